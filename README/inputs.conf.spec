@@ -3,4 +3,7 @@
 
 port = <number>
 sourcetype = <value>
-index = <value>
\ No newline at end of file
+index = <value>
+output = <stdout|stream>
+* stdout (default) writes events through the modular input, stream writes them to splunkd's
+  streaming receiver over long lived sockets
\ No newline at end of file
@@ -0,0 +1,172 @@
+import httplib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+import benchutil
+from make_corpus import load_corpus
+
+"""Measures requests/sec and latency percentiles of a gateway's /write endpoint.
+
+    python bench/bench_gateway.py [--server tornado|cherrypy] [--corpus NAME] [--batch LINES]
+                                  [--concurrency N] [--duration SECONDS] [--sink-latency-ms MS]
+                                  [--sink-error-rate FRACTION] [--output FILE]
+
+The gateway runs in a subprocess and forwards to bench/fake_hec.py, also in a subprocess, so
+neither competes with the client threads for the GIL.  --sink-latency-ms and --sink-error-rate
+are passed through to the fake HEC.  The CherryPy gateway depends on Splunk's
+bundled python (splunk cmd python bench/bench_gateway.py --server cherrypy).  Results are
+stored as JSON in bench/results for comparison across commits with bench/compare.py."""
+
+def _wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('nothing listening on port %d after %ss' % (port, timeout))
+
+def _run_cherrypy(port, sink_port):
+    '''
+    Serve cherrypy_webserver's routes, forwarding each batch to the sink like the HEC path does
+    '''
+    from cherrypy import wsgiserver
+    import cherrypy_webserver
+
+    def forward(events):
+        body = ''.join(json.dumps({ 'time': x['timestamp'], 'event': x }) for x in events)
+        conn = httplib.HTTPConnection('127.0.0.1', sink_port)
+        conn.request('POST', '/services/collector', body, { 'Authorization': 'Splunk bench' })
+        conn.getresponse().read()
+        conn.close()
+
+    cherrypy_webserver.write_events_callback = forward
+    dispatch = wsgiserver.WSGIPathInfoDispatcher({ '/write': cherrypy_webserver.handle_write,
+                                                   '/query': cherrypy_webserver.handle_query })
+    wsgiserver.CherryPyWSGIServer(('127.0.0.1', port), dispatch).start()
+
+def start_servers(server, port, sink_port, sink_args=()):
+    procs = [ subprocess.Popen([ sys.executable, os.path.join(benchutil.BENCH_DIR, 'fake_hec.py'),
+                                 '--port', str(sink_port) ] + list(sink_args)) ]
+    _wait_for_port(sink_port)
+    if server == 'tornado':
+        env = dict(os.environ)
+        env.update({ 'PORT': str(port), 'INFLUX_PORT': str(port),
+                     'SPLUNK_URL': 'http://127.0.0.1:%d/services/collector' % sink_port,
+                     'SPLUNK_TOKEN': 'bench' })
+        procs.append(subprocess.Popen([ sys.executable, os.path.join(benchutil.BIN_DIR, 'tornado_webserver.py') ], env=env))
+    else:
+        procs.append(subprocess.Popen([ sys.executable, os.path.abspath(__file__), '--cherrypy-gateway', str(port), str(sink_port) ]))
+    _wait_for_port(port)
+    return procs
+
+def make_batches(content, batch):
+    '''
+    Split a corpus into bodies of batch events, respecting quoted newlines
+    '''
+    from influxdb_common import parse_influx
+    points = len(parse_influx(content))
+    # Corpus generators put a timestamp at the end of every event, so splitting on newlines which
+    # follow a digit never breaks inside a quoted string
+    events = [ ]
+    start = 0
+    for x in xrange(len(content)):
+        if content[x] == '\n' and content[x-1:x].isdigit():
+            events.append(content[start:x])
+            start = x + 1
+    events.append(content[start:])
+    assert len(events) == points
+    return [ '\n'.join(events[x:x+batch]) for x in xrange(0, len(events), batch) ]
+
+def _client(port, bodies, deadline, latencies, errors):
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    x = 0
+    while time.time() < deadline:
+        body = bodies[x % len(bodies)]
+        x += 1
+        start = time.time()
+        try:
+            conn.request('POST', '/write', body)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 204:
+                errors.append(response.status)
+        except (httplib.HTTPException, socket.error) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = httplib.HTTPConnection('127.0.0.1', port)
+            continue
+        latencies.append(time.time() - start)
+    conn.close()
+
+def bench_gateway(server, corpus, batch, concurrency, duration, port, sink_port, sink_args=()):
+    bodies = make_batches(load_corpus(corpus), batch)
+    procs = start_servers(server, port, sink_port, sink_args)
+    try:
+        latencies = [ ]
+        errors = [ ]
+        deadline = time.time() + duration
+        threads = [ threading.Thread(target=_client, args=(port, bodies, deadline, latencies, errors))
+                    for x in xrange(concurrency) ]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+        conn = httplib.HTTPConnection('127.0.0.1', sink_port)
+        conn.request('GET', '/stats')
+        sink = json.loads(conn.getresponse().read())
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+    result = { 'server': server,
+               'corpus': corpus,
+               'batch': batch,
+               'concurrency': concurrency,
+               'requests': len(latencies),
+               'errors': len(errors),
+               'requests_per_sec': round(len(latencies) / elapsed, 1),
+               'points_per_sec': round(len(latencies) * batch / elapsed, 1),
+               'sink_events': sink['events'],
+               'sink_requests': sink['requests'],
+               'sink_errors_injected': sink['errors_injected'],
+               'sink_throttled': sink['throttled'] }
+    result.update(benchutil.latency_summary(latencies))
+    return result
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--server', default='tornado', choices=('tornado', 'cherrypy'))
+    parser.add_option('--corpus', default='telegraf')
+    parser.add_option('--batch', type='int', default=500)
+    parser.add_option('--concurrency', type='int', default=4)
+    parser.add_option('--duration', type='float', default=10.0)
+    parser.add_option('--port', type='int', default=18086)
+    parser.add_option('--sink-port', type='int', default=18088)
+    parser.add_option('--sink-latency-ms', type='float', default=0.0)
+    parser.add_option('--sink-error-rate', type='float', default=0.0)
+    parser.add_option('--output')
+    # Internal, used to run the cherrypy gateway subprocess
+    parser.add_option('--cherrypy-gateway', type='int', nargs=2)
+    (options, args) = parser.parse_args()
+
+    if options.cherrypy_gateway:
+        return _run_cherrypy(*options.cherrypy_gateway)
+
+    sink_args = [ '--latency-ms', str(options.sink_latency_ms), '--error-rate', str(options.sink_error_rate) ]
+    result = bench_gateway(options.server, options.corpus, options.batch, options.concurrency,
+                           options.duration, options.port, options.sink_port, sink_args)
+    print json.dumps(result, indent=2, sort_keys=True)
+    print 'results written to %s' % benchutil.save_results('gateway-%s' % options.server, result, options.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import gc
+import sys
+import time
+from optparse import OptionParser
+
+import benchutil
+from make_corpus import CORPORA, load_corpus
+from influxdb_common import parse_influx, parse_influx_columnar
+
+"""Measures parse_influx throughput over the committed corpora.
+
+    python bench/bench_parser.py [--repeat N] [--corpus NAME] [--columnar] [--output FILE]
+
+Reports the best of N runs per corpus as lines/sec and bytes/sec and stores the results
+as JSON in bench/results for comparison across commits with bench/compare.py.  --columnar
+benchmarks parse_influx_columnar instead of parse_influx."""
+
+def bench_corpus(name, repeat, parse=parse_influx):
+    content = load_corpus(name)
+    # Warm up, and make sure every line in the corpus parses
+    points = len(parse(content))
+    best = None
+    for x in xrange(repeat):
+        gc.collect()
+        start = time.time()
+        parse(content)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return { 'points': points,
+             'bytes': len(content),
+             'seconds': round(best, 6),
+             'lines_per_sec': round(points / best, 1),
+             'bytes_per_sec': round(len(content) / best, 1) }
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--corpus', action='append', default=[ ])
+    parser.add_option('--columnar', action='store_true', default=False)
+    parser.add_option('--output')
+    (options, args) = parser.parse_args()
+    parse = parse_influx_columnar if options.columnar else parse_influx
+
+    results = { }
+    for (name, fn) in CORPORA:
+        if options.corpus and name not in options.corpus:
+            continue
+        results[name] = bench_corpus(name, options.repeat, parse)
+        print '%-18s %8d lines %10.1f lines/sec %12.1f bytes/sec' % (name, results[name]['points'],
+            results[name]['lines_per_sec'], results[name]['bytes_per_sec'])
+    print 'results written to %s' % benchutil.save_results('columnar' if options.columnar else 'parser', results, options.output)
+
+if __name__ == '__main__':
+    main()
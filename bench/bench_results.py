@@ -0,0 +1,108 @@
+import gc
+import json
+import time
+from optparse import OptionParser
+
+import benchutil
+from splunklib import results
+
+"""Measures splunklib's search result readers on export streams of many rows.
+
+    python bench/bench_results.py [--rows N] [--xml-rows N] [--reader xml|json|both] [--output FILE]
+
+Each reader parses a stream shaped like search/jobs/export's output for its output_mode, XML
+for ResultsReader and newline-delimited JSON for JSONResultsReader, of --rows results with
+the fields the gateway's searches return.  The stream repeats one pre-rendered block of rows
+so generating it costs next to nothing and the whole export is never held in memory.
+Both readers read their stream in chunks (ResultsReader in iterparse's 16KB reads through its
+DTD filter), but building ElementTree elements still makes the XML reader the slower one, so
+it gets a smaller export, --xml-rows; compare rows_per_sec."""
+
+FIELDS = [ '_time', 'tags.host', 'tags.cpu', 'c0', 'c1', 'influx_time' ]
+
+BLOCK_ROWS = 1000
+
+def _row(x):
+    return { '_time': '2015-06-26T23:43:09.000+00:00',
+             'tags.host': 'server%02d' % (x % 50),
+             'tags.cpu': 'cpu%d' % (x % 8),
+             'c0': '%.6f' % (x * 0.37),
+             'c1': str(x % 1000),
+             'influx_time': str(1435362189 + x) }
+
+def xml_export(rows):
+    header = ("<?xml version='1.0' encoding='UTF-8'?>\n<results preview='0'>\n<meta>\n<fieldOrder>\n" +
+              ''.join('<field>%s</field>\n' % f for f in FIELDS) + '</fieldOrder>\n</meta>\n')
+    block = ''.join("<result offset='%d'>\n" % x +
+                    ''.join("<field k='%s'>\n<value><text>%s</text></value>\n</field>\n" % (f, v)
+                            for (f, v) in sorted(_row(x).items())) + '</result>\n'
+                    for x in xrange(BLOCK_ROWS))
+    return _RepeatedStream(header, block, rows // BLOCK_ROWS, '</results>\n')
+
+def json_export(rows):
+    block = ''.join(json.dumps({ 'preview': False, 'offset': x, 'result': _row(x) }, separators=(',', ':')) + '\n'
+                    for x in xrange(BLOCK_ROWS))
+    return _RepeatedStream('', block, rows // BLOCK_ROWS, '')
+
+class _RepeatedStream(object):
+    '''
+    A readable stream of header, block repeated count times, then footer
+    '''
+    def __init__(self, header, block, count, footer):
+        self.parts = [ header ] + [ block ] * count + [ footer ]
+        self.bytes = sum(len(p) for p in self.parts)
+        self.x = 0
+        self.offset = 0
+
+    def read(self, n=None):
+        out = [ ]
+        while self.x < len(self.parts) and (n is None or n > 0):
+            part = self.parts[self.x]
+            end = len(part) if n is None else min(len(part), self.offset + n)
+            out.append(part[self.offset:end])
+            if n is not None:
+                n -= end - self.offset
+            if end == len(part):
+                (self.x, self.offset) = (self.x + 1, 0)
+            else:
+                self.offset = end
+        return ''.join(out)
+
+READERS = { 'xml': (results.ResultsReader, xml_export),
+            'json': (results.JSONResultsReader, json_export) }
+
+def bench_reader(name, rows):
+    (reader, export) = READERS[name]
+    stream = export(rows)
+    gc.collect()
+    start = time.time()
+    count = 0
+    for result in reader(stream):
+        if isinstance(result, dict):
+            count += 1
+    elapsed = time.time() - start
+    assert count == rows // BLOCK_ROWS * BLOCK_ROWS, count
+    return { 'rows': count,
+             'bytes': stream.bytes,
+             'seconds': round(elapsed, 3),
+             'rows_per_sec': round(count / elapsed, 1),
+             'bytes_per_sec': round(stream.bytes / elapsed, 1) }
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--rows', type='int', default=2000000)
+    parser.add_option('--xml-rows', type='int', default=100000)
+    parser.add_option('--reader', default='both', choices=('xml', 'json', 'both'))
+    parser.add_option('--output')
+    (options, args) = parser.parse_args()
+
+    results = { }
+    for name in ('xml', 'json'):
+        if options.reader in (name, 'both'):
+            results[name] = bench_reader(name, options.xml_rows if name == 'xml' else options.rows)
+            print '%-5s %9d rows %8.2fs %12.1f rows/sec %14.1f bytes/sec' % (name, results[name]['rows'],
+                results[name]['seconds'], results[name]['rows_per_sec'], results[name]['bytes_per_sec'])
+    print 'results written to %s' % benchutil.save_results('results', results, options.output)
+
+if __name__ == '__main__':
+    main()
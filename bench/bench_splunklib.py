@@ -0,0 +1,96 @@
+import httplib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+import benchutil
+from bench_gateway import _wait_for_port
+from splunklib import binding
+
+"""Measures REST calls/sec and latency percentiles of splunklib's request handlers against
+bench/fake_splunkd.py.
+
+    python bench/bench_splunklib.py [--handler default|pooled|both] [--concurrency N]
+                                    [--duration SECONDS] [--idle-timeout SECONDS] [--output FILE]
+
+Each client thread calls GET server/info through a binding.Context in a loop.  The default
+handler opens a connection per call, pooled_handler reuses keep-alive connections; the stand-in
+counts the TCP connections each run opened.  --idle-timeout makes the stand-in close idle
+connections, to measure the pooled handler's stale connection retry.  The stand-in speaks plain
+HTTP, so the TLS handshakes a pooled handler saves against a real splunkd aren't counted."""
+
+def _client(context, deadline, latencies, errors):
+    while time.time() < deadline:
+        start = time.time()
+        try:
+            context.get('server/info').body.read()
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        latencies.append(time.time() - start)
+
+def _stats(port, method='GET'):
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    conn.request(method, '/stats' if method == 'GET' else '/stats/reset')
+    stats = json.loads(conn.getresponse().read())
+    conn.close()
+    return stats
+
+def bench_handler(name, concurrency, duration, port, idle_timeout):
+    request = binding.pooled_handler() if name == 'pooled' else binding.handler()
+    context = binding.Context(handler=request, scheme='http', host='127.0.0.1', port=port,
+                              token='Splunk bench')
+    # The stats request counts as one connection
+    _stats(port, 'POST')
+    latencies = [ ]
+    errors = [ ]
+    deadline = time.time() + duration
+    threads = [ threading.Thread(target=_client, args=(context, deadline, latencies, errors))
+                for x in xrange(concurrency) ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    stats = _stats(port)
+    result = { 'handler': name,
+               'concurrency': concurrency,
+               'idle_timeout': idle_timeout,
+               'requests': len(latencies),
+               'errors': len(errors),
+               'requests_per_sec': round(len(latencies) / elapsed, 1),
+               'connections': stats['connections'] - 1 }
+    result.update(benchutil.latency_summary(latencies))
+    return result
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--handler', default='both', choices=('default', 'pooled', 'both'))
+    parser.add_option('--concurrency', type='int', default=4)
+    parser.add_option('--duration', type='float', default=10.0)
+    parser.add_option('--idle-timeout', type='float', default=3600.0)
+    parser.add_option('--port', type='int', default=18089)
+    parser.add_option('--output')
+    (options, args) = parser.parse_args()
+
+    proc = subprocess.Popen([ sys.executable, os.path.join(benchutil.BENCH_DIR, 'fake_splunkd.py'),
+                              '--port', str(options.port), '--idle-timeout', str(options.idle_timeout) ])
+    try:
+        _wait_for_port(options.port)
+        handlers = ('default', 'pooled') if options.handler == 'both' else (options.handler,)
+        results = dict((name, bench_handler(name, options.concurrency, options.duration, options.port,
+                                            options.idle_timeout))
+                       for name in handlers)
+    finally:
+        proc.terminate()
+        proc.wait()
+    print json.dumps(results, indent=2, sort_keys=True)
+    print 'results written to %s' % benchutil.save_results('splunklib', results, options.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+"""Helpers shared by the benchmarks: result files, percentiles and locating the gateway sources."""
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BIN_DIR = os.path.join(ROOT_DIR, 'bin')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+if BIN_DIR not in sys.path:
+    sys.path.insert(0, BIN_DIR)
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def percentile(values, pct):
+    '''
+    Nearest rank percentile of an already sorted list
+    '''
+    if not values:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+def latency_summary(latencies):
+    '''
+    Summarize a list of latencies in seconds as milliseconds
+    '''
+    latencies = sorted(latencies)
+    out = { }
+    for pct in (50, 90, 99, 99.9):
+        out['p%s_ms' % pct] = round(percentile(latencies, pct) * 1000, 3)
+    out['max_ms'] = round(latencies[-1] * 1000, 3) if latencies else 0.0
+    return out
+
+def save_results(kind, results, path=None):
+    '''
+    Write results as JSON, by default to bench/results/<kind>-<commit>.json, and return the path
+    '''
+    commit = git_commit()
+    doc = { 'kind': kind,
+            'commit': commit,
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results }
+    if path is None:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        path = os.path.join(RESULTS_DIR, '%s-%s.json' % (kind, commit))
+    with open(path, 'w') as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+    return path
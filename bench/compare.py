@@ -0,0 +1,50 @@
+import json
+import sys
+from optparse import OptionParser
+
+"""Compares two benchmark result files, typically from two commits.
+
+    python bench/compare.py bench/results/parser-abc1234.json bench/results/parser-def5678.json
+
+Throughput metrics (*_per_sec) regress when they drop, latency metrics (*_ms) regress when
+they rise.  Exits 1 if any metric regressed by more than --threshold percent."""
+
+def _flatten(results, prefix=''):
+    out = { }
+    for (k, v) in results.items():
+        if isinstance(v, dict):
+            out.update(_flatten(v, prefix + k + '.'))
+        elif isinstance(v, (int, long, float)) and (k.endswith('_per_sec') or k.endswith('_ms')):
+            out[prefix + k] = v
+    return out
+
+def compare(old, new, threshold):
+    old_metrics = _flatten(old['results'])
+    new_metrics = _flatten(new['results'])
+    regressions = 0
+    print '%-40s %14s %14s %9s' % ('metric (%s -> %s)' % (old['commit'], new['commit']), 'old', 'new', 'change')
+    for name in sorted(set(old_metrics) & set(new_metrics)):
+        (a, b) = (old_metrics[name], new_metrics[name])
+        change = (b - a) * 100.0 / a if a else 0.0
+        worse = -change if name.endswith('_per_sec') else change
+        flag = ''
+        if worse > threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+        print '%-40s %14.1f %14.1f %+8.1f%%%s' % (name, a, b, change, flag)
+    return regressions
+
+def main():
+    parser = OptionParser(usage='%prog OLD.json NEW.json')
+    parser.add_option('--threshold', type='float', default=5.0)
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error('expected two result files')
+    with open(args[0]) as f:
+        old = json.load(f)
+    with open(args[1]) as f:
+        new = json.load(f)
+    sys.exit(1 if compare(old, new, options.threshold) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import gzip
+import json
+import random
+import time
+from StringIO import StringIO
+from optparse import OptionParser
+
+import tornado.gen
+import tornado.ioloop
+import tornado.web
+
+"""Stand-in for Splunk's HTTP Event Collector, for load testing the gateways offline.
+
+    python bench/fake_hec.py [--port 8088] [--token TOKEN] [--latency-ms MS] [--jitter-ms MS]
+                             [--error-rate FRACTION] [--max-rps N] [--max-inflight N]
+
+Serves /services/collector (and /event), /services/collector/raw and /services/collector/health
+with HEC's response bodies and codes.  Every event is counted exactly: event endpoint bodies are
+decoded as concatenated JSON objects, raw bodies are counted by line.  Latency, random errors and
+throttling can be injected to exercise a gateway's retry, pooling and batching behaviour.
+
+GET /stats returns the counters as JSON, POST /stats/reset zeroes them.  GET /config shows the
+injection settings and PUT /config with a JSON object changes them on a running server."""
+
+SUCCESS = (200, { 'text': 'Success', 'code': 0 })
+TOKEN_REQUIRED = (401, { 'text': 'Token is required', 'code': 2 })
+INVALID_TOKEN = (403, { 'text': 'Invalid token', 'code': 4 })
+NO_DATA = (400, { 'text': 'No data', 'code': 5 })
+INVALID_FORMAT = (400, { 'text': 'Invalid data format', 'code': 6 })
+INTERNAL_ERROR = (500, { 'text': 'Internal server error', 'code': 8 })
+SERVER_BUSY = (503, { 'text': 'Server is busy', 'code': 9 })
+HEALTHY = (200, { 'text': 'HEC is healthy', 'code': 17 })
+
+class Config(object):
+    '''
+    Injection settings, mutable at runtime through PUT /config
+    '''
+    def __init__(self, token=None, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, max_rps=0, max_inflight=0):
+        self.token = token
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.max_inflight = max_inflight
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+class Stats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.requests = 0
+        self.events = 0
+        self.bytes = 0
+        self.by_endpoint = { }
+        self.errors_injected = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.inflight = 0
+        self.max_inflight_seen = 0
+
+    def as_dict(self):
+        out = dict(self.__dict__)
+        out['elapsed'] = time.time() - self.started
+        return out
+
+def count_events(body):
+    '''
+    Count the JSON objects in an event endpoint body, which HEC accepts concatenated with or
+    without whitespace between them.  Raises ValueError on malformed data.
+    '''
+    decoder = json.JSONDecoder()
+    count = 0
+    x = 0
+    end = len(body)
+    while True:
+        while x < end and body[x] in ' \t\r\n':
+            x += 1
+        if x >= end:
+            return count
+        (obj, x) = decoder.raw_decode(body, x)
+        if not isinstance(obj, dict) or 'event' not in obj:
+            raise ValueError('event field missing')
+        count += 1
+
+def count_raw(body):
+    return len([ line for line in body.split('\n') if line.strip() ])
+
+class _RateLimiter(object):
+    '''
+    Token bucket allowing rate requests per second with a burst of one second
+    '''
+    def __init__(self):
+        self.tokens = float('inf')
+        self.last = time.time()
+
+    def allow(self, rate):
+        now = time.time()
+        self.tokens = min(float(rate), self.tokens + (now - self.last) * rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class CollectorHandler(tornado.web.RequestHandler):
+    def initialize(self, config, stats, limiter, counter):
+        self.config = config
+        self.stats = stats
+        self.limiter = limiter
+        self.counter = counter
+
+    def reply(self, response):
+        (status, body) = response
+        self.set_status(status)
+        self.write(body)
+
+    @tornado.gen.coroutine
+    def post(self, *args):
+        config = self.config
+        stats = self.stats
+        stats.requests += 1
+        stats.inflight += 1
+        stats.max_inflight_seen = max(stats.max_inflight_seen, stats.inflight)
+        try:
+            if config.token:
+                auth = self.request.headers.get('Authorization')
+                if auth != 'Splunk %s' % config.token:
+                    stats.rejected += 1
+                    self.reply(INVALID_TOKEN if auth else TOKEN_REQUIRED)
+                    return
+            if (config.max_inflight and stats.inflight > config.max_inflight) \
+                    or (config.max_rps and not self.limiter.allow(config.max_rps)):
+                stats.throttled += 1
+                self.reply(SERVER_BUSY)
+                return
+            if config.latency_ms or config.jitter_ms:
+                yield tornado.gen.sleep((config.latency_ms + random.uniform(0, config.jitter_ms)) / 1000.0)
+            if config.error_rate and random.random() < config.error_rate:
+                stats.errors_injected += 1
+                self.reply(INTERNAL_ERROR)
+                return
+
+            body = self.request.body
+            if self.request.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=StringIO(body)).read()
+            if not body.strip():
+                stats.rejected += 1
+                self.reply(NO_DATA)
+                return
+            try:
+                events = self.counter(body)
+            except ValueError:
+                stats.rejected += 1
+                self.reply(INVALID_FORMAT)
+                return
+            stats.events += events
+            stats.bytes += len(body)
+            endpoint = self.request.path
+            stats.by_endpoint[endpoint] = stats.by_endpoint.get(endpoint, 0) + events
+            self.reply(SUCCESS)
+        finally:
+            stats.inflight -= 1
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self, *args):
+        (status, body) = HEALTHY
+        self.set_status(status)
+        self.write(body)
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, config, stats):
+        self.config = config
+        self.stats = stats
+
+    def get(self):
+        self.write(self.stats.as_dict())
+
+    def post(self):
+        self.stats.reset()
+        self.write(self.stats.as_dict())
+
+class ConfigHandler(tornado.web.RequestHandler):
+    def initialize(self, config, stats):
+        self.config = config
+
+    def get(self):
+        self.write(self.config.as_dict())
+
+    def put(self):
+        for (k, v) in json.loads(self.request.body).items():
+            if hasattr(self.config, k):
+                setattr(self.config, k, v)
+        self.write(self.config.as_dict())
+
+def make_app(config=None, stats=None):
+    config = config or Config()
+    stats = stats or Stats()
+    limiter = _RateLimiter()
+    event_args = dict(config=config, stats=stats, limiter=limiter, counter=count_events)
+    raw_args = dict(config=config, stats=stats, limiter=limiter, counter=count_raw)
+    admin_args = dict(config=config, stats=stats)
+    return tornado.web.Application([
+        (r"/services/collector/health(/1\.0)?", HealthHandler),
+        (r"/services/collector/raw(/1\.0)?", CollectorHandler, raw_args),
+        (r"/services/collector(/event)?(/1\.0)?", CollectorHandler, event_args),
+        (r"/stats/reset", StatsHandler, admin_args),
+        (r"/stats", StatsHandler, admin_args),
+        (r"/config", ConfigHandler, admin_args)
+    ])
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--port', type='int', default=8088)
+    parser.add_option('--address', default='127.0.0.1')
+    parser.add_option('--token')
+    parser.add_option('--latency-ms', type='float', default=0.0)
+    parser.add_option('--jitter-ms', type='float', default=0.0)
+    parser.add_option('--error-rate', type='float', default=0.0)
+    parser.add_option('--max-rps', type='float', default=0)
+    parser.add_option('--max-inflight', type='int', default=0)
+    (options, args) = parser.parse_args()
+
+    config = Config(options.token, options.latency_ms, options.jitter_ms, options.error_rate,
+                    options.max_rps, options.max_inflight)
+    make_app(config).listen(options.port, options.address)
+    tornado.ioloop.IOLoop.current().start()
+
+if __name__ == '__main__':
+    main()
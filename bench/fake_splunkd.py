@@ -0,0 +1,215 @@
+import gzip
+import json
+import math
+import time
+from StringIO import StringIO
+from optparse import OptionParser
+
+import tornado.gen
+import tornado.httpserver
+import tornado.ioloop
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+"""Stand-in for splunkd's REST API, for benchmarking splunklib offline.
+
+    python bench/fake_splunkd.py [--port 8089] [--idle-timeout SECONDS] [--latency-ms MS]
+                                 [--export-step SECONDS] [--export-rate ROWS]
+
+Serves /services/auth/login and /services/server/info with splunkd's response bodies, and
+/services/receivers/simple, counting each line posted to it as an event, over
+HTTP/1.1 keep-alive connections which are closed after --idle-timeout seconds idle, as splunkd
+closes them, so a client's connection reuse and stale connection handling can be measured.
+
+/services/search/jobs/export streams, in XML or JSON by output_mode, one result per
+--export-step seconds between earliest_time and latest_time in time order (newest first if
+the search sorts by -influx_time, as the gateway's descending searches do), at no more than
+--export-rate rows/sec per search, like one search pipeline's throughput.
+
+Each login returns a new session key, session-N.  Requests made with one of these which has
+been expired by POST /sessions/expire are refused with 401, as splunkd refuses an expired
+session; any other Authorization is accepted.
+
+GET /stats returns the number of requests, logins, events and TCP connections accepted as JSON,
+POST /stats/reset zeroes them."""
+
+LOGIN = '<response>\n<sessionKey>%s</sessionKey>\n</response>\n'
+
+SERVER_INFO = '''<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:s="http://dev.splunk.com/ns/rest">
+  <title>server-info</title>
+  <id>https://127.0.0.1:8089/services/server/info</id>
+  <updated>2015-01-01T00:00:00+00:00</updated>
+  <entry>
+    <title>server-info</title>
+    <id>https://127.0.0.1:8089/services/server/info/server-info</id>
+    <updated>2015-01-01T00:00:00+00:00</updated>
+    <link href="/services/server/info/server-info" rel="alternate"/>
+    <content type="text/xml">
+      <s:dict>
+        <s:key name="build">bench</s:key>
+        <s:key name="serverName">fake-splunkd</s:key>
+        <s:key name="version">6.3.0</s:key>
+      </s:dict>
+    </content>
+  </entry>
+</feed>
+'''
+
+class Stats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.requests = 0
+        self.logins = 0
+        self.sessions = set()
+        self.events = 0
+        self.bytes = 0
+        self.connections = 0
+
+    def as_dict(self):
+        out = dict(self.__dict__)
+        del out['sessions']
+        out['elapsed'] = time.time() - self.started
+        return out
+
+class CountingServer(tornado.httpserver.HTTPServer):
+    def initialize(self, request_callback, stats=None, **kwargs):
+        self.stats = stats
+        super(CountingServer, self).initialize(request_callback, **kwargs)
+
+    def handle_stream(self, stream, address):
+        self.stats.connections += 1
+        super(CountingServer, self).handle_stream(stream, address)
+
+class SplunkdHandler(tornado.web.RequestHandler):
+    def initialize(self, stats, latency):
+        self.stats = stats
+        self.latency = latency
+
+    def prepare(self):
+        self.stats.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        key = self.request.headers.get('Authorization', '')[len('Splunk '):]
+        if key.startswith('session-') and key not in self.stats.sessions:
+            self.set_status(401)
+            self.finish('<response><messages><msg type="WARN">call not properly authenticated</msg></messages></response>\n')
+
+class LoginHandler(SplunkdHandler):
+    def post(self):
+        self.stats.logins += 1
+        key = 'session-%d' % self.stats.logins
+        self.stats.sessions.add(key)
+        self.set_header('Content-Type', 'text/xml; charset=utf-8')
+        self.write(LOGIN % key)
+
+class ServerInfoHandler(SplunkdHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/xml; charset=utf-8')
+        self.write(SERVER_INFO)
+
+class ReceiverHandler(SplunkdHandler):
+    def post(self):
+        body = self.request.body
+        if self.request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=StringIO(body)).read()
+        self.stats.events += len([ line for line in body.split('\n') if line.strip() ])
+        self.stats.bytes += len(body)
+        self.set_header('Content-Type', 'text/xml; charset=utf-8')
+        self.write('<response><results><result><field k="_raw">bench</field></result></results></response>\n')
+
+class ExportHandler(SplunkdHandler):
+    def initialize(self, stats, latency, step=1.0, rate=20000.0):
+        SplunkdHandler.initialize(self, stats, latency)
+        self.step = step
+        self.rate = rate
+
+    @tornado.gen.coroutine
+    def post(self):
+        args = dict((k, self.get_body_argument(k, None)) for k in ('earliest_time', 'latest_time', 'output_mode'))
+        earliest = float(args['earliest_time'] or 0)
+        latest = float(args['latest_time'] or earliest + 3600)
+        xml = args['output_mode'] != 'json'
+        times = xrange(int(math.ceil(earliest / self.step)), int(math.ceil(latest / self.step)))
+        if '-influx_time' in (self.get_body_argument('search', None) or ''):
+            times = reversed(times)
+        times = iter(times)
+        batch = 500
+        if xml:
+            self.write("<?xml version='1.0' encoding='UTF-8'?>\n<results preview='0'>\n<meta></meta>\n")
+        while True:
+            out = [ ]
+            for x in times:
+                t = x * self.step
+                result = { '_time': '%.3f' % t, 'influx_time': '%.3f' % t, 'c0': '%.6f' % math.sin(t) }
+                if xml:
+                    out.append("<result offset='0'>" + ''.join("<field k='%s'><value><text>%s</text></value></field>" % kv
+                                                              for kv in sorted(result.items())) + '</result>\n')
+                else:
+                    out.append(json.dumps({ 'preview': False, 'offset': 0, 'result': result }) + '\n')
+                if len(out) == batch:
+                    break
+            if not out:
+                break
+            self.write(''.join(out))
+            try:
+                yield self.flush()
+            except StreamClosedError:
+                # The client stopped reading
+                return
+            yield tornado.gen.sleep(len(out) / self.rate)
+        if xml:
+            self.write('</results>\n')
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, stats):
+        self.stats = stats
+
+    def get(self):
+        self.write(self.stats.as_dict())
+
+    def post(self):
+        self.stats.reset()
+        self.write(self.stats.as_dict())
+
+class SessionsHandler(tornado.web.RequestHandler):
+    def initialize(self, stats):
+        self.stats = stats
+
+    def post(self):
+        self.stats.sessions.clear()
+
+def make_app(stats, latency=0.0, export_step=1.0, export_rate=20000.0):
+    args = dict(stats=stats, latency=latency)
+    return tornado.web.Application([
+        (r"/services/auth/login", LoginHandler, args),
+        (r"/services/server/info", ServerInfoHandler, args),
+        (r"/services/receivers/simple", ReceiverHandler, args),
+        (r"/services/search/jobs/export", ExportHandler, dict(args, step=export_step, rate=export_rate)),
+        (r"/sessions/expire", SessionsHandler, dict(stats=stats)),
+        (r"/stats/reset", StatsHandler, dict(stats=stats)),
+        (r"/stats", StatsHandler, dict(stats=stats))
+    ])
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--port', type='int', default=8089)
+    parser.add_option('--address', default='127.0.0.1')
+    parser.add_option('--idle-timeout', type='float', default=3600.0)
+    parser.add_option('--latency-ms', type='float', default=0.0)
+    parser.add_option('--export-step', type='float', default=1.0)
+    parser.add_option('--export-rate', type='float', default=20000.0)
+    (options, args) = parser.parse_args()
+
+    stats = Stats()
+    app = make_app(stats, options.latency_ms / 1000.0, options.export_step, options.export_rate)
+    server = CountingServer(app, stats=stats,
+                            idle_connection_timeout=options.idle_timeout)
+    server.listen(options.port, options.address)
+    tornado.ioloop.IOLoop.current().start()
+
+if __name__ == '__main__':
+    main()
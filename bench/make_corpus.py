@@ -0,0 +1,97 @@
+import os
+import random
+import sys
+
+"""Generates the line protocol corpora used by the benchmarks into bench/corpus.
+
+The generator is seeded so the committed corpus can always be rebuilt byte for byte:
+
+    python bench/make_corpus.py [lines per corpus]"""
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+SEED = 8086
+LINES = 2000
+BASE_TS = 1435362189575692182
+
+def _telegraf(rnd, lines):
+    '''
+    cpu, mem and disk lines shaped like Telegraf's default inputs
+    '''
+    hosts = [ 'web%02d' % x for x in xrange(8) ]
+    out = [ ]
+    ts = BASE_TS
+    while len(out) < lines:
+        host = rnd.choice(hosts)
+        for cpu in xrange(4):
+            out.append('cpu,cpu=cpu%d,host=%s usage_user=%.6f,usage_system=%.6f,usage_idle=%.6f,usage_iowait=%.6f,usage_steal=0 %d'
+                       % (cpu, host, rnd.uniform(0, 60), rnd.uniform(0, 20), rnd.uniform(20, 100), rnd.uniform(0, 5), ts))
+        total = 16 * 1024 ** 3
+        used = rnd.randint(1024 ** 3, total)
+        out.append('mem,host=%s total=%di,used=%di,available=%di,used_percent=%.6f %d'
+                   % (host, total, used, total - used, used * 100.0 / total, ts))
+        for (device, path) in (('sda1', '/'), ('sdb1', '/var/lib/docker')):
+            total = 500 * 1024 ** 3
+            used = rnd.randint(0, total)
+            out.append('disk,device=%s,fstype=ext4,host=%s,path=%s free=%di,used=%di,total=%di,used_percent=%.6f,inodes_free=%di %d'
+                       % (device, host, path, total - used, used, total, used * 100.0 / total, rnd.randint(0, 10 ** 7), ts))
+        ts += 10 ** 10
+    return out[:lines]
+
+def _high_cardinality(rnd, lines):
+    '''
+    Every line is a new series, container ids and request ids make tags unique
+    '''
+    out = [ ]
+    for x in xrange(lines):
+        out.append('http_requests,host=node%04d,pod=api-%08x,container_id=%032x,route=/v1/items/%d,status=%d duration_ms=%.3f,bytes=%di %d'
+                   % (rnd.randint(0, 999), rnd.getrandbits(32), rnd.getrandbits(128), rnd.randint(0, 5000),
+                      rnd.choice((200, 200, 200, 204, 404, 500)), rnd.uniform(0.1, 900), rnd.randint(0, 10 ** 6), BASE_TS + x))
+    return out
+
+def _escaped_strings(rnd, lines):
+    '''
+    Escaped spaces, commas and equals in keys and tags, long string fields with escaped quotes
+    '''
+    words = [ 'alpha', 'beta', 'gamma', 'delta', 'C:\\\\Program Files', 'a,b', 'key=value', 'say \\"hi\\"' ]
+    out = [ ]
+    for x in xrange(lines):
+        message = ' '.join(rnd.choice(words) for y in xrange(rnd.randint(8, 24)))
+        out.append('app\\ log,service=billing\\ api,path=/net\\,/home,a\\=b=y\\=z message="%s",level="warn",count=%di %d'
+                   % (message, rnd.randint(0, 100), BASE_TS + x))
+    return out
+
+def _quoted_newlines(rnd, lines):
+    '''
+    String fields containing newlines, which must not split the event
+    '''
+    out = [ ]
+    for x in xrange(lines):
+        trace = '\n'.join('  at frame%d (file%d.py:%d)' % (y, rnd.randint(0, 50), rnd.randint(1, 900))
+                          for y in xrange(rnd.randint(2, 8)))
+        out.append('exceptions,host=web%02d,app=checkout stack="Traceback:\n%s",count=1i %d'
+                   % (rnd.randint(0, 20), trace, BASE_TS + x))
+    return out
+
+CORPORA = (('telegraf', _telegraf),
+           ('high_cardinality', _high_cardinality),
+           ('escaped_strings', _escaped_strings),
+           ('quoted_newlines', _quoted_newlines))
+
+def corpus_path(name):
+    return os.path.join(CORPUS_DIR, name + '.lp')
+
+def load_corpus(name):
+    with open(corpus_path(name), 'rb') as f:
+        return f.read()
+
+def main(lines=LINES):
+    if not os.path.isdir(CORPUS_DIR):
+        os.makedirs(CORPUS_DIR)
+    for (x, (name, fn)) in enumerate(CORPORA):
+        rnd = random.Random(SEED + x)
+        with open(corpus_path(name), 'wb') as f:
+            f.write('\n'.join(fn(rnd, lines)))
+        print '%s: %d lines, %d bytes' % (name, lines, os.path.getsize(corpus_path(name)))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else LINES)
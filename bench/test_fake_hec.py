@@ -0,0 +1,66 @@
+import json
+import unittest
+
+from tornado.httpserver import HTTPServer
+from tornado.testing import AsyncHTTPTestCase, bind_unused_port
+
+# Puts bin on the path
+import benchutil
+import fake_hec
+import tornado_webserver
+
+BATCH = 'cpu,host=server01 value=0.64 1435362189575692182\ncpu,host=server02 value=0.5 1435362189575692182\nmem,host=server01 used=1024i 1435362189575692182\n'
+
+class FakeHecTest(AsyncHTTPTestCase):
+    '''
+    Runs fake_hec in-process on the test's IOLoop, with the Tornado gateway forwarding to it
+    '''
+    def get_app(self):
+        return tornado_webserver.make_app()
+
+    def setUp(self):
+        super(FakeHecTest, self).setUp()
+        (sock, port) = bind_unused_port()
+        self.hec_server = HTTPServer(fake_hec.make_app(fake_hec.Config(token='secret')))
+        self.hec_server.add_sockets([ sock ])
+        self.hec_url = 'http://127.0.0.1:%d' % port
+        self.saved = dict((k, getattr(tornado_webserver, k, None)) for k in ('SPLUNK_URL', 'SPLUNK_TOKEN', 'SPLUNK_INDEX', 'SPLUNK_SOURCETYPE'))
+        tornado_webserver.SPLUNK_URL = self.hec_url + '/services/collector'
+        tornado_webserver.SPLUNK_TOKEN = 'secret'
+        tornado_webserver.SPLUNK_INDEX = 'metrics'
+        tornado_webserver.SPLUNK_SOURCETYPE = 'influx'
+
+    def tearDown(self):
+        self.hec_server.stop()
+        for (k, v) in self.saved.items():
+            setattr(tornado_webserver, k, v)
+        super(FakeHecTest, self).tearDown()
+
+    def hec_fetch(self, path, **kwargs):
+        self.http_client.fetch(self.hec_url + path, self.stop, **kwargs)
+        return json.loads(self.wait().body)
+
+    def write(self):
+        return self.fetch('/write?db=x', method='POST', body=BATCH)
+
+    def test_batch_is_counted(self):
+        self.assertEqual(self.write().code, 204)
+        stats = self.hec_fetch('/stats')
+        self.assertEqual((stats['requests'], stats['events'], stats['rejected']), (1, 3, 0))
+        self.assertEqual(stats['by_endpoint'], { '/services/collector': 3 })
+
+    def test_busy_then_retried(self):
+        # Under one request per second starts the bucket empty, so HEC answers 503.  The gateway
+        # doesn't retry itself, it fails the write so the client sends it again
+        self.hec_fetch('/config', method='PUT', body=json.dumps({ 'max_rps': 1e-9 }))
+        self.assertEqual(self.write().code, 500)
+        stats = self.hec_fetch('/stats')
+        self.assertEqual((stats['requests'], stats['throttled'], stats['events']), (1, 1, 0))
+
+        self.hec_fetch('/config', method='PUT', body=json.dumps({ 'max_rps': 0 }))
+        self.assertEqual(self.write().code, 204)
+        stats = self.hec_fetch('/stats')
+        self.assertEqual((stats['requests'], stats['throttled'], stats['events']), (2, 1, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,9 +5,16 @@ import os
 import json
 import socket
 import signal
+import types
+import urlparse
 import logging, logging.handlers
 from Cookie import SimpleCookie
 from influxdb_common import parse_influx
+import influxdb_metrics as metrics
+import influxdb_query
+import influxdb_search
+import influxdb_store
+import influxdb_trace
 import time, datetime
 
 #CORE SPLUNK IMPORTS
@@ -59,11 +66,19 @@ class HandleRequest(object):
                 end = time.time()
                 duration = int((end - start) * 100)
                 access_logger.info("%s %s '%s' - - - %sms", environ["REQUEST_METHOD"], environ.get("SCRIPT_NAME", "/"), status, duration)
+                metrics.inc('influx_http_requests_total', labels=(('handler', fn.__name__), ('code', status.split(' ', 1)[0])))
                 return start_response(status, response_headers)
 
             # print "Trying to send shit"
+            metrics.inc('influx_requests_inflight')
+            streaming = False
             try:
-                return fn(environ, wrapped_start_response)
+                body = fn(environ, wrapped_start_response)
+                if isinstance(body, types.GeneratorType):
+                    # The handler runs on as the server iterates the body, so it's in flight until the server closes it
+                    streaming = True
+                    return StreamedBody(body, lambda: metrics.dec('influx_requests_inflight'))
+                return body
             except Exception as e:
                 service_logger.exception("Internal Server Error on request='%s %s' specific error: %s", environ["REQUEST_METHOD"], environ.get("SCRIPT_NAME", "/"), str(e))
                 # print e
@@ -71,8 +86,32 @@ class HandleRequest(object):
                 response_headers = [('Content-type','text/plain')]
                 wrapped_start_response(status, response_headers)
                 return []
+            finally:
+                if not streaming:
+                    metrics.dec('influx_requests_inflight')
         return wrapped_fn
 
+class StreamedBody(object):
+    """
+    WSGI response body over a generator which calls done once, when the server closes it.  The
+    server closes the body however the response ends, even when it never starts iterating, which
+    a generator's own finally can't see.
+    """
+    def __init__(self, chunks, done):
+        self.chunks = chunks
+        self.done = done
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        done, self.done = self.done, None
+        try:
+            self.chunks.close()
+        finally:
+            if done is not None:
+                done()
+
 
 #===============================================================================
 # Utilities & Globals
@@ -92,6 +131,9 @@ def handle_write(environ, start_response):
     '''
     Interpret a write request in InfluxDB's POST format, documented here:
         https://influxdb.com/docs/v0.9/write_protocols/line.html
+    
+    Honors the precision query parameter (ns, u, ms, s, m, h), otherwise precision is inferred
+    from each timestamp.
         
     Example POSTS:
         cpu,host=server01,region=uswest value=1 1434055562000000000
@@ -100,15 +142,35 @@ def handle_write(environ, start_response):
         temperature,machine=unit143,type=assembly internal=22,external=130 1434055562005000035
     '''
     
+    received = time.time()
     response_headers = [('Content-type','text/plain')]
+    trace = influxdb_trace.start()
     try:
         service_logger.debug("in handle_write session=%s", environ)
         
         req_in = environ.get("wsgi.input", None)
         content = req_in.read(int(environ["CONTENT_LENGTH"]))
+        if trace: trace.stamp('receive')
+        metrics.observe('influx_http_request_body_bytes', len(content))
         
-        ret = parse_influx(content)
-        write_events_callback(ret)
+        precision = urlparse.parse_qs(environ.get("QUERY_STRING", "")).get("precision", [ None ])[0]
+        if influxdb_store.store is not None:
+            points = parse_influx(content, trace, points=True, precision=precision, received=received)
+            influxdb_store.store.add(points)
+            ret = [ p.as_dict() for p in points ]
+        else:
+            ret = parse_influx(content, trace, precision=precision, received=received)
+        target = (('target', getattr(write_events_callback, '__name__', 'callback')),)
+        metrics.inc('influx_forwards_inflight')
+        try:
+            with metrics.Timer('influx_forward_seconds', target):
+                write_events_callback(ret)
+        except Exception:
+            metrics.inc('influx_forward_errors_total', labels=target)
+            raise
+        finally:
+            metrics.dec('influx_forwards_inflight')
+        if trace: trace.stamp('forward')
             
         status = '204 No Content'
     except Exception as e:
@@ -116,6 +178,9 @@ def handle_write(environ, start_response):
         status = '400 Bad Request'
     
     start_response(status, response_headers)    
+    if trace:
+        trace.stamp('ack')
+        trace.finish()
     return ''
     
 def write_events(events):
@@ -125,14 +190,42 @@ def write_events(events):
     for event in events:
         print json.dumps(event)
         
+@HandleRequest(["GET", "POST"])
 def handle_query(environ, start_response):
     '''
-    Blindly return 200 OK to all queries with no data
+    Answer admin statements with canned results and SELECTs from the recent points store or
+    a Splunk search, streamed back as the results arrive
     '''
-    status = '200 OK'
-    start_response(status, [ ])
-    results = { 'results': [ ] }
-    return json.dumps(results)
+    params = urlparse.parse_qs(environ.get("QUERY_STRING", ""))
+    if environ["REQUEST_METHOD"] == "POST" and environ.get("CONTENT_TYPE", "").startswith("application/x-www-form-urlencoded"):
+        params.update(urlparse.parse_qs(environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))))
+    start_response('200 OK', influxdb_query.JSON_HEADERS)
+    return query_body(influxdb_search.query_chunks(params.get("q", [ "" ])[0], params.get("epoch", [ None ])[0]))
+
+def query_body(chunks):
+    '''
+    Stream a /query response, logging a failure part way through to the service log
+    '''
+    return influxdb_search.query_body(chunks, service_logger)
+
+@HandleRequest(["GET", "HEAD"])
+def handle_ping(environ, start_response):
+    '''
+    InfluxDB's health check, 204 with the version in the headers
+    '''
+    if urlparse.parse_qs(environ.get("QUERY_STRING", "")).get("verbose", [ "" ])[0] in ("true", "1"):
+        start_response('200 OK', influxdb_query.JSON_HEADERS)
+        return [ influxdb_query.PING_VERBOSE ]
+    start_response('204 No Content', influxdb_query.HEADERS)
+    return [ ]
+
+@HandleRequest(["GET"])
+def handle_metrics(environ, start_response):
+    '''
+    Prometheus exposition of the gateway's internal metrics
+    '''
+    start_response('200 OK', [('Content-type', metrics.CONTENT_TYPE)])
+    return [ metrics.render() ]
 
 #===============================================================================
 # Test Services
@@ -176,6 +269,8 @@ def bootstrap_web_service(port=8086, callback=write_events, service_log_level="D
     routes = {
 			'/write': handle_write,
             '/query': handle_query,
+            '/ping': handle_ping,
+            '/metrics': handle_metrics,
             '/test/static': test_static,
             '/test/echo': test_echo }
     dispatch = wsgiserver.WSGIPathInfoDispatcher(routes)
@@ -239,6 +334,9 @@ def bootstrap_web_service(port=8086, callback=write_events, service_log_level="D
 
     # print "started wsgi server %s" % host_name
 
+    # Connections accepted but waiting on a free worker thread
+    metrics.gauge('influx_requests_queued', 'Connections waiting for a worker thread', lambda: server.requests.qsize)
+
     #Bind a cache serialization to SIGTERM and SIGINT
     def signal_handler(sig, frame):
         """
@@ -3,6 +3,8 @@ import json
 
 from splunklib.modularinput import *
 from cherrypy_webserver import bootstrap_web_service
+import influxdb_search
+import influxdb_receiver
 
 class MyScript(Script):
     def get_scheme(self):
@@ -19,6 +21,13 @@ class MyScript(Script):
         port_argument.required_on_create = True
         scheme.add_argument(port_argument)
 
+        output_argument = Argument("output")
+        output_argument.title = "Output"
+        output_argument.data_type = Argument.data_type_string
+        output_argument.description = "stdout (default) to write events through this input, or stream to write them to splunkd's streaming receiver"
+        output_argument.required_on_create = False
+        scheme.add_argument(output_argument)
+
         return scheme
 
     def stream_events(self, inputs, ew):
@@ -30,11 +39,21 @@ class MyScript(Script):
         self.sourcetype = "influxdb" if "sourcetype" not in input_item else input_item["sourcetype"]
             
         self.ew = ew
+        # Answer /query SELECTs by searching the events this input writes
+        influxdb_search.configure(self.service, self.index, self.sourcetype)
+        
+        callback = self.write_events
+        if input_item.get("output") == "stream":
+            self.forwarder = influxdb_receiver.StreamForwarder(self.service)
+            callback = self.stream_events_out
         
-        server = bootstrap_web_service(self.port, self.write_events, service_log_level="INFO", access_log_level="INFO")
+        server = bootstrap_web_service(self.port, callback, service_log_level="INFO", access_log_level="INFO")
         server.start()
         
         
+    def stream_events_out(self, events):
+        self.forwarder.send(influxdb_receiver.serialize(events), self.index, self.sourcetype)
+
     def write_events(self, events):
         for x in events:
             event = Event()
@@ -1,7 +1,158 @@
 from __future__ import division
 import json
+import os
+import threading
 import time
-from math import log10
+import influxdb_metrics as metrics
+
+"""Configured via environment variables:
+
+    INFLUX_SERIES_CACHE_SIZE: (Optional) Number of parsed series keys to cache, 0 disables, default 50000
+    INFLUX_FIELD_NAME_CACHE_SIZE: (Optional) Number of measurement.field names to intern, 0 disables, default 100000
+    INFLUX_SPREAD_TIMESTAMPS: (Optional) Set to 1 to give lines without a timestamp increasing times within a batch
+    INFLUX_FIELD_TYPES: (Optional) JSON object of measurement to field to type (float, int, bool or string) to coerce fields to"""
+
+class FrozenTags(dict):
+    '''
+    Read only dict of tags.  Parsed tags are shared between every point of a cached series, so
+    mutating them in place would corrupt other points.  Still a dict so json.dumps works as before,
+    and hashable so a series can be keyed by its tags.
+    '''
+    __slots__ = ('_hash',)
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.iteritems()))
+            return self._hash
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('tags are shared between points and cannot be modified, copy with dict(tags)')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    # dict's own copy and pickle support would fill the copy through __setitem__, and protocol 2
+    # can't pickle the slot, so rebuild from a plain dict.  Tag keys and values are strings, so a
+    # copy can share the original.
+    def __reduce__(self):
+        return (FrozenTags, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+class ClockCache(object):
+    '''
+    Bounded cache with CLOCK eviction, an approximation of LRU where a hit only sets a reference
+    bit instead of reordering anything.  Lookups take no lock, inserts are serialized.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = { }
+        self._ring = [ ]
+        self._hand = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        entry[1] = True
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[0] = value
+                return
+            if len(self._ring) < self.size:
+                self._ring.append(key)
+            else:
+                # Sweep the hand, giving referenced entries a second chance, until one can go
+                while True:
+                    victim = self._ring[self._hand]
+                    entry = self._entries[victim]
+                    if entry[1]:
+                        entry[1] = False
+                        self._hand = (self._hand + 1) % self.size
+                    else:
+                        break
+                del self._entries[victim]
+                self._ring[self._hand] = key
+                self._hand = (self._hand + 1) % self.size
+                self.evictions += 1
+            self._entries[key] = [ value, False ]
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            self._entries = { }
+            self._ring = [ ]
+            self._hand = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+_series_cache = ClockCache(int(os.environ.get('INFLUX_SERIES_CACHE_SIZE', 50000)))
+
+def set_series_cache_size(size):
+    '''
+    Resize (and empty) the series key cache, 0 disables it
+    '''
+    _series_cache.resize(size)
+
+def series_cache_stats():
+    '''
+    Return hits, misses, evictions, current size and hit rate of the series key cache
+    '''
+    lookups = _series_cache.hits + _series_cache.misses
+    return { 'hits': _series_cache.hits,
+             'misses': _series_cache.misses,
+             'evictions': _series_cache.evictions,
+             'size': len(_series_cache),
+             'capacity': _series_cache.size,
+             'hit_rate': _series_cache.hits / lookups if lookups else 0.0 }
+
+_field_names = ClockCache(int(os.environ.get('INFLUX_FIELD_NAME_CACHE_SIZE', 100000)))
+
+def set_field_name_cache_size(size):
+    '''
+    Resize (and empty) the field name intern table, 0 disables it
+    '''
+    _field_names.resize(size)
+
+def _field_schema(name, field):
+    '''
+    Return the [flattened output key, decoder] entry for a field.  The key is name for 'value' and
+    name.field otherwise, interned by (measurement, field) so every point shares one string object
+    per field instead of building a new one per line, which also keeps the string's hash cached.
+    The decoder is the one which last decoded the field, None until the field has been seen.
+    '''
+    key = (name, field)
+    entry = _field_names.get(key)
+    if entry is None:
+        entry = [ name if field == 'value' else name+'.'+field, None ]
+        _field_names.put(key, entry)
+    return entry
+
+metrics.counter('influx_series_cache_hits_total', 'Series key cache hits', lambda: _series_cache.hits)
+metrics.counter('influx_series_cache_misses_total', 'Series key cache misses', lambda: _series_cache.misses)
+metrics.counter('influx_series_cache_evictions_total', 'Series key cache evictions', lambda: _series_cache.evictions)
+metrics.gauge('influx_series_cache_entries', 'Series keys currently cached', lambda: len(_series_cache))
+metrics.counter('influx_field_name_cache_evictions_total', 'Field names evicted from the intern table', lambda: _field_names.evictions)
+metrics.gauge('influx_field_name_cache_entries', 'Field names currently interned', lambda: len(_field_names))
+metrics.counter('influx_field_values_invalid_total', 'Field values dropped because they could not be decoded, by reason')
        
 def _remove_escapes(s):
     '''
@@ -58,8 +209,8 @@ def _segment_influx_event(content):
     if breaker[1] != 0:
         timestamp = long(content[breaker[1]:])
     else:
-        # Without a timestamp, use current time
-        timestamp = long(time.time()*1000000)
+        # Without a timestamp, the caller uses current time
+        timestamp = None
         # Set second breaker to end of the string
         breaker[1] = len(content)
     measurements = content[breaker[0]:breaker[1]].strip()
@@ -119,11 +270,17 @@ def _parse_influx_kv(kv, breakers, escapeequals=True):
     
 def _parse_influx_keys(keys):
     '''
-    Parse influx Keys format: name,tag=value,tag2=value2
+    Parse influx Keys format: name,tag=value,tag2=value2.  The same series is sent over and over,
+    so results are cached by the raw keys string and tags are returned as FrozenTags.
     '''
+    cached = _series_cache.get(keys)
+    if cached is not None:
+        return cached
+    
     name = ''
     tags = { }
     
+    original = keys
     breakers = _find_comma_breakers(keys)
     
     # Name is always the first element
@@ -136,87 +293,370 @@ def _parse_influx_keys(keys):
 
     tags = _parse_influx_kv(keys, breakers)
     
-    return (name, tags)
+    parsed = (name, FrozenTags(tags))
+    _series_cache.put(original, parsed)
+    return parsed
 
-def _parse_influx_measurements(measurements, name):
+#===============================================================================
+# Field decoding
+#===============================================================================
+_BOOLEANS = { 't': True, 'T': True, 'true': True, 'True': True, 'TRUE': True,
+              'f': False, 'F': False, 'false': False, 'False': False, 'FALSE': False }
+
+# Characters a float() parsable value can start with, including inf and nan
+_NUMERIC_FIRST = frozenset('0123456789+-. \tiInN')
+
+def _decode_string(v):
+    # If we're a string, we're enclosed in quotes
+    if v[0:1] != '"' or v[-1:] != '"':
+        raise ValueError('not a string')
+    return v[1:-1]
+
+def _decode_bool(v):
+    b = _BOOLEANS.get(v)
+    if b is None:
+        raise ValueError('not a boolean')
+    return b
+
+def _decode_int(v):
+    # If the last character is an 'i', we're an integer
+    if v[-1:] != 'i':
+        raise ValueError('not an integer')
+    return long(v[:-1])
+
+def _decode_trimmed_float(v):
+    # Floats may carry a trailing 'l', trim it
+    if v[-1:] != 'l':
+        raise ValueError('not a float')
+    return float(v[:-1])
+
+def _decode_float(v):
+    return float(v)
+
+_DECODERS_BY_LAST = { 'i': _decode_int, 'l': _decode_trimmed_float }
+
+def _dispatch_decoder(v):
+    '''
+    Pick the decoder for a raw field value from its first and last characters, or None if the
+    value can't be any field type
+    '''
+    first = v[0:1]
+    if first == '"':
+        return _decode_string if v[-1:] == '"' else None
+    if v in _BOOLEANS:
+        return _decode_bool
+    if first in _NUMERIC_FIRST:
+        return _DECODERS_BY_LAST.get(v[-1:], _decode_float)
+    return None
+
+def _decode_natural(v):
+    decoder = _dispatch_decoder(v)
+    if decoder is None:
+        raise ValueError('unrecognized value')
+    return decoder(v)
+
+def _to_bool(x):
+    if isinstance(x, basestring):
+        return _decode_bool(x)
+    return bool(x)
+
+def _to_string(x):
+    if isinstance(x, basestring):
+        return x
+    return unicode(x).lower() if isinstance(x, bool) else unicode(x)
+
+_COERCIONS = { 'float': float, 'int': lambda x: long(float(x)) if isinstance(x, basestring) else long(x),
+               'bool': _to_bool, 'string': _to_string }
+
+def _coercer(kind):
+    '''
+    Return a decoder which decodes a value as whatever type it is and converts it to kind
+    '''
+    try:
+        convert = _COERCIONS[kind]
+    except KeyError:
+        raise ValueError("unknown field type '%s', expected one of %s" % (kind, ', '.join(sorted(_COERCIONS))))
+    def coerce(v):
+        try:
+            x = _decode_natural(v)
+        except ValueError:
+            # Anything can be a string, even unquoted text
+            if kind == 'string':
+                return v
+            raise
+        return convert(x)
+    return coerce
+
+# (measurement, field) -> coercing decoder, for fields whose type is configured rather than learned
+_pinned_types = { }
+
+def coerce_field(measurement, field, kind):
+    '''
+    Always convert measurement's field to kind, one of float, int, bool or string, whatever type
+    each line sends it as.  kind None goes back to decoding each value as its own type.
+    '''
+    if kind is None:
+        _pinned_types.pop((measurement, field), None)
+    else:
+        _pinned_types[(measurement, field)] = _coercer(kind)
+
+def _load_field_types(config):
+    for (measurement, fields) in json.loads(config).items():
+        for (field, kind) in fields.items():
+            coerce_field(measurement, field, kind)
+
+_load_field_types(os.environ.get('INFLUX_FIELD_TYPES', '{}'))
+
+def _parse_influx_fields(measurements, name):
     '''
     Parse influx measurements format: tag="string value",value=0.0
+    Returns parallel lists of flattened field names and typed values.  Each field remembers the
+    decoder that last worked for it, so a field which has always been a float goes straight to
+    float() and only falls back to dispatching on the value's characters when that fails.
+    Values which can't be decoded are dropped and counted in influx_field_values_invalid_total.
     '''
     breakers = _find_comma_breakers(measurements)
     temp = _parse_influx_kv(measurements, breakers, False)
     
     # print "breakers=%s temp=%s" % (breakers, temp)
     
-    out = { }
+    names = [ ]
+    values = [ ]
     for (k, v) in temp.items():
-        if k == 'value':
-            k = name
-        else:
-            k = name+'.'+k
-        try:    
-            # If we're a string, we're enclosed in quotes
-            if v[0:1] == '"' and v[-1:] == '"':
-                v = v[1:-1]
-            # Check if we're boolean
-            elif v in ('t', 'T', 'true', 'True', 'TRUE'):
-                v = True
-            elif v in ('f', 'F', 'false', 'False', 'FALSE'):
-                v = False
-            # If the last character is an 'i', we're an integer
-            elif v[-1:] == 'i':
-                v = long(v[:-1])
-            # Check if the last character is 'l', trim it if so
-            elif v[-1:] == 'l':
-                v = float(v[:-1])
-            # Otherwise, we're a float
-            else:
-                v = float(v)
-                
-            out[k] = v
-        except ValueError as e:
-            pass
+        entry = _field_schema(name, k)
+        if _pinned_types:
+            coerce = _pinned_types.get((name, k))
+            if coerce is not None:
+                try:
+                    v = coerce(v)
+                except ValueError:
+                    metrics.inc('influx_field_values_invalid_total', labels=(('reason', 'coercion'),))
+                    continue
+                names.append(entry[0])
+                values.append(v)
+                continue
+        decoder = entry[1]
+        if decoder is not None:
+            try:
+                v = decoder(v)
+                names.append(entry[0])
+                values.append(v)
+                continue
+            except ValueError:
+                pass
+        # First sighting of the field, or its type changed
+        decoder = _dispatch_decoder(v)
+        if decoder is None:
+            metrics.inc('influx_field_values_invalid_total', labels=(('reason', 'unrecognized'),))
+            continue
+        try:
+            v = decoder(v)
+        except ValueError:
+            metrics.inc('influx_field_values_invalid_total', labels=(('reason', 'malformed'),))
+            continue
+        entry[1] = decoder
+        names.append(entry[0])
+        values.append(v)
             
-    return out
+    return (names, values)
 
-def parse_influx_event(content):
+def _parse_influx_measurements(measurements, name):
     '''
-    Parse Influx's line protocol from https://influxdb.com/docs/v0.9/write_protocols/line.html
+    Parse influx measurements format into a dictionary of flattened field names to values
+    '''
+    (names, values) = _parse_influx_fields(measurements, name)
+    return dict(zip(names, values))
+
+# Nanoseconds per unit of InfluxDB's precision query parameter
+PRECISIONS = { 'n': 1, 'ns': 1, 'u': 10**3, 'us': 10**3, 'ms': 10**6, 's': 10**9, 'm': 60 * 10**9, 'h': 3600 * 10**9 }
+
+def _infer_timestamp(timestamp):
+    '''
+    Without an explicit precision, determine precision of timestamp from its magnitude and put
+    in floating point notation.  19 digits are nanoseconds, 16 microseconds, 13 milliseconds and
+    anything shorter seconds.
+    '''
+    magnitude = abs(timestamp)
+    if magnitude >= 10**18:
+        return round(timestamp/10**9, 6)
+    elif magnitude >= 10**15:
+        return round(timestamp/10**6, 6)
+    elif magnitude >= 10**12:
+        return round(timestamp/10**3, 6)
+    else:
+        return timestamp
+
+def _timestamp_converter(precision):
+    '''
+    Return a function converting raw timestamps of the given precision to seconds, resolved once
+    per batch so each line costs a single multiply and divide
     '''
+    if precision is None:
+        return _infer_timestamp
+    try:
+        ns = PRECISIONS[precision]
+    except KeyError:
+        raise ValueError("unknown precision '%s', expected one of %s" % (precision, ', '.join(sorted(PRECISIONS))))
+    return lambda timestamp: round(timestamp*ns/10**9, 6)
+
+spread_timestamps = os.environ.get('INFLUX_SPREAD_TIMESTAMPS', '0') not in ('', '0', 'false', 'False')
+# Nanoseconds between spread timestamps, the finest step the microsecond event times can hold
+SPREAD_STEP_NS = 1000
+
+class ReceiveTime(object):
+    '''
+    Default timestamp for lines without one, captured once per batch rather than calling
+    time.time() per line so every point in a request gets the same time.  With spread each
+    subsequent line is step seconds later, keeping points ordered as they were sent.
+    '''
+    __slots__ = ('received', 'step', 'count')
+
+    def __init__(self, received=None, spread=None, step=SPREAD_STEP_NS / 10**9):
+        self.received = time.time() if received is None else received
+        if spread is None:
+            spread = spread_timestamps
+        self.step = step if spread else 0
+        self.count = 0
+
+    def next(self):
+        if not self.step:
+            return round(self.received, 6)
+        timestamp = round(self.received + self.count*self.step, 6)
+        self.count += 1
+        return timestamp
+
+class Point(object):
+    '''
+    Compact parsed point.  Tags are shared with every other point of the series and fields are
+    kept as two tuples, so a batch of points costs far less than the legacy dicts.  as_dict()
+    builds the legacy event dictionary on demand.
+    '''
+    __slots__ = ('name', 'tags', 'field_names', 'field_values', 'timestamp')
+
+    def __init__(self, name, tags, field_names, field_values, timestamp):
+        self.name = name
+        self.tags = tags
+        self.field_names = field_names
+        self.field_values = field_values
+        self.timestamp = timestamp
+
+    def as_dict(self):
+        '''
+        Return the legacy dictionary form: timestamp, flattened fields and tags if there are any
+        '''
+        out = { 'timestamp': self.timestamp }
+        out.update(zip(self.field_names, self.field_values))
+        if self.tags:
+            out['tags'] = self.tags
+        return out
+
+    def __repr__(self):
+        return 'Point(%r, %r, %r, %r)' % (self.name, self.tags, dict(zip(self.field_names, self.field_values)), self.timestamp)
+
+def parse_influx_point(content, trace=None, precision=None, received=None):
+    '''
+    Parse one line of Influx's line protocol into a Point, or False if it has no valid fields.
+    precision is InfluxDB's ns, u, ms, s, m or h, or None to infer it from each timestamp.
+    received is the time in seconds to use if the line has no timestamp, now by default.
+    '''
+    return _parse_influx_point(content, trace, _timestamp_converter(precision), ReceiveTime(received))
+
+def _parse_influx_point(content, trace, convert, default):
     (keys, measurements, timestamp) = _segment_influx_event(content)
+    if trace: trace.stamp('segment')
     
     (name, tags) = _parse_influx_keys(keys)
+    if trace: trace.stamp('keys')
     
-    measures = _parse_influx_measurements(measurements, name)
+    (names, values) = _parse_influx_fields(measurements, name)
+    if trace: trace.stamp('fields')
     
     # print "keys=%s measurements=%s timestamp=%s" % (keys, measurements, timestamp)
     # print "name=%s tags=%s" % (name, tags)
-    # print "measures=%s" % measures
-    
-    if measures:
-        out = { }
-        # Determine precision of timestamp and put in floating point notation
-        if int(log10(timestamp))+1 == 19:
-            out['timestamp'] = round(timestamp/10**9, 6)
-        elif int(log10(timestamp))+1 == 16:
-            out['timestamp'] = round(timestamp/10**6, 6)
-        else:
-            out['timestamp'] = timestamp
-        out.update(measures)
-        if tags:
-            out['tags'] = tags
+    # print "names=%s values=%s" % (names, values)
     
-        return out
+    if names:
+        if timestamp is None:
+            timestamp = default.next()
+        else:
+            timestamp = convert(timestamp)
+        return Point(name, tags, tuple(names), tuple(values), timestamp)
     else:
         return False
+
+def parse_influx_event(content, trace=None, precision=None, received=None):
+    '''
+    Parse Influx's line protocol from https://influxdb.com/docs/v0.9/write_protocols/line.html
+    '''
+    return _parse_influx_event(content, trace, _timestamp_converter(precision), ReceiveTime(received))
+
+def _parse_influx_event(content, trace, convert, default):
+    point = _parse_influx_point(content, trace, convert, default)
+    if point:
+        return point.as_dict()
+    else:
+        return False
+
+_INFINITY = float('inf')
+
+def _json_value(v):
+    '''
+    JSON for one field value, formatted as json.dumps would but skipping it for the common types
+    '''
+    t = type(v)
+    if t is float:
+        if -_INFINITY < v < _INFINITY:
+            return repr(v)
+    elif t is int or t is long:
+        return str(v)
+    elif t is bool:
+        return 'true' if v else 'false'
+    return json.dumps(v)
+
+def hec_events(points, index, sourcetype):
+    '''
+    Serialize Points as a body for Splunk's HTTP Event Collector, concatenated event JSON.  Each
+    event is written straight from the point's slots, with the JSON for a series' tags and for
+    each set of field names encoded once per call rather than building as_dict() per point.
+    '''
+    dumps = json.dumps
+    value = _json_value
+    head = dumps({ 'index': index, 'sourcetype': sourcetype })[:-1] + ', "time": '
+    templates = { }
+    tag_json = { }
+    out = [ ]
+    for p in points:
+        names = p.field_names
+        template = templates.get(names)
+        if template is None:
+            if 'timestamp' in names or 'tags' in names or len(set(names)) < len(names):
+                # Fields which as_dict() would merge away
+                template = False
+            else:
+                template = '{"timestamp": %s' + ''.join([ ', %s: %%s' % dumps(n).replace('%', '%%') for n in names ])
+            templates[names] = template
+        ts = value(p.timestamp)
+        if template is False:
+            out.append('%s%s, "event": %s}' % (head, ts, dumps(p.as_dict())))
+            continue
+        event = template % ((ts,) + tuple([ value(v) for v in p.field_values ]))
+        tags = p.tags
+        if tags:
+            encoded = tag_json.get(id(tags))
+            if encoded is None:
+                encoded = tag_json[id(tags)] = ', "tags": %s}' % dumps(tags)
+            event += encoded
+        else:
+            event += '}'
+        out.append('%s%s, "event": %s}' % (head, ts, event))
+    return ''.join(out)
     
     
-def parse_influx(content):
+def _split_influx_events(content):
     '''
-    Parse a blob of Influx's line protocol from https://influxdb.com/docs/v0.9/write_protocols/line.html.
-    This breaks things into events since we can seemingly stupidly have newlines in an event.
+    Break content into events on newlines, except newlines inside quoted strings.  Blank events,
+    such as the one after the newline ending a batch, are dropped, so they don't count as lines.
     '''
-    
-    # Break content into events, call parse_influx_event
     events = [ ]
     quotes = 0
     lastbreaker = 0
@@ -238,15 +678,317 @@ def parse_influx(content):
     
     # Append the last or only event
     events.append(content[lastbreaker:])
+    return [ event for event in events if event and not event.isspace() ]
+
+def parse_influx(content, trace=None, points=False, precision=None, received=None, spread=None):
+    '''
+    Parse a blob of Influx's line protocol from https://influxdb.com/docs/v0.9/write_protocols/line.html.
+    This breaks things into events since we can seemingly stupidly have newlines in an event.
+    Pass an influxdb_trace.Trace as trace to time each parsing stage.  Returns a list of legacy
+    event dictionaries, or of Points if points is True.  precision is the /write precision query
+    parameter, ns, u, ms, s, m or h, and is inferred per timestamp when None.
+    
+    Lines without a timestamp get received, the time the request arrived in seconds and now by
+    default.  If spread (default INFLUX_SPREAD_TIMESTAMPS) each is SPREAD_STEP_NS after the last.
+    '''
+    parse_event = _parse_influx_point if points else _parse_influx_event
+    convert = _timestamp_converter(precision)
+    default = ReceiveTime(received, spread)
+    
+    start = time.time()
+    # Break content into events, call parse_influx_event
+    events = _split_influx_events(content)
+    if trace: trace.stamp('split')
     
     out = [ ]
-    for event in events:
-        ret = parse_influx_event(event)
-        if ret:
-            out.append(ret)
+    try:
+        for event in events:
+            ret = parse_event(event, trace, convert, default)
+            if ret:
+                out.append(ret)
+            else:
+                metrics.inc('influx_parse_errors_total', labels=(('type', 'no_fields'),))
+    except Exception as e:
+        metrics.inc('influx_parse_errors_total', labels=(('type', e.__class__.__name__),))
+        raise
+    finally:
+        metrics.inc('influx_lines_received_total', len(events))
+        metrics.inc('influx_points_parsed_total', len(out))
+        metrics.observe('influx_parse_seconds', time.time() - start)
         
     return out
 
+#===============================================================================
+# Columnar output
+#===============================================================================
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from array import array
+
+try:
+    array('q')
+    _INT64 = 'q'
+except ValueError:
+    # Python 2's array has no 'q', a C long is 64 bits on LP64 platforms
+    _INT64 = 'l'
+
+_COLUMN_KINDS = ('bool', 'int', 'float')
+
+def _value_kind(v):
+    # bool is a subclass of int, so it has to be checked first
+    if isinstance(v, bool):
+        return 'bool'
+    elif isinstance(v, (int, long)):
+        return 'int'
+    elif isinstance(v, float):
+        return 'float'
+    return 'string'
+
+def _timestamps_ns(timestamps, precision, now, spread):
+    '''
+    Convert a column of raw timestamps to int64 nanoseconds in one pass.  With a precision the
+    whole column is multiplied by one factor, otherwise precision is inferred per element by
+    magnitude as in _infer_timestamp.  Missing timestamps (None) become now, or now plus
+    SPREAD_STEP_NS per preceding missing timestamp if spread.  A timestamp which doesn't fit in
+    int64 nanoseconds raises ValueError.
+    '''
+    missing = [ x for (x, ts) in enumerate(timestamps) if ts is None ]
+    if missing:
+        timestamps = [ 0 if ts is None else ts for ts in timestamps ]
+    if numpy is not None:
+        try:
+            ts = numpy.array(timestamps, dtype=numpy.int64)
+        except OverflowError:
+            raise ValueError('timestamp out of range')
+        # abs wraps around for the int64 minimum, so clamp it to the largest magnitude
+        magnitude = numpy.abs(ts)
+        magnitude[magnitude < 0] = 2**63 - 1
+        if precision is not None:
+            factor = PRECISIONS[precision]
+            if (magnitude > (2**63 - 1) // factor).any():
+                raise ValueError('timestamp out of range for precision %s' % precision)
+        else:
+            factor = numpy.where(magnitude >= 10**18, 1,
+                     numpy.where(magnitude >= 10**15, 10**3,
+                     numpy.where(magnitude >= 10**12, 10**6, 10**9)))
+            if (magnitude > (2**63 - 1) // factor).any():
+                raise ValueError('timestamp out of range')
+        ts *= factor
+        if missing:
+            ts[missing] = now + numpy.arange(len(missing), dtype=numpy.int64) * SPREAD_STEP_NS if spread else now
+        return ts
+    if precision is not None:
+        factor = PRECISIONS[precision]
+        try:
+            ts = array(_INT64, [ x * factor for x in timestamps ])
+        except OverflowError:
+            raise ValueError('timestamp out of range for precision %s' % precision)
+    else:
+        try:
+            ts = array(_INT64, [ x * (1 if abs(x) >= 10**18 else 10**3 if abs(x) >= 10**15 else 10**6 if abs(x) >= 10**12 else 10**9)
+                                 for x in timestamps ])
+        except OverflowError:
+            raise ValueError('timestamp out of range')
+    for (offset, x) in enumerate(missing):
+        ts[x] = now + offset * SPREAD_STEP_NS if spread else now
+    return ts
+
+class DictionaryColumn(object):
+    '''
+    Dictionary encoded string column.  codes holds an index into dictionary per row, -1 where
+    the row has no value.
+    '''
+    __slots__ = ('name', 'codes', 'dictionary')
+
+    def __init__(self, name, codes, dictionary):
+        self.name = name
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def __getitem__(self, row):
+        code = self.codes[row]
+        if code < 0:
+            return None
+        return self.dictionary[code]
+
+class FieldColumn(object):
+    '''
+    Typed field column.  kind is bool, int or float backed by a bool/int64/float64 array, or
+    string backed by a list, and valid is a per row mask of which rows carry the field.
+    '''
+    __slots__ = ('name', 'kind', 'values', 'valid')
+
+    def __init__(self, name, kind, values, valid):
+        self.name = name
+        self.kind = kind
+        self.values = values
+        self.valid = valid
+
+    def __getitem__(self, row):
+        if not self.valid[row]:
+            return None
+        v = self.values[row]
+        if self.kind == 'bool':
+            return bool(v)
+        elif self.kind == 'int':
+            return long(v)
+        elif self.kind == 'float':
+            return float(v)
+        return v
+
+class ColumnarBatch(object):
+    '''
+    Column oriented parse of a blob of line protocol.  timestamps are int64 nanoseconds,
+    measurement and tags are DictionaryColumns and fields are FieldColumns keyed by the same
+    flattened name.field names as the dict API.  Arrays are NumPy when it is installed and the
+    array module otherwise, backend says which.
+    '''
+    __slots__ = ('length', 'timestamps', 'measurement', 'tags', 'fields', 'backend')
+
+    def __init__(self, length, timestamps, measurement, tags, fields, backend):
+        self.length = length
+        self.timestamps = timestamps
+        self.measurement = measurement
+        self.tags = tags
+        self.fields = fields
+        self.backend = backend
+
+    def __len__(self):
+        return self.length
+
+    def rows(self):
+        '''
+        Iterate the batch as legacy event dictionaries
+        '''
+        for row in xrange(self.length):
+            out = { 'timestamp': round(long(self.timestamps[row])/10**9, 6) }
+            for column in self.fields.values():
+                if column.valid[row]:
+                    out[column.name] = column[row]
+            tags = dict((column.name, column[row]) for column in self.tags.values() if column.codes[row] >= 0)
+            if tags:
+                out['tags'] = tags
+            yield out
+
+def _dense(kind, n, rows, values):
+    '''
+    Scatter sparse (rows, values) into a dense array of n rows plus a validity mask
+    '''
+    if numpy is not None:
+        valid = numpy.zeros(n, dtype=numpy.bool_)
+        valid[rows] = True
+        if kind == 'string':
+            dense = numpy.empty(n, dtype=object)
+        else:
+            dense = numpy.zeros(n, dtype={ 'bool': numpy.bool_, 'int': numpy.int64, 'float': numpy.float64 }[kind])
+        dense[rows] = values
+        return (dense, valid)
+    valid = array('b', [ 0 ]) * n
+    if kind == 'string':
+        dense = [ None ] * n
+    else:
+        dense = array({ 'bool': 'b', 'int': _INT64, 'float': 'd' }[kind], [ 0 ]) * n
+    for (row, v) in zip(rows, values):
+        dense[row] = v
+        valid[row] = 1
+    return (dense, valid)
+
+def _codes(n, rows, codes):
+    if numpy is not None:
+        dense = numpy.full(n, -1, dtype=numpy.int32)
+        dense[rows] = codes
+        return dense
+    dense = array('i', [ -1 ]) * n
+    for (row, code) in zip(rows, codes):
+        dense[row] = code
+    return dense
+
+def parse_influx_columnar(content, precision=None, received=None, spread=None):
+    '''
+    Parse a blob of line protocol into a ColumnarBatch instead of a list of dictionaries.  Fields
+    whose type varies between rows are widened, int to float, anything else to string.  precision,
+    received and spread are as for parse_influx.
+    '''
+    if precision is not None and precision not in PRECISIONS:
+        raise ValueError("unknown precision '%s', expected one of %s" % (precision, ', '.join(sorted(PRECISIONS))))
+    start = time.time()
+    events = _split_influx_events(content)
+    
+    timestamps = [ ]
+    names = { }
+    name_rows = [ ]
+    # tag key -> (rows, codes, value -> code)
+    tags = { }
+    # field name -> (rows, values, kinds seen)
+    fields = { }
+    try:
+        for event in events:
+            (keys, measurements, timestamp) = _segment_influx_event(event)
+            (name, row_tags) = _parse_influx_keys(keys)
+            (field_names, values) = _parse_influx_fields(measurements, name)
+            if not field_names:
+                metrics.inc('influx_parse_errors_total', labels=(('type', 'no_fields'),))
+                continue
+            row = len(timestamps)
+            timestamps.append(timestamp)
+            name_rows.append(names.setdefault(name, len(names)))
+            for (k, v) in row_tags.items():
+                column = tags.get(k)
+                if column is None:
+                    column = tags[k] = ([ ], [ ], { })
+                column[0].append(row)
+                column[1].append(column[2].setdefault(v, len(column[2])))
+            for (k, v) in zip(field_names, values):
+                column = fields.get(k)
+                if column is None:
+                    column = fields[k] = ([ ], [ ], set())
+                column[0].append(row)
+                column[1].append(v)
+                column[2].add(_value_kind(v))
+    except Exception as e:
+        metrics.inc('influx_parse_errors_total', labels=(('type', e.__class__.__name__),))
+        raise
+    
+    n = len(timestamps)
+    if received is None:
+        received = start
+    if spread is None:
+        spread = spread_timestamps
+    # Rounded to the microsecond like ReceiveTime, so both parsers give a line the same time
+    ts = _timestamps_ns(timestamps, precision, long(round(received*10**6))*1000, spread)
+    if numpy is not None:
+        backend = 'numpy'
+        measurement_codes = numpy.array(name_rows, dtype=numpy.int32)
+    else:
+        backend = 'array'
+        measurement_codes = array('i', name_rows)
+    measurement = DictionaryColumn('measurement', measurement_codes, sorted(names, key=names.get))
+    
+    tag_columns = { }
+    for (k, (rows, codes, dictionary)) in tags.items():
+        tag_columns[k] = DictionaryColumn(k, _codes(n, rows, codes), sorted(dictionary, key=dictionary.get))
+    
+    field_columns = { }
+    for (k, (rows, values, kinds)) in fields.items():
+        if len(kinds) == 1:
+            kind = kinds.pop()
+        elif kinds == set(('int', 'float')):
+            kind = 'float'
+            values = [ float(v) for v in values ]
+        else:
+            kind = 'string'
+            values = [ unicode(v) for v in values ]
+        (dense, valid) = _dense(kind, n, rows, values)
+        field_columns[k] = FieldColumn(k, kind, dense, valid)
+    
+    metrics.inc('influx_lines_received_total', len(events))
+    metrics.inc('influx_points_parsed_total', n)
+    metrics.observe('influx_parse_seconds', time.time() - start)
+    return ColumnarBatch(n, ts, measurement, tag_columns, field_columns, backend)
+
     
 if __name__ == '__main__':
     # events = [ 'disk_free free_space=442221834240i,disk_type="SSD" 1435362189575692182\ndisk_free free_space=442221834240i,disk_type="SSD" 1435362189575692182\ndisk_free free_space=442221834240i,disk_type="SSD" 1435362189575692182',
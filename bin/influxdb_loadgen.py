@@ -0,0 +1,238 @@
+import httplib
+import json
+import math
+import random
+import socket
+import sys
+import threading
+import time
+import urlparse
+from optparse import OptionParser
+
+"""Load generator which drives an InfluxDB compatible /write endpoint at a target rate.
+
+    python influxdb_loadgen.py --url http://localhost:8086/write --rate 50000 --batch-size 1000
+                               --concurrency 8 --duration 60 --series 10000 [--no-reuse] [--json]
+
+Synthetic points are generated from --series distinct series spread over --measurements
+measurements with --tags tags each, so tag cardinality is controlled directly.  Each worker
+sends on a fixed schedule and latency is measured from when a request was due rather than when
+it was sent, so a backed up server shows up in the percentiles instead of silently lowering the
+request rate.  Connections are kept alive unless --no-reuse is given.
+
+Reports achieved points/sec, error rate and an HDR latency histogram."""
+
+class HdrHistogram(object):
+    '''
+    High dynamic range histogram of integer values, in the manner of HdrHistogram: values are
+    bucketed by power of two, each power of two split into enough linear sub buckets to keep
+    significant_digits of precision, so memory is fixed and relative error bounded from 1 to
+    highest.
+    '''
+    def __init__(self, highest=3600 * 1000000, significant_digits=3):
+        largest_single_unit = 2 * 10 ** significant_digits
+        self.sub_bucket_bits = int(math.ceil(math.log(largest_single_unit, 2)))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.highest = highest
+        buckets = 1
+        while (self.sub_bucket_count << (buckets - 1)) <= highest:
+            buckets += 1
+        self.counts = [ 0 ] * ((buckets + 1) * self.sub_bucket_half)
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        bucket = max(value.bit_length() - self.sub_bucket_bits, 0)
+        sub_bucket = value >> bucket
+        return (bucket * self.sub_bucket_half) + sub_bucket
+
+    def _value_at(self, index):
+        bucket = max(index // self.sub_bucket_half - 1, 0)
+        sub_bucket = index - bucket * self.sub_bucket_half
+        return sub_bucket << bucket
+
+    def record(self, value):
+        value = min(max(int(value), 0), self.highest)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for (x, count) in enumerate(other.counts):
+            self.counts[x] += count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct):
+        if not self.total:
+            return 0
+        target = max(int(math.ceil(pct / 100.0 * self.total)), 1)
+        seen = 0
+        for (x, count) in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._value_at(x), self.max)
+        return self.max
+
+    def mean(self):
+        if not self.total:
+            return 0.0
+        return sum(self._value_at(x) * count for (x, count) in enumerate(self.counts) if count) / float(self.total)
+
+def make_series(series, measurements, tags, seed=0):
+    '''
+    Build the key section (measurement,tag=value...) of every synthetic series
+    '''
+    rnd = random.Random(seed)
+    out = [ ]
+    for x in xrange(series):
+        # Spread the series index across the tags like an odometer so every key is unique
+        rest = x
+        parts = [ 'loadgen_m%d' % (x % measurements) ]
+        for t in xrange(tags):
+            parts.append('tag%d=value%d' % (t, rest % 100 if t < tags - 1 else rest))
+            rest //= 100
+        out.append(','.join(parts))
+    rnd.shuffle(out)
+    return out
+
+def make_batch(series, offset, batch_size, fields, timestamp):
+    lines = [ ]
+    for x in xrange(batch_size):
+        key = series[(offset + x) % len(series)]
+        values = ','.join('field%d=%.3f' % (f, random.random() * 100) for f in xrange(fields))
+        lines.append('%s %s %d' % (key, values, timestamp + x))
+    return '\n'.join(lines)
+
+class Worker(threading.Thread):
+    def __init__(self, options, series, worker_id, start_at, deadline):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.options = options
+        self.series = series
+        self.worker_id = worker_id
+        self.start_at = start_at
+        self.deadline = deadline
+        self.histogram = HdrHistogram()
+        self.requests = 0
+        self.points = 0
+        self.errors = { }
+        url = urlparse.urlparse(options.url)
+        self.connection_class = httplib.HTTPSConnection if url.scheme == 'https' else httplib.HTTPConnection
+        self.netloc = url.netloc
+        self.path = url.path or '/write'
+        if url.query:
+            self.path += '?' + url.query
+
+    def _error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def run(self):
+        options = self.options
+        # Seconds between batches for this worker to hold its share of the target rate
+        interval = options.batch_size * options.concurrency / float(options.rate) if options.rate else 0.0
+        # Stagger workers so their requests don't arrive in lock step
+        due = self.start_at + interval * self.worker_id / options.concurrency
+        conn = None
+        offset = self.worker_id * options.batch_size
+        while due < self.deadline:
+            now = time.time()
+            if due > now:
+                time.sleep(due - now)
+            body = make_batch(self.series, offset, options.batch_size, options.fields, int(time.time() * 10 ** 9))
+            offset += options.batch_size * options.concurrency
+            if conn is None:
+                conn = self.connection_class(self.netloc, timeout=options.timeout)
+            try:
+                conn.request('POST', self.path, body, { 'Content-Type': 'text/plain' })
+                response = conn.getresponse()
+                response.read()
+                if response.status // 100 != 2:
+                    self._error(str(response.status))
+                else:
+                    self.points += options.batch_size
+            except (httplib.HTTPException, socket.error) as e:
+                self._error(e.__class__.__name__)
+                conn.close()
+                conn = None
+            self.requests += 1
+            # Latency from when the request was due, not when it was sent
+            self.histogram.record((time.time() - (due if interval else now)) * 1000000)
+            if not options.reuse and conn is not None:
+                conn.close()
+                conn = None
+            due = due + interval if interval else time.time()
+        if conn is not None:
+            conn.close()
+
+def run(options):
+    series = make_series(options.series, options.measurements, options.tags, options.seed)
+    start_at = time.time() + 0.1
+    deadline = start_at + options.duration
+    workers = [ Worker(options, series, x, start_at, deadline) for x in xrange(options.concurrency) ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = max(time.time() - start_at, 0.001)
+
+    histogram = HdrHistogram()
+    errors = { }
+    requests = points = 0
+    for w in workers:
+        histogram.merge(w.histogram)
+        requests += w.requests
+        points += w.points
+        for (k, v) in w.errors.items():
+            errors[k] = errors.get(k, 0) + v
+    error_count = sum(errors.values())
+    return { 'target_points_per_sec': options.rate,
+             'points_per_sec': round(points / elapsed, 1),
+             'requests_per_sec': round(requests / elapsed, 1),
+             'requests': requests,
+             'points': points,
+             'errors': errors,
+             'error_rate': round(error_count / float(requests), 6) if requests else 0.0,
+             'latency_ms': dict([ ('p%s' % pct, histogram.percentile(pct) / 1000.0) for pct in (50, 75, 90, 99, 99.9, 99.99) ] +
+                                [ ('min', (histogram.min or 0) / 1000.0), ('max', histogram.max / 1000.0),
+                                  ('mean', round(histogram.mean() / 1000.0, 3)) ]) }
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option('--url', default='http://localhost:8086/write')
+    parser.add_option('--rate', type='float', default=10000, help='target points/sec, 0 for as fast as possible')
+    parser.add_option('--batch-size', type='int', default=1000, help='points per request')
+    parser.add_option('--concurrency', type='int', default=4)
+    parser.add_option('--duration', type='float', default=30)
+    parser.add_option('--series', type='int', default=1000, help='distinct series, the tag cardinality')
+    parser.add_option('--measurements', type='int', default=10)
+    parser.add_option('--tags', type='int', default=3, help='tags per series')
+    parser.add_option('--fields', type='int', default=4, help='fields per point')
+    parser.add_option('--no-reuse', dest='reuse', action='store_false', default=True,
+                      help='open a new connection for every request')
+    parser.add_option('--timeout', type='float', default=30)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--json', action='store_true', default=False)
+    (options, args) = parser.parse_args(argv[1:])
+    if options.tags < 1:
+        parser.error('--tags must be at least 1')
+
+    result = run(options)
+    if options.json:
+        print json.dumps(result, indent=2, sort_keys=True)
+    else:
+        print 'points/sec: %.1f (target %.1f)  requests/sec: %.1f' % (result['points_per_sec'], options.rate, result['requests_per_sec'])
+        print 'requests: %d  errors: %s  error rate: %.4f%%' % (result['requests'], result['errors'] or 0, result['error_rate'] * 100)
+        print 'latency ms:'
+        for k in ('min', 'mean', 'p50', 'p75', 'p90', 'p99', 'p99.9', 'p99.99', 'max'):
+            print '  %-7s %10.3f' % (k, result['latency_ms'][k])
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
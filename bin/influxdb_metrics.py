@@ -0,0 +1,221 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+"""Lightweight Prometheus style instrumentation shared by both gateways.
+
+Every thread which records a metric gets its own shard of counters and histograms, so
+the hot path is a thread local lookup and a dict update with no locking.  Shards are
+only merged when /metrics is scraped, and a shard is folded into a retired total when its
+thread exits.  Values are exported in the Prometheus text
+exposition format, rates (points per second etc) are left to the scraper."""
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name -> (type, help, buckets)
+_metrics = { }
+# weakref to each live thread's shard -> its (counters, histograms), only touched under
+# _shards_lock when a thread shows up or exits
+_shards = { }
+_shards_lock = threading.Lock()
+_local = threading.local()
+# Counts from the shards of threads which have exited, only touched under _shards_lock
+_retired = ({ }, { })
+# Last value gauges, and metrics computed at scrape time
+_gauges = { }
+_callbacks = { }
+
+class _Shard(object):
+    '''
+    Per thread storage for counters and histograms
+    '''
+    __slots__ = ('counters', 'histograms', '__weakref__')
+
+    def __init__(self):
+        self.counters = { }
+        self.histograms = { }
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _Shard()
+        with _shards_lock:
+            # _local only holds the shard, so it dies with its thread
+            _shards[weakref.ref(shard, _retire)] = (shard.counters, shard.histograms)
+        _local.shard = shard
+        return shard
+
+def _fold(into, counters, histograms):
+    for (key, value) in counters.items():
+        into[0][key] = into[0].get(key, 0) + value
+    for (key, h) in histograms.items():
+        if key in into[1]:
+            into[1][key] = [ a+b for (a, b) in zip(into[1][key], h) ]
+        else:
+            into[1][key] = list(h)
+
+def _retire(ref):
+    '''
+    Called as a thread exits and its shard is collected, so short lived threads don't leave
+    a shard behind each
+    '''
+    with _shards_lock:
+        (counters, histograms) = _shards.pop(ref)
+        _fold(_retired, counters, histograms)
+
+def counter(name, help, callback=None):
+    '''
+    Declare a counter.  If callback is given it is called at scrape time and should return
+    a number, or a list of (labels, number) tuples, for counts kept outside this module.
+    '''
+    _metrics[name] = ('counter', help, None)
+    if callback:
+        _callbacks[name] = callback
+
+def gauge(name, help, callback=None):
+    '''
+    Declare a gauge.  If callback is given it is called at scrape time and should return
+    a number, or a list of (labels, number) tuples.
+    '''
+    _metrics[name] = ('gauge', help, None)
+    if callback:
+        _callbacks[name] = callback
+
+def histogram(name, help, buckets=SECONDS_BUCKETS):
+    '''
+    Declare a histogram with the given upper bucket bounds
+    '''
+    _metrics[name] = ('histogram', help, tuple(buckets))
+
+def inc(name, value=1, labels=()):
+    '''
+    Increment a counter.  Labels are a tuple of (key, value) pairs.  Also used for up/down
+    gauges like in-flight counts, since per thread deltas sum correctly on scrape.
+    '''
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+def dec(name, value=1, labels=()):
+    inc(name, -value, labels)
+
+def observe(name, value, labels=()):
+    '''
+    Record a value in a histogram
+    '''
+    histograms = _shard().histograms
+    key = (name, labels)
+    h = histograms.get(key)
+    if h is None:
+        # Bucket counts, followed by sum and count
+        h = histograms[key] = [ 0 ] * (len(_metrics[name][2]) + 3)
+    h[bisect_left(_metrics[name][2], value)] += 1
+    h[-2] += value
+    h[-1] += 1
+
+def set_gauge(name, value, labels=()):
+    '''
+    Set a last value gauge
+    '''
+    _gauges[(name, labels)] = value
+
+def _merge():
+    '''
+    Sum every shard, and the retired total, into a single set of counters and histograms
+    '''
+    merged = ({ }, { })
+    with _shards_lock:
+        _fold(merged, *_retired)
+        # items() copies under the GIL, so writers never need to be stopped
+        for (counters, histograms) in _shards.values():
+            _fold(merged, counters, histograms)
+    return merged
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for (k, v) in labels)
+
+def _format_value(v):
+    if isinstance(v, float):
+        return repr(v)
+    return str(v)
+
+def render():
+    '''
+    Merge all shards and return the Prometheus text exposition of every declared metric
+    '''
+    (counters, histograms) = _merge()
+    samples = { }
+    for ((name, labels), value) in counters.items():
+        samples.setdefault(name, [ ]).append((labels, value))
+    for ((name, labels), value) in _gauges.items():
+        samples.setdefault(name, [ ]).append((labels, value))
+    for (name, callback) in _callbacks.items():
+        try:
+            value = callback()
+        except Exception:
+            continue
+        if isinstance(value, list):
+            samples.setdefault(name, [ ]).extend(value)
+        elif value is not None:
+            samples.setdefault(name, [ ]).append(((), value))
+
+    lines = [ ]
+    for name in sorted(_metrics):
+        (mtype, help, buckets) = _metrics[name]
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, mtype))
+        if mtype == 'histogram':
+            for ((hname, labels), h) in sorted(histograms.items()):
+                if hname != name:
+                    continue
+                cumulative = 0
+                for (bound, count) in zip(buckets, h):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels, (('le', _format_value(float(bound))),)), cumulative))
+                cumulative += h[len(buckets)]
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels, (('le', '+Inf'),)), cumulative))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(h[-2])))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels), h[-1]))
+        else:
+            for (labels, value) in sorted(samples.get(name, [ ])):
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+class Timer(object):
+    '''
+    Context manager observing elapsed wall time into a histogram
+    '''
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.time() - self.start, self.labels)
+        return False
+
+# Metrics common to both gateways
+counter('influx_http_requests_total', 'HTTP requests served, by handler and status code')
+histogram('influx_http_request_body_bytes', 'Size of /write request bodies in bytes', BYTES_BUCKETS)
+counter('influx_points_parsed_total', 'Points successfully parsed from line protocol')
+counter('influx_lines_received_total', 'Lines of line protocol received')
+counter('influx_parse_errors_total', 'Line protocol parse failures, by error type')
+histogram('influx_parse_seconds', 'Time spent parsing a /write body')
+histogram('influx_forward_seconds', 'Latency forwarding a batch to its target, by target')
+counter('influx_forward_errors_total', 'Failed forwards, by target')
+gauge('influx_requests_inflight', 'Requests currently being handled')
+gauge('influx_forwards_inflight', 'Batches sent to a target which have not completed yet')
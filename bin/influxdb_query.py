@@ -0,0 +1,588 @@
+from __future__ import division
+import datetime
+import calendar
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from influxdb_common import ClockCache, PRECISIONS
+import influxdb_store
+
+"""Answers /query and /ping like an InfluxDB server would, without a database behind them.
+
+Configured via environment variables:
+
+    INFLUX_VERSION: (Optional) Version reported in X-Influxdb-Version, default 1.8.10
+    INFLUX_DATABASES: (Optional) JSON list of databases for SHOW DATABASES, default ["telegraf"]
+    INFLUX_MAX_DATABASES: (Optional) Most databases SHOW DATABASES lists, CREATE DATABASE beyond it is ignored, default 100
+
+Agents and dashboards hammer these endpoints at startup (CREATE DATABASE, SHOW DATABASES, /ping),
+so every answer is pre-encoded: admin statements map to canned JSON fragments and whole
+responses are cached by query string, leaving a dict lookup and a write per request.
+
+SELECT statements are answered from influxdb_store's recent points when INFLUX_STORE_SECONDS is
+set.  Supported is a single measurement with count, sum, mean, min, max, first and last or raw
+fields, a WHERE clause of time bounds and tag comparisons, GROUP BY time(interval) and tags,
+fill(), ORDER BY time and LIMIT:
+
+    SELECT mean("usage_idle") FROM "cpu" WHERE "host" =~ /^web/ AND time > now() - 5m
+        GROUP BY time(10s), "host" fill(null)"""
+
+VERSION = os.environ.get('INFLUX_VERSION', '1.8.10')
+
+# Headers for every response, as (name, value) pairs for both gateways
+HEADERS = [ ('X-Influxdb-Version', VERSION), ('X-Influxdb-Build', 'OSS') ]
+JSON_HEADERS = [ ('Content-Type', 'application/json') ] + HEADERS
+
+PING_VERBOSE = json.dumps({ 'version': VERSION })
+
+_databases = json.loads(os.environ.get('INFLUX_DATABASES', '["telegraf"]'))
+MAX_DATABASES = int(os.environ.get('INFLUX_MAX_DATABASES', '100'))
+_lock = threading.Lock()
+_responses = ClockCache(1024)
+
+def _series(columns, values, name=None):
+    series = { 'columns': columns, 'values': values }
+    if name:
+        series['name'] = name
+    return json.dumps({ 'series': [ series ] }, separators=(',', ':'))[1:-1]
+
+def fragment(body=''):
+    '''
+    Pre-encode a single statement's result, leaving %d for its statement_id
+    '''
+    if body:
+        return '{"statement_id":%d,' + body.replace('%', '%%') + '}'
+    return '{"statement_id":%d}'
+
+EMPTY = fragment()
+
+_canned = { }
+
+def _encode_canned():
+    _canned['SHOW DATABASES'] = fragment(_series([ 'name' ], [ [ db ] for db in _databases ], 'databases'))
+    _canned['SHOW RETENTION POLICIES'] = fragment(_series([ 'name', 'duration', 'shardGroupDuration', 'replicaN', 'default' ],
+                                                           [ [ 'autogen', '0s', '168h0m0s', 1, True ] ]))
+    _canned['SHOW USERS'] = fragment(_series([ 'user', 'admin' ], [ ]))
+
+_encode_canned()
+
+# First words of a statement -> canned key, anything unlisted gets an empty result
+_STATEMENTS = ((re.compile(r'SHOW\s+DATABASES\b', re.I), 'SHOW DATABASES'),
+               (re.compile(r'SHOW\s+RETENTION\s+POLICIES\b', re.I), 'SHOW RETENTION POLICIES'),
+               (re.compile(r'SHOW\s+USERS\b', re.I), 'SHOW USERS'))
+_CREATE_DATABASE = re.compile(r'CREATE\s+DATABASE\s+(?:"((?:[^"\\]|\\.)+)"|(\w+))', re.I)
+
+def split_statements(q):
+    '''
+    Split a query on semicolons which aren't inside quotes
+    '''
+    statements = [ ]
+    quote = None
+    last = 0
+    for (x, c) in enumerate(q):
+        if quote:
+            if c == quote and q[x-1:x] != '\\':
+                quote = None
+        elif c in ('"', "'"):
+            quote = c
+        elif c == ';':
+            statements.append(q[last:x])
+            last = x + 1
+    statements.append(q[last:])
+    return [ s.strip() for s in statements if s.strip() ]
+
+def create_database(name):
+    '''
+    Remember a database so it shows up in SHOW DATABASES, unless MAX_DATABASES are listed already.
+    Every name a client creates is otherwise kept and re-encoded for good.
+    '''
+    with _lock:
+        if name in _databases or len(_databases) >= MAX_DATABASES:
+            return
+        _databases.append(name)
+        _encode_canned()
+        # Cached responses may include the old database list
+        _responses.resize(_responses.size)
+
+def statement_result(statement, epoch=None):
+    '''
+    Return the pre-encoded result fragment for one statement
+    '''
+    if _SELECT.match(statement):
+        try:
+            return select(statement, epoch)
+        except QueryError as e:
+            return fragment(json.dumps({ 'error': str(e) }, separators=(',', ':'))[1:-1])
+    match = _CREATE_DATABASE.match(statement)
+    if match:
+        create_database(match.group(1) or match.group(2))
+        return EMPTY
+    for (pattern, key) in _STATEMENTS:
+        if pattern.match(statement):
+            return _canned[key]
+    return EMPTY
+
+def query_response(q, epoch=None):
+    '''
+    Return the encoded JSON body answering the InfluxQL in q.  epoch is the query parameter of
+    the same name, the unit for integer timestamps in SELECT results, RFC3339 strings if None.
+    '''
+    body = _responses.get(q)
+    if body is None:
+        statements = split_statements(q or '')
+        results = [ statement_result(statement, epoch) % x for (x, statement) in enumerate(statements) ]
+        body = '{"results":[' + ','.join(results) + ']}'
+        # Don't cache anything with side effects or results which change, CREATE DATABASE has
+        # to be seen again to be applied and SELECT has to see new points
+        if not _CREATE_DATABASE.search(q or '') and not any(_SELECT.match(s) for s in statements):
+            _responses.put(q, body)
+    return body
+
+#===============================================================================
+# SELECT over the recent points store
+#===============================================================================
+_SELECT = re.compile(r'SELECT\b', re.I)
+
+class QueryError(ValueError):
+    pass
+
+_TOKENS = re.compile(r'''\s*(?:
+    (?P<duration>\d+(?:ns|us|u|ms|s|m|h|d|w)(?![\w.]))|
+    (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)|
+    (?P<string>'(?:[^'\\]|\\.)*')|
+    (?P<ident>"(?:[^"\\]|\\.)*"|[A-Za-z_]\w*)|
+    (?P<regex>/(?:[^/\\]|\\.)*/)|
+    (?P<op>=~|!~|!=|<>|<=|>=|::|[=<>(),.*+-]))''', re.X)
+
+# Seconds per InfluxQL duration unit
+_DURATIONS = { 'ns': 1e-9, 'u': 1e-6, 'us': 1e-6, 'ms': 1e-3, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800 }
+_DURATION = re.compile(r'(\d+)(\D+)$')
+
+MAX_BUCKETS = 100000
+
+def _tokenize(statement):
+    '''
+    Split InfluxQL into (kind, text, keyword) tuples, keyword being the upper cased text of
+    unquoted identifiers and None otherwise.  Quotes are removed from strings and identifiers.
+    '''
+    tokens = [ ]
+    x = 0
+    end = len(statement.rstrip())
+    while x < end:
+        match = _TOKENS.match(statement, x)
+        if match is None:
+            raise QueryError('found %s, expected a token at char %d' % (statement[x:x+10].split()[0], x + 1))
+        kind = match.lastgroup
+        text = match.group(kind)
+        keyword = None
+        if kind == 'ident' and text[0] == '"':
+            text = text[1:-1].replace('\\"', '"')
+        elif kind == 'ident':
+            keyword = text.upper()
+        elif kind == 'string':
+            text = text[1:-1].replace("\\'", "'")
+        elif kind == 'regex':
+            text = text[1:-1].replace('\\/', '/')
+        tokens.append((kind, text, keyword))
+        x = match.end()
+    return tokens
+
+def _duration(text):
+    (count, unit) = _DURATION.match(text).groups()
+    return int(count) * _DURATIONS[unit]
+
+def _rfc3339(text):
+    '''
+    Parse an RFC3339 UTC time, or a date, as InfluxQL accepts in time comparisons
+    '''
+    # strptime's %f takes at most microseconds
+    text = re.sub(r'(\.\d{6})\d+', r'\1', text)
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            parsed = datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        return calendar.timegm(parsed.timetuple()) + parsed.microsecond / 1e6
+    raise QueryError('invalid time %r' % text)
+
+class _Parser(object):
+    '''
+    Recursive descent parser for the SELECT subset described in the module documentation
+    '''
+    def __init__(self, statement, now):
+        self.tokens = _tokenize(statement)
+        self.x = 0
+        self.now = now
+
+    def peek(self, offset=0):
+        x = self.x + offset
+        return self.tokens[x] if x < len(self.tokens) else ('eof', '', None)
+
+    def next(self):
+        token = self.peek()
+        self.x += 1
+        return token
+
+    def accept(self, *texts):
+        (kind, text, keyword) = self.peek()
+        if (kind == 'op' and text in texts) or (keyword is not None and keyword in texts):
+            self.x += 1
+            return keyword or text
+        return None
+
+    def expect(self, *texts):
+        found = self.accept(*texts)
+        if found is None:
+            raise QueryError('found %s, expected %s' % (self.peek()[1] or 'EOF', ', '.join(texts)))
+        return found
+
+    def ident(self):
+        (kind, text, keyword) = self.next()
+        if kind != 'ident':
+            raise QueryError('found %s, expected identifier' % (text or 'EOF'))
+        # Type casts such as "value"::field don't matter here
+        if self.accept('::'):
+            self.next()
+        return text
+
+    def parse(self):
+        self.expect('SELECT')
+        query = { 'fields': [ self.field() ] }
+        while self.accept(','):
+            query['fields'].append(self.field())
+        self.expect('FROM')
+        # Only the measurement matters out of db.rp.measurement
+        query['measurement'] = self.ident()
+        while self.accept('.'):
+            query['measurement'] = self.ident()
+        query['where'] = self.condition() if self.accept('WHERE') else None
+        query['interval'] = query['offset'] = None
+        query['dimensions'] = [ ]
+        if self.accept('GROUP'):
+            self.expect('BY')
+            self.dimension(query)
+            while self.accept(','):
+                self.dimension(query)
+        query['fill'] = 'null'
+        if self.accept('FILL'):
+            self.expect('(')
+            (kind, text, keyword) = self.next()
+            if keyword in ('NULL', 'NONE', 'PREVIOUS'):
+                query['fill'] = keyword.lower()
+            elif kind == 'number' or (text == '-' and self.peek()[0] == 'number'):
+                query['fill'] = float(text + self.next()[1]) if text == '-' else float(text)
+            else:
+                raise QueryError('fill(%s) is not supported' % text)
+            self.expect(')')
+        query['descending'] = False
+        if self.accept('ORDER'):
+            self.expect('BY')
+            if self.ident().lower() != 'time':
+                raise QueryError('only ORDER BY time supported at this time')
+            query['descending'] = self.accept('ASC', 'DESC') == 'DESC'
+        query['limit'] = None
+        if self.accept('LIMIT'):
+            (kind, text, keyword) = self.next()
+            if kind != 'number':
+                raise QueryError('found %s, expected integer' % text)
+            query['limit'] = int(text)
+        if self.peek()[0] != 'eof':
+            raise QueryError('found %s, expected EOF' % self.peek()[1])
+        return query
+
+    def field(self):
+        if self.accept('*'):
+            field = { 'function': None, 'field': '*' }
+        elif self.peek(1)[1] == '(' and self.peek()[0] == 'ident':
+            function = self.next()[1].lower()
+            if function not in influxdb_store.AGGREGATES:
+                raise QueryError('undefined function %s()' % function)
+            self.expect('(')
+            field = { 'function': function, 'field': self.ident() }
+            self.expect(')')
+        else:
+            field = { 'function': None, 'field': self.ident() }
+        field['alias'] = self.ident() if self.accept('AS') else None
+        return field
+
+    def dimension(self, query):
+        if self.accept('*'):
+            query['dimensions'] = '*'
+        elif self.peek()[2] == 'TIME' and self.peek(1)[1] == '(':
+            self.next()
+            self.expect('(')
+            query['interval'] = self.duration()
+            if query['interval'] <= 0:
+                raise QueryError('time dimension must have positive duration')
+            query['offset'] = self.duration() if self.accept(',') else 0
+            self.expect(')')
+        elif query['dimensions'] != '*':
+            query['dimensions'].append(self.ident())
+        else:
+            self.ident()
+
+    def duration(self):
+        (kind, text, keyword) = self.next()
+        if kind != 'duration':
+            raise QueryError('found %s, expected duration' % text)
+        return _duration(text)
+
+    def condition(self):
+        terms = [ self.conjunction() ]
+        while self.accept('OR'):
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def conjunction(self):
+        terms = [ ]
+        while True:
+            term = self.comparison()
+            # Flatten parenthesized ANDs so time bounds inside them are still found
+            if term[0] == 'and':
+                terms.extend(term[1])
+            else:
+                terms.append(term)
+            if not self.accept('AND'):
+                break
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def comparison(self):
+        if self.accept('('):
+            term = self.condition()
+            self.expect(')')
+            return term
+        key = self.ident()
+        op = self.expect('=', '!=', '<>', '=~', '!~', '<', '<=', '>', '>=')
+        if key.lower() == 'time':
+            return ('time', op, self.time())
+        (kind, text, keyword) = self.next()
+        if op in ('=~', '!~'):
+            if kind != 'regex':
+                raise QueryError('found %s, expected regex' % text)
+            try:
+                return ('tag', key, op, re.compile(text))
+            except re.error as e:
+                raise QueryError('invalid regular expression /%s/: %s' % (text, e))
+        if op not in ('=', '!=', '<>') or kind not in ('string', 'ident'):
+            raise QueryError('comparing %s %s %s is not supported, only tags can be filtered' % (key, op, text))
+        return ('tag', key, op, text)
+
+    def time(self):
+        '''
+        Parse now() [+-] duration..., an RFC3339 string, a duration since the epoch or integer
+        nanoseconds, returning seconds since the epoch
+        '''
+        (kind, text, keyword) = self.next()
+        if keyword == 'NOW':
+            self.expect('(')
+            self.expect(')')
+            value = self.now
+        elif kind == 'string':
+            value = _rfc3339(text)
+        elif kind == 'duration':
+            value = _duration(text)
+        elif kind == 'number':
+            value = float(text) / 1e9
+        else:
+            raise QueryError('found %s, expected time' % (text or 'EOF'))
+        while True:
+            sign = self.accept('+', '-')
+            if sign is None:
+                return value
+            value += self.duration() * (1 if sign == '+' else -1)
+
+def _time_bounds(where):
+    '''
+    Return (start, end) from the time comparisons ANDed at the top of a WHERE clause
+    '''
+    (start, end) = (float('-inf'), float('inf'))
+    terms = [ where ] if where is None or where[0] != 'and' else where[1]
+    for term in terms:
+        if term is None or term[0] != 'time':
+            continue
+        (kind, op, value) = term
+        if op in ('>', '>='):
+            start = max(start, value)
+        elif op in ('<', '<='):
+            end = min(end, value)
+        elif op == '=':
+            (start, end) = (max(start, value), min(end, value))
+        else:
+            raise QueryError('invalid time comparison operator: %s' % op)
+    return (start, end)
+
+def _matcher(term):
+    '''
+    Build a predicate on a series' tags from a WHERE clause, ignoring its time bounds
+    '''
+    if term is None or term[0] == 'time':
+        return None
+    if term[0] in ('and', 'or'):
+        if term[0] == 'or' and _has_time(term):
+            raise QueryError('time conditions cannot be combined with OR')
+        tests = [ m for m in (_matcher(t) for t in term[1]) if m is not None ]
+        combine = all if term[0] == 'and' else any
+        return lambda tags: combine(test(tags) for test in tests)
+    (kind, key, op, value) = term
+    if op == '=':
+        return lambda tags: tags.get(key, '') == value
+    elif op in ('!=', '<>'):
+        return lambda tags: tags.get(key, '') != value
+    elif op == '=~':
+        return lambda tags: value.search(tags.get(key, '')) is not None
+    return lambda tags: value.search(tags.get(key, '')) is None
+
+def _has_time(term):
+    if term[0] in ('and', 'or'):
+        return any(_has_time(t) for t in term[1])
+    return term[0] == 'time'
+
+def format_time(t, epoch):
+    if epoch:
+        return int(round(t * 1e9 / PRECISIONS[epoch]))
+    when = datetime.datetime.utcfromtimestamp(t)
+    out = when.strftime('%Y-%m-%dT%H:%M:%S')
+    if when.microsecond:
+        out += ('.%06d' % when.microsecond).rstrip('0')
+    return out + 'Z'
+
+def column_names(fields):
+    '''
+    Name result columns like InfluxDB, the alias, function or field, suffixed _1, _2... if repeated
+    '''
+    names = [ ]
+    seen = { }
+    for f in fields:
+        name = f['alias'] or f['function'] or f['field']
+        if name in seen:
+            seen[name] += 1
+            name = '%s_%d' % (name, seen[name])
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _list(column):
+    # Plain floats are much quicker to walk than numpy scalars
+    return column.tolist() if hasattr(column, 'tolist') else column
+
+def _fill(rows, functions, fill):
+    if fill == 'null':
+        return rows
+    if fill == 'none':
+        return [ row for row in rows
+                 if any(v is not None and (f != 'count' or v) for (f, v) in zip(functions, row[1:])) ]
+    if fill == 'previous':
+        previous = [ None ] * (len(functions))
+        out = [ ]
+        for row in rows:
+            values = [ previous[x] if v is None else v for (x, v) in enumerate(row[1:]) ]
+            previous = values
+            out.append([ row[0] ] + values)
+        return out
+    return [ [ row[0] ] + [ fill if v is None else v for v in row[1:] ] for row in rows ]
+
+def parse_select(statement, now=None):
+    '''
+    Parse a SELECT into a dictionary describing it, including its time bounds as start and end
+    and match, a predicate on tags for its WHERE clause.  Raises QueryError if it's unsupported.
+    '''
+    query = _Parser(statement, time.time() if now is None else now).parse()
+    (query['start'], query['end']) = _time_bounds(query['where'])
+    query['match'] = _matcher(query['where'])
+    return query
+
+def select(statement, epoch=None):
+    '''
+    Run a SELECT against the recent points store and return its pre-encoded result fragment
+    '''
+    now = time.time()
+    return select_parsed(parse_select(statement, now), epoch, now)
+
+def select_parsed(query, epoch, now):
+    store = influxdb_store.store
+    if store is None:
+        return EMPTY
+    if epoch is not None and epoch not in PRECISIONS:
+        raise QueryError('invalid epoch %s' % epoch)
+
+    measurement = query['measurement']
+    fields = [ ]
+    for f in query['fields']:
+        if f['field'] == '*':
+            if f['function']:
+                raise QueryError('%s(*) is not supported' % f['function'])
+            fields.extend({ 'function': None, 'field': name, 'alias': None } for name in store.fields(measurement))
+        else:
+            fields.append(f)
+    functions = [ f['function'] for f in fields ]
+    aggregated = any(functions)
+    if aggregated and not all(functions):
+        raise QueryError('mixing aggregate and non-aggregate queries is not supported')
+    if query['interval'] and not aggregated:
+        raise QueryError('GROUP BY requires at least one aggregate function')
+    if not fields:
+        return EMPTY
+
+    (start, end) = (query['start'], query['end'])
+    bounded = start != float('-inf')
+    start = max(start, now - store.retention)
+    if query['interval'] and end == float('inf'):
+        end = now
+    names = sorted(set(f['field'] for f in fields))
+    columns = dict((name, x) for (x, name) in enumerate(names))
+    found = store.read(measurement, names, start, end, query['match'])
+
+    dimensions = query['dimensions']
+    if dimensions == '*':
+        dimensions = sorted(set(k for (tags, times, values) in found for k in tags))
+    groups = { }
+    for (tags, times, values) in found:
+        groups.setdefault(tuple(tags.get(k, '') for k in dimensions), [ ]).append((times, values))
+
+    interval = query['interval']
+    if interval:
+        offset = query['offset'] % interval
+        origin = math.floor((start - offset) / interval) * interval + offset
+        buckets = int(math.floor((end - origin) / interval)) + 1
+        if buckets > MAX_BUCKETS:
+            raise QueryError('max-select-buckets limit exceeded: (%d/%d)' % (buckets, MAX_BUCKETS))
+    else:
+        (origin, buckets) = (start if bounded else 0, 1)
+
+    header = [ 'time' ] + column_names(fields)
+    series = [ ]
+    for key in sorted(groups):
+        (times, values) = influxdb_store.merge(groups[key])
+        if aggregated:
+            results = [ influxdb_store.aggregate(f['function'], times, values[columns[f['field']]], origin, interval, buckets)
+                        for f in fields ]
+            rows = [ [ origin + x * interval if interval else origin ] + [ r[x] for r in results ] for x in xrange(buckets) ]
+            rows = _fill(rows, functions, query['fill'])
+        else:
+            selected = [ _list(values[columns[f['field']]]) for f in fields ]
+            rows = [ ]
+            for (x, t) in enumerate(_list(times)):
+                row = [ None if c[x] != c[x] else c[x] for c in selected ]
+                if any(v is not None for v in row):
+                    rows.append([ t ] + row)
+        if query['descending']:
+            rows.reverse()
+        if query['limit'] is not None:
+            rows = rows[:query['limit']]
+        if not rows:
+            continue
+        for row in rows:
+            row[0] = format_time(row[0], epoch)
+        result = { 'name': measurement, 'columns': header, 'values': rows }
+        if dimensions:
+            result['tags'] = dict(zip(dimensions, key))
+        series.append(result)
+
+    if not series:
+        return EMPTY
+    return fragment(json.dumps({ 'series': series }, separators=(',', ':'))[1:-1])
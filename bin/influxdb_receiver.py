@@ -0,0 +1,154 @@
+import json
+import os
+import select
+import socket
+import threading
+import time
+import Queue
+
+from influxdb_common import Point
+import influxdb_metrics as metrics
+
+"""Forwards points to Splunk's streaming receiver, /services/receivers/stream, over sockets opened
+with splunklib's Index.attach, for installations without the HTTP Event Collector.
+
+Configured via environment variables:
+
+    INFLUX_STREAM_SOCKETS: (Optional) Attached sockets kept per index and sourcetype, default 4
+    INFLUX_STREAM_MAX_IDLE: (Optional) Seconds an idle socket is kept before it's reattached, default 60
+
+Each point is written as a line of JSON, the same object the modular input and HEC events carry,
+so the sourcetype should break events on newlines (SHOULD_LINEMERGE = false) and take _time from
+the "timestamp" field.  Sockets stay attached between batches; one which has been closed by
+splunkd is dropped before it's written to.  One which fails mid write is dropped and the batch
+fails, rather than being written again, since splunkd may already have part of it."""
+
+metrics.counter('influx_stream_connects_total', 'Sockets attached to the streaming receiver')
+metrics.counter('influx_stream_write_errors_total', 'Batches failed because an attached socket failed mid write')
+
+def serialize(events):
+    '''
+    Newline delimited JSON for a list of Points or legacy event dictionaries
+    '''
+    dumps = json.dumps
+    return ''.join([ dumps(e.as_dict() if isinstance(e, Point) else e) + '\n' for e in events ])
+
+class AttachedPool(object):
+    '''
+    Sockets attached to one index with one sourcetype.  At most size are open at once, senders
+    beyond that wait for one to be returned.
+    '''
+    def __init__(self, service, index, sourcetype, size=4, max_idle=60.0):
+        self.service = service
+        self.index = index
+        self.sourcetype = sourcetype
+        self.max_idle = max_idle
+        self._entity = None
+        self._idle = [ ]
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(size)
+
+    def _attach(self):
+        if self._entity is None:
+            self._entity = self.service.indexes[self.index]
+        metrics.inc('influx_stream_connects_total')
+        return self._entity.attach(sourcetype=self.sourcetype)
+
+    def _checkout(self):
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                (sock, used) = self._idle.pop()
+            # splunkd only ever writes to a streaming socket to refuse it or hang up, so a
+            # readable socket is a dead one
+            if now - used < self.max_idle and not select.select([ sock ], [ ], [ ], 0)[0]:
+                return sock
+            _close(sock)
+        return self._attach()
+
+    def send(self, data):
+        self._slots.acquire()
+        try:
+            sock = self._checkout()
+            try:
+                sock.sendall(data)
+            except socket.error:
+                _close(sock)
+                metrics.inc('influx_stream_write_errors_total')
+                raise
+            with self._lock:
+                self._idle.append((sock, time.time()))
+        finally:
+            self._slots.release()
+
+    def idle(self):
+        return len(self._idle)
+
+    def close(self):
+        with self._lock:
+            (idle, self._idle) = (self._idle, [ ])
+        for (sock, used) in idle:
+            _close(sock)
+
+def _close(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+    sock.close()
+
+class StreamForwarder(object):
+    '''
+    An AttachedPool per (index, sourcetype).  send() blocks until the data is written, while
+    send_async() hands it to a worker thread and calls callback(error) when it's done, error
+    being None on success, for callers such as the Tornado gateway which mustn't block.
+    '''
+    def __init__(self, service, size=None, max_idle=None):
+        self.service = service
+        self.size = size or int(os.environ.get('INFLUX_STREAM_SOCKETS', 4))
+        self.max_idle = float(max_idle or os.environ.get('INFLUX_STREAM_MAX_IDLE', 60))
+        self.pools = { }
+        self._lock = threading.Lock()
+        self._queue = None
+        metrics.gauge('influx_stream_sockets_idle', 'Attached sockets waiting for a batch',
+                      lambda: sum(pool.idle() for pool in self.pools.values()))
+
+    def pool(self, index, sourcetype):
+        key = (index, sourcetype)
+        pool = self.pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self.pools.get(key)
+                if pool is None:
+                    pool = self.pools[key] = AttachedPool(self.service, index, sourcetype, self.size, self.max_idle)
+        return pool
+
+    def send(self, data, index, sourcetype):
+        self.pool(index, sourcetype).send(data)
+
+    def send_async(self, data, index, sourcetype, callback):
+        if self._queue is None:
+            with self._lock:
+                if self._queue is None:
+                    self._queue = Queue.Queue()
+                    for x in xrange(self.size):
+                        worker = threading.Thread(target=self._work, name='stream-forwarder-%d' % x)
+                        worker.daemon = True
+                        worker.start()
+        self._queue.put((data, index, sourcetype, callback))
+
+    def _work(self):
+        while True:
+            (data, index, sourcetype, callback) = self._queue.get()
+            try:
+                self.send(data, index, sourcetype)
+                error = None
+            except Exception as e:
+                error = e
+            callback(error)
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
@@ -0,0 +1,561 @@
+from __future__ import division
+import json
+import os
+import re
+import threading
+import time
+import urlparse
+
+from influxdb_common import ClockCache
+import influxdb_metrics as metrics
+import influxdb_query
+import influxdb_store
+
+try:
+    import splunklib.binding as binding
+    import splunklib.client as client
+    import splunklib.results as results
+except ImportError:
+    binding = client = results = None
+
+"""Runs /query SELECTs as Splunk searches when the recent points store can't answer them.
+
+Configured via environment variables:
+
+    SPLUNK_SEARCH_URL: (Optional) splunkd management URL (https://host:8089) to search, unset disables searching
+    SPLUNK_SEARCH_TOKEN: (Optional) Session key for splunkd, otherwise SPLUNK_USERNAME and SPLUNK_PASSWORD log in
+    SPLUNK_SEARCH_APP: (Optional) App context for searches
+    SPLUNK_INDEX: Index the gateway's events are in
+    SPLUNK_SOURCETYPE: Sourcetype of the gateway's events
+    INFLUX_SPL_MODE: (Optional) stats (default) for the gateway's JSON events, tstats for indexed fields or mstats for a metrics index
+    INFLUX_SEARCH_SLICES: (Optional) Concurrent exports a search's time range is split between, default 1
+    INFLUX_QUERY_CACHE_TTL: (Optional) Seconds identical queries share a response, 0 disables, default 10
+    INFLUX_QUERY_CACHE_ENTRIES: (Optional) Responses cached, default 256
+    INFLUX_QUERY_CACHE_BYTES: (Optional) Largest response cached, default 1048576
+
+Each SELECT becomes one SPL search run with Jobs.export, and its results are converted to
+InfluxDB's JSON as they stream out of JSONResultsReader, so a large result is never held whole.
+A query arriving while an identical one is running waits for it and shares its response.
+With INFLUX_SEARCH_SLICES above 1, a SELECT over a bounded time range without GROUP BY tags
+is run as that many exports of consecutive time slices, aligned to its GROUP BY time
+interval, whose results are read back in order."""
+
+SPL_MODES = ('stats', 'tstats', 'mstats')
+
+# InfluxQL aggregates as SPL stats functions
+SPL_FUNCTIONS = { 'count': 'count', 'sum': 'sum', 'mean': 'avg', 'min': 'min', 'max': 'max',
+                  'first': 'earliest', 'last': 'latest' }
+
+# Rows per chunk of a streamed response
+CHUNK_ROWS = 500
+
+service = None
+index = os.environ.get('SPLUNK_INDEX', 'metrics')
+sourcetype = os.environ.get('SPLUNK_SOURCETYPE', 'metrics')
+mode = os.environ.get('INFLUX_SPL_MODE', 'stats')
+slices = int(os.environ.get('INFLUX_SEARCH_SLICES', 1))
+cache_ttl = float(os.environ.get('INFLUX_QUERY_CACHE_TTL', 10))
+cache_bytes = int(os.environ.get('INFLUX_QUERY_CACHE_BYTES', 1048576))
+
+_cache = ClockCache(int(os.environ.get('INFLUX_QUERY_CACHE_ENTRIES', 256)))
+_flights = { }
+_lock = threading.Lock()
+_SELECT = re.compile(r'\bSELECT\b', re.I)
+_PLAIN_FIELD = re.compile(r'^[A-Za-z_][\w.]*$')
+
+metrics.counter('influx_query_cache_hits_total', 'Query responses served from the cache', lambda: _cache.hits)
+metrics.counter('influx_query_cache_misses_total', 'Query responses not found in the cache', lambda: _cache.misses)
+metrics.counter('influx_query_coalesced_total', 'Queries which waited on an identical running query')
+metrics.counter('influx_searches_total', 'Splunk searches run for /query')
+metrics.counter('influx_search_errors_total', 'Splunk searches for /query which failed')
+metrics.histogram('influx_search_seconds', 'Time to stream a Splunk search for /query')
+
+def configure(new_service=None, new_index=None, new_sourcetype=None, new_mode=None):
+    '''
+    Search with a connected splunklib Service, the modular input's for example, None disables
+    '''
+    global service, index, sourcetype, mode
+    service = new_service
+    index = new_index or index
+    sourcetype = new_sourcetype or sourcetype
+    if new_mode is not None:
+        if new_mode not in SPL_MODES:
+            raise ValueError('unknown SPL mode %s, expected one of %s' % (new_mode, ', '.join(SPL_MODES)))
+        mode = new_mode
+
+def connect_from_environment():
+    '''
+    Return a splunklib Service logged in to SPLUNK_SEARCH_URL, or None if it isn't set
+    '''
+    url = os.environ.get('SPLUNK_SEARCH_URL')
+    if not url or client is None:
+        return None
+    parsed = urlparse.urlparse(url)
+    return client.connect(scheme=parsed.scheme or 'https', host=parsed.hostname, port=parsed.port or 8089,
+                          token=os.environ.get('SPLUNK_SEARCH_TOKEN'),
+                          username=os.environ.get('SPLUNK_USERNAME', ''),
+                          password=os.environ.get('SPLUNK_PASSWORD', ''),
+                          app=os.environ.get('SPLUNK_SEARCH_APP'), autologin=True,
+                          handler=binding.pooled_handler())
+
+def _connect():
+    '''
+    Connect on first use, so the gateway starts even if splunkd is down
+    '''
+    global service
+    if service is None:
+        with _lock:
+            if service is None:
+                service = connect_from_environment()
+    return service
+
+def enabled():
+    return service is not None or (client is not None and bool(os.environ.get('SPLUNK_SEARCH_URL')))
+
+#===============================================================================
+# Translation
+#===============================================================================
+def _spl_string(s):
+    return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"')
+
+def _spl_field(name):
+    return name if _PLAIN_FIELD.match(name) else _spl_string(name)
+
+def _eval_field(name):
+    return "'%s'" % name.replace("'", "\\'")
+
+def _value_field(measurement, field):
+    # The gateway's events flatten fields the same way
+    return measurement if field == 'value' else measurement+'.'+field
+
+def _has_regex(term):
+    if term is None or term[0] == 'time':
+        return False
+    if term[0] in ('and', 'or'):
+        return any(_has_regex(t) for t in term[1])
+    return term[2] in ('=~', '!~')
+
+def _search_terms(term, tag_field):
+    '''
+    Render tag comparisons as search terms, for the base search or a tstats/mstats WHERE
+    '''
+    if term is None or term[0] == 'time':
+        return None
+    if term[0] in ('and', 'or'):
+        parts = [ p for p in (_search_terms(t, tag_field) for t in term[1]) if p ]
+        if len(parts) < 2:
+            return parts[0] if parts else None
+        return '(%s)' % (' ' if term[0] == 'and' else ' OR ').join(parts)
+    (kind, key, op, value) = term
+    comparison = '%s=%s' % (_spl_field(tag_field(key)), _spl_string(value))
+    return comparison if op == '=' else 'NOT ' + comparison
+
+def _where_expression(term, tag_field):
+    '''
+    Render tag comparisons as an eval expression for | where, which unlike search terms can match
+    regular expressions.  A missing tag compares as an empty string, as in InfluxDB.
+    '''
+    if term is None or term[0] == 'time':
+        return None
+    if term[0] in ('and', 'or'):
+        parts = [ p for p in (_where_expression(t, tag_field) for t in term[1]) if p ]
+        if len(parts) < 2:
+            return parts[0] if parts else None
+        return '(%s)' % (' AND ' if term[0] == 'and' else ' OR ').join(parts)
+    (kind, key, op, value) = term
+    field = 'coalesce(%s, "")' % _eval_field(tag_field(key))
+    if op in ('=~', '!~'):
+        expression = 'match(%s, %s)' % (field, _spl_string(value.pattern))
+        return expression if op == '=~' else 'NOT ' + expression
+    return '%s%s%s' % (field, '=' if op == '=' else '!=', _spl_string(value))
+
+def _span(interval):
+    if interval == int(interval):
+        return '%ds' % interval
+    return '%dms' % round(interval * 1000)
+
+def to_spl(query, spl_mode=None):
+    '''
+    Translate a query from influxdb_query.parse_select into SPL.  Returns (spl, keys, tag_fields),
+    keys being the result field holding each selected column and tag_fields the field holding
+    each GROUP BY tag.  Raises influxdb_query.QueryError for what can't be translated.
+    '''
+    spl_mode = spl_mode or mode
+    QueryError = influxdb_query.QueryError
+    fields = query['fields']
+    if any(f['field'] == '*' for f in fields):
+        raise QueryError('SELECT * is not supported when searching Splunk')
+    if query['dimensions'] == '*':
+        raise QueryError('GROUP BY * is not supported when searching Splunk')
+    functions = [ f['function'] for f in fields ]
+    aggregated = any(functions)
+    if aggregated and not all(functions):
+        raise QueryError('mixing aggregate and non-aggregate queries is not supported')
+    if query['interval'] and not aggregated:
+        raise QueryError('GROUP BY requires at least one aggregate function')
+    if not aggregated and spl_mode != 'stats':
+        raise QueryError('selecting raw fields needs INFLUX_SPL_MODE=stats')
+    regex = _has_regex(query['where'])
+    if regex and spl_mode != 'stats':
+        raise QueryError('regular expressions need INFLUX_SPL_MODE=stats')
+
+    tag_field = (lambda k: k) if spl_mode == 'mstats' else (lambda k: 'tags.' + k)
+    tag_fields = [ tag_field(d) for d in query['dimensions'] ]
+    values = [ _value_field(query['measurement'], f['field']) for f in fields ]
+    by = [ _spl_field(t) for t in tag_fields ]
+    terms = None if regex else _search_terms(query['where'], tag_field)
+
+    if aggregated:
+        keys = [ 'c%d' % x for x in xrange(len(fields)) ]
+        aggregates = ', '.join('%s(%s) AS %s' % (SPL_FUNCTIONS[f], _spl_field(v), k) for (f, v, k) in zip(functions, values, keys))
+    else:
+        keys = values
+
+    if spl_mode == 'stats':
+        spl = 'search index=%s sourcetype=%s' % (_spl_string(index), _spl_string(sourcetype))
+        if terms:
+            spl += ' ' + terms
+        if regex:
+            spl += ' | where ' + _where_expression(query['where'], tag_field)
+        if aggregated:
+            if query['interval']:
+                spl += ' | bin _time span=%s' % _span(query['interval'])
+            spl += ' | stats ' + aggregates
+            grouping = by + ([ '_time' ] if query['interval'] else [ ])
+            if grouping:
+                spl += ' by ' + ' '.join(grouping)
+        else:
+            spl += ' | fields _time %s' % ' '.join(by + [ _spl_field(v) for v in values ])
+    else:
+        where = 'index=%s' % _spl_string(index)
+        if spl_mode == 'tstats':
+            where += ' sourcetype=%s' % _spl_string(sourcetype)
+        if terms:
+            where += ' ' + terms
+        spl = '| %s %s WHERE %s' % (spl_mode, aggregates, where)
+        # tstats buckets _time as a BY field, mstats takes span on its own
+        grouping = by + ([ '_time' ] if query['interval'] and spl_mode == 'tstats' else [ ])
+        if grouping:
+            spl += ' BY ' + ' '.join(grouping)
+        if query['interval']:
+            spl += ' span=%s' % _span(query['interval'])
+
+    # Results have to arrive a series at a time, in time order
+    spl += ' | eval influx_time=_time | sort 0 %s' % ' '.join(by + [ '-influx_time' if query['descending'] else 'influx_time' ])
+    if query['limit'] is not None and not by:
+        spl += ' | head %d' % query['limit']
+    return (spl, keys, tag_fields)
+
+#===============================================================================
+# Streaming results
+#===============================================================================
+class _Filler(object):
+    '''
+    Fills in one series' empty GROUP BY time buckets as its rows stream past, in either order,
+    according to the query's fill()
+    '''
+    def __init__(self, functions, fill, origin, interval, buckets, descending):
+        self.functions = functions
+        self.fill = fill
+        self.origin = origin
+        self.interval = interval
+        self.step = -1 if descending else 1
+        self.stop = -1 if descending else buckets
+        self.next = buckets - 1 if descending else 0
+        self.previous = [ None ] * len(functions)
+
+    def _empty(self, x):
+        values = [ 0 if f == 'count' else None for f in self.functions ]
+        return self._filled(self.origin + x * self.interval, values)
+
+    def _filled(self, t, values):
+        if self.fill == 'none':
+            if not any(v is not None and (f != 'count' or v) for (f, v) in zip(self.functions, values)):
+                return [ ]
+        elif self.fill == 'previous':
+            values = [ self.previous[x] if v is None else v for (x, v) in enumerate(values) ]
+            self.previous = values
+        elif self.fill != 'null':
+            values = [ self.fill if v is None else v for v in values ]
+        return [ [ t ] + values ]
+
+    def rows(self, t, values):
+        out = [ ]
+        if self.interval:
+            x = int(round((t - self.origin) / self.interval))
+            while (x - self.next) * self.step > 0:
+                out.extend(self._empty(self.next))
+                self.next += self.step
+            self.next = x + self.step
+        return out + self._filled(t, values)
+
+    def finish(self):
+        out = [ ]
+        if self.interval:
+            while (self.stop - self.next) * self.step > 0:
+                out.extend(self._empty(self.next))
+                self.next += self.step
+        return out
+
+def _number(v, integer=False):
+    if v is None or v == '':
+        return None
+    try:
+        return int(float(v)) if integer else float(v)
+    except ValueError:
+        return v
+
+def _stream_search(query, statement_id, epoch, now):
+    '''
+    Run a translated SELECT and generate its statement result as JSON text, a chunk at a time
+    '''
+    if epoch is not None and epoch not in influxdb_query.PRECISIONS:
+        raise influxdb_query.QueryError('invalid epoch %s' % epoch)
+    (spl, keys, tag_fields) = to_spl(query)
+    fields = query['fields']
+    functions = [ f['function'] for f in fields ]
+    aggregated = any(functions)
+    (start, end) = (query['start'], query['end'])
+    bounded = start != float('-inf')
+    interval = query['interval']
+    if interval and end == float('inf'):
+        end = now
+    params = { 'output_mode': 'json' }
+    if bounded:
+        params['earliest_time'] = '%.6f' % start
+    if end != float('inf'):
+        params['latest_time'] = '%.6f' % end
+    if interval and bounded:
+        offset = query['offset'] % interval
+        origin = (start - offset) // interval * interval + offset
+        buckets = int((end - origin) // interval) + 1
+        if buckets > influxdb_query.MAX_BUCKETS:
+            raise influxdb_query.QueryError('max-select-buckets limit exceeded: (%d/%d)' % (buckets, influxdb_query.MAX_BUCKETS))
+    else:
+        # Without a lower bound only the gaps between rows can be filled
+        (origin, buckets) = (None, 0)
+
+    columns = [ 'time' ] + influxdb_query.column_names(fields)
+    dumps = json.dumps
+    out = [ '{"statement_id":%d' % statement_id ]
+    current = None
+    filler = None
+    rows = 0
+    error = None
+    metrics.inc('influx_searches_total')
+    begin = time.time()
+    # Without tags every row is one series in time order, so time slices can be concatenated
+    sliced = slices > 1 and bounded and end != float('inf') and not tag_fields and (interval or not aggregated)
+    found = _search(spl, params, query, start, end, sliced)
+    try:
+        for result in found:
+            if isinstance(result, results.Message):
+                if result.type in ('FATAL', 'ERROR') and error is None:
+                    error = result.message
+                continue
+            key = tuple(result.get(t) or '' for t in tag_fields)
+            if key != current or filler is None:
+                if filler is not None:
+                    new = _limited(filler.finish(), query, rows)
+                    out.append(_encode_rows(new, rows, epoch))
+                    out.append(']},')
+                else:
+                    out.append(',"series":[')
+                series = { 'name': query['measurement'], 'columns': columns }
+                if tag_fields:
+                    series['tags'] = dict(zip(query['dimensions'], key))
+                out.append(dumps(series, separators=(',', ':'))[:-1] + ',"values":[')
+                (current, rows) = (key, 0)
+                series_origin = origin
+                if interval and origin is None:
+                    series_origin = float(result.get('influx_time') or 0)
+                filler = _Filler(functions, query['fill'], series_origin, interval, buckets or 1, query['descending'])
+                if interval and origin is None:
+                    # Unbounded, so fill nothing past the last row either
+                    filler.stop = filler.next
+
+            if aggregated:
+                values = [ _number(result.get(k), f == 'count') for (k, f) in zip(keys, functions) ]
+                t = float(result['influx_time']) if interval else (start if bounded else 0)
+            else:
+                values = [ _number(result.get(k)) for k in keys ]
+                if all(v is None for v in values):
+                    continue
+                t = float(result['influx_time'])
+            new = _limited(filler.rows(t, values), query, rows)
+            out.append(_encode_rows(new, rows, epoch))
+            rows += len(new)
+            if len(out) >= CHUNK_ROWS:
+                yield ''.join(out)
+                out = [ ]
+
+        if filler is not None:
+            out.append(_encode_rows(_limited(filler.finish(), query, rows), rows, epoch))
+            out.append(']}]')
+        elif error is not None:
+            metrics.inc('influx_search_errors_total')
+            out.append(',"error":%s' % dumps(error))
+        out.append('}')
+        yield ''.join(out)
+    finally:
+        found.close()
+        metrics.observe('influx_search_seconds', time.time() - begin)
+
+def _search(spl, params, query, start, end, sliced):
+    '''
+    Generate a search's final results and messages, from INFLUX_SEARCH_SLICES exports run in
+    parallel if sliced
+    '''
+    jobs = _connect().jobs
+    if sliced:
+        found = jobs.export_parallel(spl, start, end, slices=slices, reverse=query['descending'],
+                                     span=query['interval'], output_mode=params['output_mode'])
+        try:
+            for result in found:
+                yield result
+        finally:
+            found.close()
+        return
+    stream = jobs.export(spl, **params)
+    try:
+        reader = results.JSONResultsReader(stream)
+        for result in reader:
+            if isinstance(result, dict) and reader.is_preview:
+                continue
+            yield result
+    finally:
+        stream.close()
+
+def _limited(rows, query, emitted):
+    if query['limit'] is None:
+        return rows
+    return rows[:max(query['limit'] - emitted, 0)]
+
+def _encode_rows(rows, emitted, epoch):
+    if not rows:
+        return ''
+    parts = [ ]
+    for row in rows:
+        row[0] = influxdb_query.format_time(row[0], epoch)
+        parts.append(json.dumps(row, separators=(',', ':')))
+    return (',' if emitted else '') + ','.join(parts)
+
+#===============================================================================
+# Responses
+#===============================================================================
+def _routed(statement, now):
+    '''
+    Return the parsed query if statement is a SELECT to run in Splunk, None to answer it locally
+    '''
+    if not _SELECT.match(statement.lstrip()):
+        return None
+    try:
+        query = influxdb_query.parse_select(statement, now)
+    except influxdb_query.QueryError:
+        # The local path reports it
+        return None
+    store = influxdb_store.store
+    if store is not None and query['start'] >= now - store.retention:
+        return None
+    return query
+
+def searches(q):
+    '''
+    True if answering q involves a Splunk search, so it should be streamed off the event loop
+    '''
+    if not enabled() or not _SELECT.search(q or ''):
+        return False
+    now = time.time()
+    return any(_routed(statement, now) is not None for statement in influxdb_query.split_statements(q))
+
+def _respond(q, epoch):
+    now = time.time()
+    yield '{"results":['
+    for (x, statement) in enumerate(influxdb_query.split_statements(q or '')):
+        if x:
+            yield ','
+        query = _routed(statement, now) if enabled() else None
+        if query is None:
+            yield influxdb_query.statement_result(statement, epoch) % x
+            continue
+        chunks = _stream_search(query, x, epoch, now)
+        try:
+            first = chunks.next()
+        except Exception as e:
+            # Nothing has been sent for the statement yet, so it can still report the failure
+            metrics.inc('influx_search_errors_total')
+            yield influxdb_query.fragment(json.dumps({ 'error': str(e) }, separators=(',', ':'))[1:-1]) % x
+            continue
+        yield first
+        for chunk in chunks:
+            yield chunk
+    yield ']}'
+
+def query_chunks(q, epoch=None):
+    '''
+    Generate the /query response body for q in pieces.  The first request for a query runs it and
+    caches the response if it's under INFLUX_QUERY_CACHE_BYTES, identical requests made while it
+    runs wait for it, and later ones within INFLUX_QUERY_CACHE_TTL seconds get the cached copy.
+    If it fails or is too big to cache, the requests which waited for it all run it at once.
+    '''
+    if not searches(q):
+        yield influxdb_query.query_response(q, epoch)
+        return
+    key = (q, epoch)
+    cached = _cache.get(key)
+    if cached is not None and cached[0] > time.time():
+        yield cached[1]
+        return
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = threading.Event()
+    if not leader:
+        metrics.inc('influx_query_coalesced_total')
+        flight.wait()
+        cached = _cache.get(key)
+        if cached is not None and cached[0] > time.time():
+            yield cached[1]
+        else:
+            # Electing another leader would run the waiters one after another
+            for chunk in _respond(q, epoch):
+                yield chunk
+        return
+
+    kept = [ ]
+    size = 0
+    complete = False
+    try:
+        for chunk in _respond(q, epoch):
+            if kept is not None:
+                size += len(chunk)
+                if size > cache_bytes:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            yield chunk
+        complete = True
+    finally:
+        if complete and kept is not None and cache_ttl > 0:
+            _cache.put(key, (time.time() + cache_ttl, ''.join(kept)))
+        with _lock:
+            del _flights[key]
+        flight.set()
+
+def query_body(chunks, logger):
+    '''
+    Stream a /query response, reporting a failure part way through as an InfluxDB error object
+    after whatever was sent, since the 200 has already gone out.  The failure is logged to logger.
+    '''
+    sent = False
+    try:
+        for chunk in chunks:
+            sent = True
+            yield chunk
+    except Exception as e:
+        logger.exception("Query failed part way through, specific error: %s", str(e))
+        error = json.dumps({ 'error': str(e) }, separators=(',', ':'))
+        yield '\n' + error if sent else error
+    finally:
+        chunks.close()
@@ -0,0 +1,308 @@
+from __future__ import division
+import math
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+import influxdb_metrics as metrics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""Optional in-memory store of the most recent points, so /query can answer live dashboards
+without a round trip to Splunk.
+
+Configured via environment variables:
+
+    INFLUX_STORE_SECONDS: (Optional) Seconds of recent points to keep, 0 (default) disables the store
+    INFLUX_STORE_SERIES_POINTS: (Optional) Points kept per series, default 8192
+    INFLUX_STORE_MAX_SERIES: (Optional) Series kept before new series are dropped, default 100000
+
+Each series is a ring buffer holding a column of timestamps and one column per numeric field,
+array('d') so numpy can aggregate them in place.  String fields are not stored."""
+
+NAN = float('nan')
+
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max', 'first', 'last')
+
+class SeriesBuffer(object):
+    '''
+    Ring buffer of one series' last capacity points.  Fields missing from a point are NaN.
+    Timestamps are normally appended in order, so the ring read from head is sorted and is its
+    own time index; an out of order point marks the buffer unordered until it is overwritten.
+    '''
+    __slots__ = ('capacity', 'times', 'fields', 'head', 'count', 'previous', 'newest', 'unordered')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', [ 0.0 ]) * capacity
+        self.fields = { }
+        self.head = 0
+        self.count = 0
+        self.previous = None
+        self.newest = None
+        self.unordered = 0
+
+    def append(self, timestamp, names, values):
+        x = self.head
+        if self.previous is not None and timestamp < self.previous:
+            self.unordered = self.capacity
+        elif self.unordered:
+            self.unordered -= 1
+        self.previous = timestamp
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+        self.times[x] = timestamp
+
+        fields = self.fields
+        stored = [ ]
+        for (name, v) in zip(names, values):
+            if isinstance(v, basestring):
+                continue
+            column = fields.get(name)
+            if column is None:
+                column = fields[name] = array('d', [ NAN ]) * self.capacity
+            column[x] = v
+            stored.append(name)
+        # Clear whatever the overwritten point had in the fields this one lacks
+        if len(stored) < len(fields):
+            for (name, column) in fields.iteritems():
+                if name not in stored:
+                    column[x] = NAN
+
+        self.head = 0 if x + 1 == self.capacity else x + 1
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _chronological(self, column):
+        if self.count < self.capacity:
+            return column[:self.count]
+        return column[self.head:] + column[:self.head]
+
+    def _slice(self, column, lo, hi):
+        '''
+        Copy chronological positions lo to hi of a column without unrolling the whole ring
+        '''
+        if self.count < self.capacity:
+            return column[lo:hi]
+        (lo, hi) = (lo + self.head, hi + self.head)
+        if hi <= self.capacity:
+            return column[lo:hi]
+        if lo >= self.capacity:
+            return column[lo-self.capacity:hi-self.capacity]
+        return column[lo:] + column[:hi-self.capacity]
+
+    def window(self, start, end, names):
+        '''
+        Return (times, columns) for the points with start <= time <= end, sorted by time, with
+        a column per field in names.  numpy arrays if numpy is available, otherwise arrays.
+        '''
+        times = self._chronological(self.times)
+        order = None
+        if self.unordered:
+            if numpy is not None:
+                order = numpy.argsort(numpy.frombuffer(times), kind='mergesort')
+            else:
+                order = sorted(xrange(len(times)), key=times.__getitem__)
+                times = array('d', [ times[x] for x in order ])
+        if numpy is not None:
+            times = numpy.frombuffer(times)
+            if order is not None:
+                times = times[order]
+            (lo, hi) = (numpy.searchsorted(times, start, 'left'), numpy.searchsorted(times, end, 'right'))
+        else:
+            (lo, hi) = (bisect_left(times, start), bisect_right(times, end))
+
+        columns = [ ]
+        for name in names:
+            column = self.fields.get(name)
+            if column is None:
+                column = array('d', [ NAN ]) * (hi - lo)
+            elif order is None:
+                column = self._slice(column, lo, hi)
+            elif numpy is not None:
+                column = numpy.frombuffer(self._chronological(column))[order[lo:hi]]
+            else:
+                column = self._chronological(column)
+                column = array('d', [ column[x] for x in order[lo:hi] ])
+            columns.append(numpy.frombuffer(column) if numpy is not None and isinstance(column, array) else column)
+        return (times[lo:hi], columns)
+
+class RecentStore(object):
+    '''
+    Series buffers by measurement then tags, dropping series which have had no points for the
+    retention period.  Fields are stored under their flattened names (measurement.field, or the
+    measurement for value) as they come out of the parser and translated back when read.
+    '''
+    def __init__(self, retention, capacity=8192, max_series=100000):
+        self.retention = retention
+        self.capacity = capacity
+        self.max_series = max_series
+        self.measurements = { }
+        self.series = 0
+        self.dropped = 0
+        self._pruned = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, points):
+        '''
+        Store a batch of Points
+        '''
+        now = time.time()
+        with self._lock:
+            measurements = self.measurements
+            for p in points:
+                by_tags = measurements.get(p.name)
+                if by_tags is None:
+                    by_tags = measurements[p.name] = { }
+                buf = by_tags.get(p.tags)
+                if buf is None:
+                    if self.series >= self.max_series:
+                        self.dropped += 1
+                        continue
+                    buf = by_tags[p.tags] = SeriesBuffer(self.capacity)
+                    self.series += 1
+                buf.append(p.timestamp, p.field_names, p.field_values)
+            if now - self._pruned > self.retention:
+                self._prune(now)
+
+    def _prune(self, now):
+        cutoff = now - self.retention
+        for (name, by_tags) in self.measurements.items():
+            for (tags, buf) in by_tags.items():
+                if buf.newest < cutoff:
+                    del by_tags[tags]
+                    self.series -= 1
+            if not by_tags:
+                del self.measurements[name]
+        self._pruned = now
+
+    def fields(self, measurement):
+        '''
+        Return the sorted names of the numeric fields stored for a measurement
+        '''
+        with self._lock:
+            flattened = set()
+            for buf in self.measurements.get(measurement, { }).itervalues():
+                flattened.update(buf.fields)
+        return sorted(_field_name(measurement, f) for f in flattened)
+
+    def read(self, measurement, fields, start, end, match=None):
+        '''
+        Return [ (tags, times, columns) ] for each series of measurement whose tags pass match,
+        with the points between start and end (seconds, inclusive) no older than the retention
+        period and a column per field in fields.
+        '''
+        start = max(start, time.time() - self.retention)
+        flattened = [ measurement if f == 'value' else measurement+'.'+f for f in fields ]
+        out = [ ]
+        with self._lock:
+            for (tags, buf) in self.measurements.get(measurement, { }).iteritems():
+                if match is not None and not match(tags):
+                    continue
+                (times, columns) = buf.window(start, end, flattened)
+                if len(times):
+                    out.append((tags, times, columns))
+        return out
+
+def _field_name(measurement, flattened):
+    return 'value' if flattened == measurement else flattened[len(measurement)+1:]
+
+#===============================================================================
+# Aggregation
+#===============================================================================
+def merge(series):
+    '''
+    Merge [ (times, columns) ] from several series into one (times, columns) sorted by time
+    '''
+    if len(series) == 1:
+        return series[0]
+    if numpy is not None:
+        times = numpy.concatenate([ t for (t, c) in series ])
+        order = numpy.argsort(times, kind='mergesort')
+        columns = [ numpy.concatenate([ c[x] for (t, c) in series ])[order] for x in xrange(len(series[0][1])) ]
+        return (times[order], columns)
+    rows = sorted((t, [ c[x] for c in columns ]) for (times, columns) in series for (x, t) in enumerate(times))
+    return ([ t for (t, values) in rows ], [ [ values[x] for (t, values) in rows ] for x in xrange(len(series[0][1])) ])
+
+def aggregate(func, times, values, origin, interval, buckets):
+    '''
+    Apply one of AGGREGATES to values, grouped into buckets windows of interval seconds from
+    origin, or all into one bucket if interval is None.  times must be sorted.  Returns a list
+    with a value per bucket, None where a bucket has no values (except count, which is 0).
+    '''
+    if numpy is not None:
+        return _aggregate_numpy(func, times, values, origin, interval, buckets)
+
+    grouped = [ [ ] for x in xrange(buckets) ]
+    for (t, v) in zip(times, values):
+        if v != v:
+            continue
+        x = int(math.floor((t - origin) / interval)) if interval else 0
+        if 0 <= x < buckets:
+            grouped[x].append(v)
+    if func == 'count':
+        return [ len(g) for g in grouped ]
+    reducer = _REDUCERS[func]
+    return [ reducer(g) if g else None for g in grouped ]
+
+_REDUCERS = { 'sum': sum, 'mean': lambda g: sum(g) / len(g), 'min': min, 'max': max,
+              'first': lambda g: g[0], 'last': lambda g: g[-1] }
+
+def _aggregate_numpy(func, times, values, origin, interval, buckets):
+    valid = ~numpy.isnan(values)
+    if interval:
+        index = numpy.floor((times - origin) / interval).astype(numpy.int64)
+        valid &= (index >= 0) & (index < buckets)
+    else:
+        index = numpy.zeros(len(times), dtype=numpy.int64)
+    if not valid.all():
+        (index, values) = (index[valid], values[valid])
+
+    counts = numpy.bincount(index, minlength=buckets)
+    if func == 'count':
+        return counts.tolist()
+    if func in ('sum', 'mean'):
+        out = numpy.bincount(index, weights=values, minlength=buckets)
+        if func == 'mean':
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                out = out / counts
+    else:
+        # index never decreases since times are sorted, so each bucket is one contiguous run
+        out = numpy.full(buckets, NAN)
+        if len(index):
+            starts = numpy.flatnonzero(numpy.r_[True, index[1:] != index[:-1]])
+            if func == 'min':
+                reduced = numpy.minimum.reduceat(values, starts)
+            elif func == 'max':
+                reduced = numpy.maximum.reduceat(values, starts)
+            elif func == 'first':
+                reduced = values[starts]
+            else:
+                reduced = values[numpy.r_[starts[1:], len(values)] - 1]
+            out[index[starts]] = reduced
+    return [ None if counts[x] == 0 else v for (x, v) in enumerate(out.tolist()) ]
+
+#===============================================================================
+# Module store
+#===============================================================================
+store = None
+
+def configure(retention, capacity=8192, max_series=100000):
+    '''
+    Replace the store with an empty one keeping retention seconds of points, 0 disables it
+    '''
+    global store
+    store = RecentStore(retention, capacity, max_series) if retention > 0 else None
+
+configure(float(os.environ.get('INFLUX_STORE_SECONDS', 0)),
+          int(os.environ.get('INFLUX_STORE_SERIES_POINTS', 8192)),
+          int(os.environ.get('INFLUX_STORE_MAX_SERIES', 100000)))
+
+metrics.gauge('influx_store_series', 'Series held in the recent points store', lambda: store.series if store else 0)
+metrics.counter('influx_store_series_dropped_total', 'Points dropped because the recent points store was full of series',
+                lambda: store.dropped if store else 0)
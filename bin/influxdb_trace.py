@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+import random
+from timeit import default_timer
+
+import influxdb_metrics as metrics
+
+"""Opt-in per stage latency tracing for the write path.
+
+Configured via environment variables:
+
+    INFLUX_TRACE: Set to 1 to enable tracing
+    INFLUX_TRACE_SAMPLE: (Optional) Fraction of traced requests to also log as a span, default 0
+
+Callers ask for a trace with start(), which returns None when tracing is disabled, and
+then guard every stamp with `if trace:` so a disabled trace costs one branch per stage.
+Stage durations always feed the influx_stage_seconds histogram on /metrics."""
+
+STAGES = ('receive', 'split', 'segment', 'keys', 'fields', 'serialize', 'enqueue', 'forward', 'ack')
+
+enabled = os.environ.get('INFLUX_TRACE', '0') not in ('', '0', 'false', 'False')
+sample_rate = float(os.environ.get('INFLUX_TRACE_SAMPLE', 0))
+
+span_logger = logging.getLogger('InfluxImpersonator-trace')
+
+metrics.histogram('influx_stage_seconds', 'Time spent in each stage of the write path, when tracing is enabled')
+
+class Trace(object):
+    '''
+    Accumulates time per stage for one request.  stamp() charges the time since the previous
+    stamp to the named stage, so stages hit once per line (segment, keys, fields) sum across
+    the whole batch.
+    '''
+    __slots__ = ('start', 'last', 'durations', 'sampled')
+
+    def __init__(self, sampled=False):
+        self.start = self.last = default_timer()
+        self.durations = { }
+        self.sampled = sampled
+
+    def stamp(self, stage):
+        now = default_timer()
+        self.durations[stage] = self.durations.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def add(self, stage, seconds):
+        '''
+        Charge time measured elsewhere, for example by the HTTP server, to a stage
+        '''
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def skip(self):
+        '''
+        Move the clock forward without charging the elapsed time to any stage
+        '''
+        self.last = default_timer()
+
+    def finish(self):
+        for (stage, seconds) in self.durations.items():
+            metrics.observe('influx_stage_seconds', seconds, (('stage', stage),))
+        if self.sampled:
+            span_logger.info(json.dumps({ 'total': default_timer() - self.start,
+                                          'stages': self.durations }))
+
+def configure(enable, sample=0.0):
+    '''
+    Turn tracing on or off at runtime
+    '''
+    global enabled, sample_rate
+    enabled = enable
+    sample_rate = sample
+
+def start():
+    '''
+    Return a new Trace, or None when tracing is disabled
+    '''
+    if not enabled:
+        return None
+    return Trace(sample_rate > 0 and random.random() < sample_rate)
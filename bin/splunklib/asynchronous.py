@@ -0,0 +1,599 @@
+# Copyright 2011-2015 Splunk, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"): you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The **splunklib.asynchronous** module provides :class:`AsyncContext` and
+:class:`AsyncService`, non-blocking variants of
+:class:`splunklib.binding.Context` and :class:`splunklib.client.Service` for
+code that runs on a `Tornado <http://www.tornadoweb.org>`_ ``IOLoop``.
+
+Their request methods are Tornado coroutines, which return futures to yield
+from a ``gen.coroutine``::
+
+    from tornado import gen
+    import splunklib.asynchronous as asynchronous
+
+    @gen.coroutine
+    def count_results(query):
+        service = asynchronous.AsyncService(username="boris", password="natasha",
+                                            autologin=True)
+        yield service.login()
+        reader = service.export(query, earliest_time="-1h")
+        count = 0
+        while True:
+            results = yield reader.read()
+            if not results:
+                break
+            count += len(results)
+        raise gen.Return(count)
+
+URLs, namespaces, and sessions are handled by the same code as the
+:class:`splunklib.binding.Context`, so an ``AsyncContext`` and a ``Context``
+with the same credentials share one session. Requests go through a Tornado
+``AsyncHTTPClient`` of the context's own, which uses libcurl, keeping
+connections to splunkd open between requests, when ``pycurl`` is installed.
+Each export has a simple HTTP client of its own, which stops reading the
+results while the reader is behind and drops the connection when the
+reader is closed.
+"""
+
+import logging
+import sys
+import time
+from StringIO import StringIO
+from xml.etree.ElementTree import XML
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.queues import Queue
+from tornado.simple_httpclient import SimpleAsyncHTTPClient, _HTTPConnection
+from tornado.httpclient import HTTPRequest, HTTPError as _TornadoHTTPError
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    CurlAsyncHTTPClient = None
+
+from binding import Context, HTTPError, AuthenticationError, UrlEncoded, \
+    _NoAuthenticationToken, _encode, _parse_cookies, _handle_auth_error
+from client import PATH_INDEXES, MATCH_ENTRY_CONTENT, _filter_content, \
+    _load_atom, _load_atom_entries, _parse_atom_entry
+from data import record
+import results
+
+__all__ = [
+    "AsyncContext",
+    "AsyncService",
+    "ExportReader",
+]
+
+DEFAULT_MAX_CLIENTS = 10
+MAX_BODY_SIZE = 1 << 62
+# The batches of results an export may have waiting to be read
+EXPORT_QUEUE_SIZE = 16
+
+
+class AsyncContext(Context):
+    """This class is the non-blocking counterpart of
+    :class:`splunklib.binding.Context`, taking the same arguments except for
+    *handler*.
+
+    :meth:`get`, :meth:`post`, :meth:`delete`, :meth:`request`,
+    :meth:`login`, and :meth:`stream` are Tornado coroutines, which resolve
+    to the same response records as the methods of ``Context``, with the
+    body read into a ``StringIO``. Errors are raised from the futures as
+    :class:`splunklib.binding.HTTPError` and
+    :class:`splunklib.binding.AuthenticationError`, as they are by
+    ``Context``.
+
+    :param max_clients: The number of requests to run at once (optional);
+        others wait for one to finish.
+    :type max_clients: ``integer``
+    :param timeout: The connection and request time-out period, in seconds
+        (optional; requests don't time out by default).
+    :type timeout: ``integer``
+    :param key_file: A path to a PEM formatted file containing your private
+        key (optional).
+    :type key_file: ``string``
+    :param cert_file: A path to a PEM formatted file containing a
+        certificate chain file (optional).
+    :type cert_file: ``string``
+    """
+    def __init__(self, **kwargs):
+        super(AsyncContext, self).__init__(**kwargs)
+        self.timeout = kwargs.get("timeout")
+        self.key_file = kwargs.get("key_file")
+        self.cert_file = kwargs.get("cert_file")
+        max_clients = kwargs.get("max_clients", DEFAULT_MAX_CLIENTS)
+        # An HTTP client of our own, so neither its settings nor its queue
+        # are shared with the application's AsyncHTTPClient
+        if CurlAsyncHTTPClient is not None:
+            self.client = CurlAsyncHTTPClient(force_instance=True, max_clients=max_clients)
+        else:
+            # Exports stream far more than the simple client's default limit
+            self.client = SimpleAsyncHTTPClient(force_instance=True, max_clients=max_clients,
+                                                max_body_size=MAX_BODY_SIZE)
+        self._logging_in = None
+
+    def close(self):
+        """Closes the context's HTTP client."""
+        self.client.close()
+
+    @gen.coroutine
+    def _fetch(self, method, path, headers, body, streaming_callback=None, client=None):
+        """Sends one request and returns its response record, raising an
+        ``HTTPError`` for an error status.
+
+        With *streaming_callback*, the body of a successful response is
+        passed to it in chunks rather than returned. The request goes through
+        *client* if it's given, rather than the context's own.
+        """
+        url = self.authority + path
+        start = time.time()
+        status = [None]
+        error_body = []
+
+        def header_callback(line):
+            if line.startswith("HTTP/"):
+                status[0] = int(line.split(" ", 2)[1])
+
+        def stream(chunk):
+            # An error's body is kept for the HTTPError
+            if status[0] is not None and status[0] >= 400:
+                error_body.append(chunk)
+            else:
+                return streaming_callback(chunk)
+
+        request = HTTPRequest(
+            str(url), method=method, headers=dict(headers),
+            body=body, follow_redirects=False, validate_cert=False,
+            client_key=self.key_file, client_cert=self.cert_file,
+            connect_timeout=self.timeout, request_timeout=self.timeout or 0,
+            header_callback=header_callback if streaming_callback else None,
+            streaming_callback=stream if streaming_callback else None)
+        reply = yield (client or self.client).fetch(request, raise_error=False)
+        logging.debug("Operation took %s", time.time() - start)
+        if reply.code == 599:
+            raise reply.error
+
+        response = record({
+            'status': reply.code,
+            'reason': reply.reason,
+            'headers': [(key.lower(), value) for key, value in reply.headers.get_all()],
+            'body': StringIO(''.join(error_body) if error_body else reply.body or '')
+        })
+        if 400 <= response.status:
+            raise HTTPError(response)
+        for key, value in response.headers:
+            if key == "set-cookie":
+                _parse_cookies(value, self.get_cookies())
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def _authenticated(self, send):
+        """Calls *send*, which returns a future of a response, logged in as
+        :class:`splunklib.binding.Context` would be, and logging in again if
+        the session has expired when ``autologin`` is set.
+        """
+        session = self._session
+        generation = self._generation
+        now = time.time()
+        if self.autologin and self.username and self.password and \
+                session.used is not None and \
+                now - session.used > self.session_timeout * 0.9:
+            with _handle_auth_error("Autologin failed."):
+                yield self._login(generation)
+            generation = self._generation
+        session.used = now
+        if self.token is _NoAuthenticationToken and \
+                not self.has_cookies():
+            if self.autologin and self.username and self.password:
+                yield self.login()
+                generation = self._generation
+            else:
+                with _handle_auth_error("Request aborted: not logged in."):
+                    response = yield send()
+                raise gen.Return(response)
+        try:
+            response = yield send()
+        except HTTPError as he:
+            if he.status == 401 and self.autologin:
+                with _handle_auth_error("Autologin failed."):
+                    yield self._login(generation)
+                with _handle_auth_error(
+                        "Autologin succeeded, but there was an auth error on "
+                        "next request. Something is very wrong."):
+                    response = yield send()
+            elif he.status == 401 and not self.autologin:
+                raise AuthenticationError(
+                    "Request failed: Session is not logged in.", he)
+            else:
+                raise
+        raise gen.Return(response)
+
+    def _send(self, method, path, headers=None, body=None, streaming_callback=None,
+              client=None):
+        headers = list(headers or [])
+        # The headers are built for each try, as logging in changes them
+        return self._authenticated(
+            lambda: self._fetch(method, path, headers + self._auth_headers, body,
+                                streaming_callback, client))
+
+    def delete(self, path_segment, owner=None, app=None, sharing=None, **query):
+        """Performs a DELETE operation at the REST path segment with the given
+        namespace and query, as :meth:`splunklib.binding.Context.delete` does.
+
+        :return: A future of the response.
+        :rtype: ``Future``
+        """
+        path = self._abspath(path_segment, owner=owner, app=app, sharing=sharing)
+        if query:
+            path = path + UrlEncoded('?' + _encode(**query), skip_encode=True)
+        logging.debug("DELETE request to %s (body: %s)", path, repr(query))
+        return self._send("DELETE", path)
+
+    def get(self, path_segment, owner=None, app=None, sharing=None, **query):
+        """Performs a GET operation from the REST path segment with the given
+        namespace and query, as :meth:`splunklib.binding.Context.get` does.
+
+        :return: A future of the response.
+        :rtype: ``Future``
+        """
+        path = self._abspath(path_segment, owner=owner, app=app, sharing=sharing)
+        if query:
+            path = path + UrlEncoded('?' + _encode(**query), skip_encode=True)
+        logging.debug("GET request to %s (body: %s)", path, repr(query))
+        return self._send("GET", path)
+
+    def post(self, path_segment, owner=None, app=None, sharing=None, headers=None, **query):
+        """Performs a POST operation from the REST path segment with the given
+        namespace and query, as :meth:`splunklib.binding.Context.post` does.
+        A ``body`` argument is sent as the body, and the rest of the query
+        in the URL; otherwise the query is sent as a form.
+
+        :return: A future of the response.
+        :rtype: ``Future``
+        """
+        path, body = self._form(path_segment, owner, app, sharing, query)
+        headers = list(headers or []) + [("Content-Type", "application/x-www-form-urlencoded")]
+        logging.debug("POST request to %s (body: %s)", path, repr(query))
+        return self._send("POST", path, headers, body)
+
+    def request(self, path_segment, method="GET", headers=None, body="",
+                owner=None, app=None, sharing=None):
+        """Issues an arbitrary HTTP request to the REST path segment, as
+        :meth:`splunklib.binding.Context.request` does.
+
+        :return: A future of the response.
+        :rtype: ``Future``
+        """
+        path = self._abspath(path_segment, owner=owner, app=app, sharing=sharing)
+        logging.debug("%s request to %s (body: %s)", method, path, repr(body))
+        # Tornado refuses a body, even an empty one, for a GET
+        if method in ("GET", "DELETE", "HEAD") and not body:
+            body = None
+        return self._send(method, path, headers, body)
+
+    def stream(self, path_segment, callback, method="GET", owner=None, app=None,
+               sharing=None, **query):
+        """Issues a request whose response body is passed to *callback* a
+        chunk at a time as it arrives, rather than read into the response.
+
+        The query is sent in the URL for a ``GET`` and as a form for a
+        ``POST``. If the request fails, nothing is passed to *callback*.
+
+        :return: A future of the response, which is done once the body has
+            all been passed to *callback*.
+        :rtype: ``Future``
+        """
+        return self._stream(path_segment, callback, method, owner, app, sharing, query)
+
+    def _stream(self, path_segment, callback, method, owner, app, sharing, query, client=None):
+        if method == "GET":
+            path = self._abspath(path_segment, owner=owner, app=app, sharing=sharing)
+            if query:
+                path = path + UrlEncoded('?' + _encode(**query), skip_encode=True)
+            headers, body = [], None
+        else:
+            path, body = self._form(path_segment, owner, app, sharing, query)
+            headers = [("Content-Type", "application/x-www-form-urlencoded")]
+        logging.debug("%s request to %s (body: %s)", method, path, repr(query))
+        return self._send(method, path, headers, body, callback, client)
+
+    def _form(self, path_segment, owner, app, sharing, query):
+        path = self._abspath(path_segment, owner=owner, app=app, sharing=sharing)
+        if 'body' in query:
+            body = query.pop('body')
+            if query:
+                path = path + UrlEncoded('?' + _encode(**query), skip_encode=True)
+        else:
+            body = _encode(**query)
+        return path, body
+
+    @gen.coroutine
+    def login(self):
+        """Logs into the Splunk instance, as
+        :meth:`splunklib.binding.Context.login` does.
+
+        :raises AuthenticationError: Raised when login fails.
+        :return: A future of this ``AsyncContext``.
+        :rtype: ``Future``
+        """
+        if (self.has_cookies() or self.token is not _NoAuthenticationToken) and \
+                (not self.username and not self.password):
+            # Logged in with the session cookies or token we were given
+            raise gen.Return(self)
+        yield self._login(self._generation)
+        raise gen.Return(self)
+
+    @gen.coroutine
+    def _login(self, generation):
+        """Logs in unless the session has been renewed since this context took
+        the one of *generation*. Requests which need to log in while a login
+        is running wait for it rather than starting another.
+        """
+        session = self._session
+        if session.generation != generation:
+            self._use_session(session)
+            raise gen.Return(self)
+        if self._logging_in is None:
+            self._logging_in = Future()
+            try:
+                response = yield self._fetch(
+                    "POST", self._abspath("/services/auth/login"),
+                    [("Content-Type", "application/x-www-form-urlencoded")],
+                    _encode(username=self.username, password=self.password, cookie="1"))
+                key = XML(response.body.read()).findtext("./sessionKey")
+                with session.lock:
+                    session.token = "Splunk %s" % key
+                    session.cookies = dict(self.get_cookies())
+                    session.used = time.time()
+                    session.generation += 1
+                self._logging_in.set_result(None)
+            except Exception as e:
+                if isinstance(e, HTTPError) and e.status == 401:
+                    e = AuthenticationError("Login failed.", e)
+                self._logging_in.set_exception(e)
+            finally:
+                logging_in, self._logging_in = self._logging_in, None
+            yield logging_in
+        else:
+            yield self._logging_in
+        self._use_session(session)
+        raise gen.Return(self)
+
+
+class AsyncService(AsyncContext):
+    """This class is the non-blocking counterpart of
+    :class:`splunklib.client.Service`, for the calls an application serving
+    requests from an ``IOLoop`` makes most: server information, listing
+    entities such as indexes, and exporting search results.
+
+    It takes the same arguments as :class:`AsyncContext`.
+    """
+    @gen.coroutine
+    def info(self):
+        """Returns the information about this instance of Splunk.
+
+        :return: A future of the system information, as key-value pairs.
+        :rtype: ``Future``
+        """
+        response = yield self.get("/services/server/info")
+        raise gen.Return(_filter_content(_load_atom(response, MATCH_ENTRY_CONTENT)))
+
+    @gen.coroutine
+    def entities(self, path_segment, count=0, **query):
+        """Lists the entities of the collection at *path_segment*.
+
+        :param count: The maximum number of entities to return (optional;
+            all of them by default).
+        :type count: ``integer``
+        :return: A future of a ``list`` of entity states, records with the
+            same ``title``, ``content``, ``access``, and ``fields`` as the
+            state of a :class:`splunklib.client.Entity`.
+        :rtype: ``Future``
+        """
+        response = yield self.get(path_segment, count=count, **query)
+        entries = _load_atom_entries(response) or []
+        raise gen.Return([_parse_atom_entry(entry) for entry in entries])
+
+    def indexes(self, **query):
+        """Lists the indexes on this instance of Splunk.
+
+        :return: A future of a ``list`` of index states, as returned by
+            :meth:`entities`.
+        :rtype: ``Future``
+        """
+        return self.entities(PATH_INDEXES, **query)
+
+    def export(self, query, previews=False, **params):
+        """Runs a search and streams its results, as
+        :meth:`splunklib.client.Jobs.export` does.
+
+        The results are JSON (the ``output_mode`` defaults to ``json``), read
+        from the returned :class:`ExportReader` as they arrive.
+
+        :param query: The search query.
+        :type query: ``string``
+        :param previews: Whether to return preview results (optional).
+        :type previews: ``boolean``
+        :param params: Additional arguments for the export (optional).
+        :type params: ``dict``
+        :return: An ``ExportReader`` of the search's results.
+        :rtype: ``ExportReader``
+        """
+        params.setdefault("output_mode", "json")
+        if "exec_mode" in params:
+            raise TypeError("Cannot specify an exec_mode to export.")
+        client = _StreamingHTTPClient(force_instance=True, max_clients=1,
+                                      max_body_size=MAX_BODY_SIZE)
+        reader = ExportReader(previews, client)
+        params["search"] = query
+        future = self._stream("search/jobs/export", reader._feed, "POST",
+                              None, None, None, params, client)
+        IOLoop.current().add_future(future, reader._finish)
+        return reader
+
+
+class _StreamingConnection(_HTTPConnection):
+    """An ``_HTTPConnection`` whose streaming callback may return a future,
+    and which reads no more of the body until the future is done, and which
+    can be aborted."""
+    def data_received(self, chunk):
+        if self._should_follow_redirect():
+            return
+        if self.request.streaming_callback is not None:
+            return self.request.streaming_callback(chunk)
+        self.chunks.append(chunk)
+
+    def _on_connect(self, stream):
+        if self.final_callback is None:
+            # Aborted while connecting
+            stream.close()
+            return
+        super(_StreamingConnection, self)._on_connect(stream)
+
+    def abort(self):
+        if getattr(self, "stream", None) is not None:
+            # Ends the request through on_connection_close
+            self.stream.close()
+        elif self.final_callback is not None:
+            try:
+                raise _TornadoHTTPError(599, "Aborted")
+            except _TornadoHTTPError:
+                self._handle_exception(*sys.exc_info())
+
+
+class _StreamingHTTPClient(SimpleAsyncHTTPClient):
+    """A ``SimpleAsyncHTTPClient`` making :class:`_StreamingConnection`
+    requests, which aborts the ones still running when it's closed."""
+    def initialize(self, *args, **kwargs):
+        super(_StreamingHTTPClient, self).initialize(*args, **kwargs)
+        self._connections = []
+
+    def _connection_class(self):
+        def connect(*args, **kwargs):
+            connection = _StreamingConnection(*args, **kwargs)
+            self._connections.append(connection)
+            return connection
+        return connect
+
+    def close(self):
+        super(_StreamingHTTPClient, self).close()
+        connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.abort()
+
+
+class ExportReader(object):
+    """The results of an :meth:`AsyncService.export`, which arrive in the
+    background and are read a batch at a time.
+
+    Each :meth:`read` resolves to a ``list`` of the results which have
+    arrived since the last one: ``dict`` objects and
+    :class:`splunklib.results.Message` objects, as
+    :class:`splunklib.results.JSONResultsReader` returns. At the end of the
+    results it resolves to an empty list, or raises the error which ended
+    the export.
+
+    At most *maxsize* batches are kept waiting to be read; once that many
+    are, the export stops reading from splunkd until the reader catches up.
+
+    :param previews: Whether to return preview results (optional).
+    :type previews: ``boolean``
+    :param client: The HTTP client of the export, closed to abort it
+        (optional).
+    :type client: ``AsyncHTTPClient``
+    :param maxsize: The number of batches to keep waiting (optional).
+    :type maxsize: ``integer``
+    """
+    def __init__(self, previews=False, client=None, maxsize=EXPORT_QUEUE_SIZE):
+        self.previews = previews
+        self.is_preview = False
+        self._client = client
+        self._queue = Queue(maxsize=maxsize)
+        self._pending = []
+        self._done = False
+        self._closed = False
+
+    # Parses the complete lines received so far, returning a future which is
+    # done once there's room for their batch
+    def _feed(self, chunk):
+        if self._closed:
+            return None
+        end = chunk.rfind("\n")
+        if end == -1:
+            self._pending.append(chunk)
+            return None
+        self._pending.append(chunk[:end])
+        text = "".join(self._pending)
+        self._pending = [chunk[end+1:]]
+        batch = self._parse(text)
+        return self._queue.put(batch) if batch else None
+
+    def _parse(self, text):
+        reader = results.JSONResultsReader(StringIO(text))
+        batch = []
+        for item in reader:
+            if isinstance(item, dict):
+                self.is_preview = reader.is_preview
+                if self.is_preview and not self.previews:
+                    continue
+            batch.append(item)
+        return batch
+
+    # The end of the export goes in the queue whether or not there's room, as
+    # nothing is left to hold back
+    def _finish(self, future):
+        error = future.exception()
+        if self._client is not None:
+            self._client.close()
+        if self._closed:
+            return
+        if error is None:
+            tail = "".join(self._pending)
+            batch = self._parse(tail) if tail.strip() else None
+            if batch:
+                self._queue.put(batch)
+            self._queue.put(None)
+        else:
+            self._queue.put(future.exc_info())
+
+    @gen.coroutine
+    def read(self):
+        """Returns the next batch of results.
+
+        :return: A future of a ``list`` of results, empty at the end.
+        :rtype: ``Future``
+        """
+        if self._done:
+            raise gen.Return([])
+        item = yield self._queue.get()
+        if isinstance(item, list):
+            raise gen.Return(item)
+        self._done = True
+        if item is not None:
+            raise item[0], item[1], item[2]
+        raise gen.Return([])
+
+    def close(self):
+        """Aborts the export, dropping the results which haven't been read."""
+        self._closed = True
+        self._done = True
+        # Emptying the queue lets a feed waiting for room go on, to find the
+        # connection closed
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self._client is not None:
+            self._client.close()
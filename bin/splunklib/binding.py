@@ -24,13 +24,17 @@ If you want a friendlier interface to the Splunk REST API, use the
 :mod:`splunklib.client` module.
 """
 
+import hashlib
 import httplib
 import logging
+import select
 import socket
 import ssl
 import urllib
 import io
 import sys
+import threading
+import time
 import Cookie
 
 from datetime import datetime
@@ -50,9 +54,11 @@ from data import record
 __all__ = [
     "AuthenticationError",
     "connect",
+    "ConnectionPool",
     "Context",
     "handler",
-    "HTTPError"
+    "HTTPError",
+    "pooled_handler"
 ]
 
 # If you change these, update the docstring
@@ -61,6 +67,9 @@ DEFAULT_HOST = "localhost"
 DEFAULT_PORT = "8089"
 DEFAULT_SCHEME = "https"
 
+# Idle keep-alive connections kept per host by pooled_handler.
+DEFAULT_POOL_SIZE = 8
+
 def _log_duration(f):
     @wraps(f)
     def new_f(*args, **kwargs):
@@ -127,6 +136,39 @@ class _NoAuthenticationToken(object):
     pass
 
 
+class _Session(object):
+    """The session key of one login, shared by the :class:`Context` objects
+    using it.
+
+    ``generation`` counts logins, so a ``Context`` can tell whether the
+    session it holds has already been replaced. ``lock`` is only held while
+    logging in, so that one thread at a time does it.
+    """
+    def __init__(self):
+        self.token = _NoAuthenticationToken
+        self.cookies = {}
+        self.generation = 0
+        self.used = None
+        self.lock = threading.Lock()
+
+
+# Sessions shared by Contexts logging in with the same credentials, by
+# scheme, host, port, username, and a hash of the password.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _shared_session(scheme, host, port, username, password):
+    # hashlib only takes bytes, and would encode a unicode password as ASCII
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    key = (scheme, host, port, username, hashlib.sha256(password).hexdigest())
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _Session()
+        return session
+
+
 class UrlEncoded(str):
     """This class marks URL-encoded strings.
     It should be considered an SDK-private implementation detail.
@@ -268,6 +310,18 @@ def _authentication(request_fun):
     """
     @wraps(request_fun)
     def wrapper(self, *args, **kwargs):
+        session = self._session
+        generation = self._generation
+        now = time.time()
+        if self.autologin and self.username and self.password and \
+                session.used is not None and \
+                now - session.used > self.session_timeout * 0.9:
+            # splunkd expires sessions left idle for its sessionTimeout, so
+            # log in again now rather than wait for the request to fail.
+            with _handle_auth_error("Autologin failed."):
+                self._login(generation)
+            generation = self._generation
+        session.used = now
         if self.token is _NoAuthenticationToken and \
                 not self.has_cookies():
             # Not yet logged in.
@@ -289,8 +343,10 @@ def _authentication(request_fun):
                 # Authentication failed. Try logging in, and then
                 # rerunning the request. If either step fails, throw
                 # an AuthenticationError and give up.
+                # Another thread may have logged in again already, in which
+                # case this reuses its session.
                 with _handle_auth_error("Autologin failed."):
-                    self.login()
+                    self._login(generation)
                 with _handle_auth_error(
                         "Autologin succeeded, but there was an auth error on "
                         "next request. Something is very wrong."):
@@ -445,6 +501,14 @@ class Context(object):
     :param password: The password for the Splunk account.
     :type password: ``string``
     :param handler: The HTTP request handler (optional).
+    :param share_session: Whether to share the session with other ``Context``
+        objects logging in with the same username and password (the default
+        is ``True``), so that they log in once between them.
+    :type share_session: ``boolean``
+    :param session_timeout: splunkd's ``sessionTimeout`` in seconds (the
+        default is 3600). With ``autologin``, a session left idle for most of
+        this is renewed before the next request rather than after it fails.
+    :type session_timeout: ``integer``
     :returns: A ``Context`` instance.
 
     **Example**::
@@ -472,6 +536,12 @@ class Context(object):
         self.username = kwargs.get("username", "")
         self.password = kwargs.get("password", "")
         self.autologin = kwargs.get("autologin", False)
+        self.session_timeout = kwargs.get("session_timeout", 3600)
+        if kwargs.get("share_session", True) and self.username and self.password:
+            self._session = _shared_session(self.scheme, self.host, self.port, self.username, self.password)
+        else:
+            self._session = _Session()
+        self._generation = 0
 
         # Store any cookies in the self.http._cookies dict
         if kwargs.has_key("cookie") and kwargs['cookie'] not in [None, _NoAuthenticationToken]:
@@ -838,28 +908,53 @@ class Context(object):
             # logged in.
             return
 
-        # Only try to get a token and updated cookie if username & password are specified
-        try:
-            response = self.http.post(
-                self.authority + self._abspath("/services/auth/login"),
-                username=self.username,
-                password=self.password,
-                cookie="1") # In Splunk 6.2+, passing "cookie=1" will return the "set-cookie" header
-
-            body = response.body.read()
-            session = XML(body).findtext("./sessionKey")
-            self.token = "Splunk %s" % session
+        return self._login(self._generation)
+
+    def _login(self, generation):
+        """Logs in unless the session has been renewed since this ``Context``
+        took the one of *generation*, in which case it takes the new one.
+
+        Only one thread logs in at a time, the others wait for it and use
+        its session.
+        """
+        session = self._session
+        with session.lock:
+            if session.generation != generation:
+                self._use_session(session)
+                return self
+
+            # Only try to get a token and updated cookie if username & password are specified
+            try:
+                response = self.http.post(
+                    self.authority + self._abspath("/services/auth/login"),
+                    username=self.username,
+                    password=self.password,
+                    cookie="1") # In Splunk 6.2+, passing "cookie=1" will return the "set-cookie" header
+
+                body = response.body.read()
+                key = XML(body).findtext("./sessionKey")
+            except HTTPError as he:
+                if he.status == 401:
+                    raise AuthenticationError("Login failed.", he)
+                else:
+                    raise
+            session.token = "Splunk %s" % key
+            session.cookies = dict(self.get_cookies())
+            session.used = time.time()
+            session.generation += 1
+            self._use_session(session)
             return self
-        except HTTPError as he:
-            if he.status == 401:
-                raise AuthenticationError("Login failed.", he)
-            else:
-                raise
+
+    def _use_session(self, session):
+        self.token = session.token
+        self.http._cookies = dict(session.cookies)
+        self._generation = session.generation
 
     def logout(self):
         """Forgets the current session token, and cookies."""
         self.token = _NoAuthenticationToken
         self.http._cookies = {}
+        self._generation = 0
         return self
 
     def _abspath(self, path_segment,
@@ -1225,13 +1320,27 @@ class ResponseReader(io.RawIOBase):
     The ``ResponseReader`` class is intended to be a layer to unify the different
     types of HTTP libraries used with this SDK. This class also provides a
     preview of the stream and a few useful predicates.
+
+    It is a raw stream with a :meth:`readinto` which fills the caller's
+    buffer in place, so it can be wrapped in an ``io.BufferedReader`` by
+    callers which make many small reads.
     """
     # For testing, you can use a StringIO as the argument to
     # ``ResponseReader`` instead of an ``httplib.HTTPResponse``. It
     # will work equally well.
-    def __init__(self, response):
+    #
+    # ``release``, if given, is called once with ``True`` when the response
+    # has been read to the end, or ``False`` if it's closed before then.
+    def __init__(self, response, release=None):
         self._response = response
-        self._buffer = ''
+        # Bytes peeked at but not yet read
+        self._buffer = bytearray()
+        self._release = release
+
+    def _released(self, complete):
+        release, self._release = self._release, None
+        if release is not None:
+            release(complete)
 
     def __str__(self):
         return self.read()
@@ -1251,12 +1360,13 @@ class ResponseReader(io.RawIOBase):
         :type size: ``integer``
         """
         c = self.read(size)
-        self._buffer = self._buffer + c
+        self._buffer[0:0] = c
         return c
 
     def close(self):
         """Closes this response."""
         self._response.close()
+        self._released(False)
 
     def read(self, size = None):
         """Reads a given number of characters from the response.
@@ -1266,11 +1376,20 @@ class ResponseReader(io.RawIOBase):
         :type size: ``integer`` or "None"
 
         """
-        r = self._buffer
-        self._buffer = ''
-        if size is not None:
-            size -= len(r)
-        r = r + self._response.read(size)
+        if size is not None and size < 0:
+            size = None
+        buffered = len(self._buffer)
+        if not buffered:
+            r = self._response.read(size)
+        elif size is not None and size <= buffered:
+            r = str(self._buffer[:size])
+            del self._buffer[:size]
+            return r
+        else:
+            r = str(self._buffer) + self._response.read(None if size is None else size - buffered)
+            del self._buffer[:]
+        if self._release is not None and self._response.isclosed():
+            self._released(True)
         return r
 
     def readable(self):
@@ -1284,24 +1403,24 @@ class ResponseReader(io.RawIOBase):
         :type byte_array: ``bytearray`` or ``memoryview``
 
         """
-        max_size = len(byte_array)
-        data = self.read(max_size)
-        bytes_read = len(data)
-        byte_array[:bytes_read] = data
-        return bytes_read
-
-
-def handler(key_file=None, cert_file=None, timeout=None):
-    """This class returns an instance of the default HTTP request handler using
-    the values you provide.
-
-    :param `key_file`: A path to a PEM (Privacy Enhanced Mail) formatted file containing your private key (optional).
-    :type key_file: ``string``
-    :param `cert_file`: A path to a PEM (Privacy Enhanced Mail) formatted file containing a certificate chain file (optional).
-    :type cert_file: ``string``
-    :param `timeout`: The request time-out period, in seconds (optional).
-    :type timeout: ``integer`` or "None"
-    """
+        view = memoryview(byte_array)
+        size = len(view)
+        n = min(len(self._buffer), size)
+        if n:
+            view[:n] = self._buffer[:n]
+            del self._buffer[:n]
+            if n == size:
+                return n
+        data = self._response.read(size - n)
+        view[n:n+len(data)] = data
+        if self._release is not None and self._response.isclosed():
+            self._released(True)
+        return n + len(data)
+
+
+def _connector(key_file=None, cert_file=None, timeout=None):
+    """Returns a function that opens an unconnected ``httplib`` connection
+    for a scheme, host, and port, using the values you provide."""
 
     def connect(scheme, host, port):
         kwargs = {}
@@ -1318,18 +1437,41 @@ def handler(key_file=None, cert_file=None, timeout=None):
             return httplib.HTTPSConnection(host, port, **kwargs)
         raise ValueError("unsupported scheme: %s" % scheme)
 
+    return connect
+
+
+def _prepare(url, message):
+    """Splits a request's URL and returns it with the method, body, and
+    headers to send."""
+    scheme, host, port, path = _spliturl(url)
+    body = message.get("body", "")
+    head = {
+        "Content-Length": str(len(body)),
+        "Host": host,
+        "User-Agent": "splunk-sdk-python/1.5.0",
+        "Accept": "*/*",
+    } # defaults
+    for key, value in message["headers"]:
+        head[key] = value
+    method = message.get("method", "GET")
+    return scheme, host, port, path, method, body, head
+
+
+def handler(key_file=None, cert_file=None, timeout=None):
+    """This class returns an instance of the default HTTP request handler using
+    the values you provide.
+
+    :param `key_file`: A path to a PEM (Privacy Enhanced Mail) formatted file containing your private key (optional).
+    :type key_file: ``string``
+    :param `cert_file`: A path to a PEM (Privacy Enhanced Mail) formatted file containing a certificate chain file (optional).
+    :type cert_file: ``string``
+    :param `timeout`: The request time-out period, in seconds (optional).
+    :type timeout: ``integer`` or "None"
+    """
+    connect = _connector(key_file, cert_file, timeout)
+
     def request(url, message, **kwargs):
-        scheme, host, port, path = _spliturl(url)
-        body = message.get("body", "")
-        head = {
-            "Content-Length": str(len(body)),
-            "Host": host,
-            "User-Agent": "splunk-sdk-python/1.5.0",
-            "Accept": "*/*",
-        } # defaults
-        for key, value in message["headers"]:
-            head[key] = value
-        method = message.get("method", "GET")
+        scheme, host, port, path, method, body, head = _prepare(url, message)
 
         connection = connect(scheme, host, port)
         try:
@@ -1348,3 +1490,143 @@ def handler(key_file=None, cert_file=None, timeout=None):
         }
 
     return request
+
+
+# Errors which mean a kept-alive connection was closed by the server while
+# it sat in the pool, before it could carry the request.
+_STALE_ERRORS = (socket.error, httplib.BadStatusLine, httplib.CannotSendRequest)
+
+# Methods which can be sent again without repeating their effect on the server
+_IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+
+class ConnectionPool(object):
+    """Keeps idle keep-alive ``httplib`` connections per scheme, host, and
+    port so that requests can reuse them instead of opening a new TCP (and
+    TLS) connection each time.
+
+    A connection is checked out by one thread at a time and only returned to
+    the pool once its response has been read to the end. At most
+    ``max_size`` idle connections are kept per host; connections beyond that
+    are opened as needed and closed after use.
+
+    :param connect: A function returning a new connection for a scheme, host,
+        and port.
+    :param max_size: The number of idle connections kept per host.
+    :type max_size: ``integer``
+    """
+    def __init__(self, connect, max_size=DEFAULT_POOL_SIZE):
+        self.connect = connect
+        self.max_size = max_size
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, host, port):
+        """Returns a ``(connection, reused)`` pair, reusing an idle connection
+        if there's one that the server hasn't closed."""
+        key = (scheme, host, port)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                connection = idle.pop()
+            # An idle connection has nothing to read unless the server has
+            # hung up (or sent something unsolicited), either way it's done.
+            sock = connection.sock
+            if sock is not None and not select.select([sock], [], [], 0)[0]:
+                return connection, True
+            connection.close()
+        return self.connect(scheme, host, port), False
+
+    def put(self, scheme, host, port, connection):
+        """Returns a connection whose response has been fully read."""
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def idle(self):
+        """Returns the number of idle connections in the pool."""
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.itervalues())
+
+    def clear(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.itervalues():
+            for connection in connections:
+                connection.close()
+
+
+def pooled_handler(key_file=None, cert_file=None, timeout=None, max_size=DEFAULT_POOL_SIZE):
+    """Returns an HTTP request handler like :func:`handler`, except that it
+    keeps connections alive in a :class:`ConnectionPool` and reuses them. It
+    is safe to share between threads.
+
+    An idempotent request (``GET``, ``HEAD``, ``OPTIONS``, ``PUT``, or
+    ``DELETE``) which fails on a reused connection before any response
+    arrives is sent again once on a new connection, since the server may have
+    closed the connection while it was idle. Other requests, such as a
+    ``POST`` which the server may already have acted on, and requests which
+    time out are never sent again.
+
+    :param `key_file`: A path to a PEM (Privacy Enhanced Mail) formatted file containing your private key (optional).
+    :type key_file: ``string``
+    :param `cert_file`: A path to a PEM (Privacy Enhanced Mail) formatted file containing a certificate chain file (optional).
+    :type cert_file: ``string``
+    :param `timeout`: The request time-out period, in seconds (optional).
+    :type timeout: ``integer`` or "None"
+    :param `max_size`: The number of idle connections kept per host (optional).
+    :type max_size: ``integer``
+    """
+    pool = ConnectionPool(_connector(key_file, cert_file, timeout), max_size)
+
+    def send(connection, method, path, body, head):
+        try:
+            connection.request(method, path, body, head)
+            if timeout is not None:
+                connection.sock.settimeout(timeout)
+            return connection.getresponse()
+        except:
+            connection.close()
+            raise
+
+    def request(url, message, **kwargs):
+        scheme, host, port, path, method, body, head = _prepare(url, message)
+
+        connection, reused = pool.get(scheme, host, port)
+        try:
+            response = send(connection, method, path, body, head)
+        except _STALE_ERRORS as e:
+            if not reused or method not in _IDEMPOTENT_METHODS or \
+                    isinstance(e, socket.timeout):
+                raise
+            connection = pool.connect(scheme, host, port)
+            response = send(connection, method, path, body, head)
+
+        def release(complete):
+            if complete and not response.will_close:
+                pool.put(scheme, host, port, connection)
+            else:
+                connection.close()
+
+        body = ResponseReader(response, release)
+        if response.length == 0:
+            # Nothing to read (HEAD, 204, 304), so there may never be a read
+            # to hand the connection back.
+            body.read()
+
+        return {
+            "status": response.status,
+            "reason": response.reason,
+            "headers": response.getheaders(),
+            "body": body,
+        }
+
+    request.pool = pool
+    return request
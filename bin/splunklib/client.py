@@ -62,14 +62,22 @@ import datetime
 import json
 import urllib
 import logging
+import time
 from time import sleep
 from datetime import datetime, timedelta
 import socket
 import contextlib
+import gzip
+import math
+import sys
+import threading
+import Queue
+from StringIO import StringIO
 
 from binding import Context, HTTPError, AuthenticationError, namespace, UrlEncoded, _encode, _make_cookie_header
 from data import record
 import data
+import results
 
 __all__ = [
     "connect",
@@ -104,6 +112,9 @@ PATH_RECEIVERS_STREAM = "receivers/stream"
 PATH_RECEIVERS_SIMPLE = "receivers/simple"
 PATH_STORAGE_PASSWORDS = "storage/passwords"
 
+# Size of the bodies Index.submit_many posts to receivers/simple
+DEFAULT_BATCH_BYTES = 1024 * 1024
+
 XNAMEF_ATOM = "{http://www.w3.org/2005/Atom}%s"
 XNAME_ENTRY = XNAMEF_ATOM % "entry"
 XNAME_CONTENT = XNAMEF_ATOM % "content"
@@ -192,13 +203,14 @@ def _path(base, name):
 
 
 # Load an atom record from the body of the given response
-def _load_atom(response, match=None):
-    return data.load(response.body.read(), match)
+def _load_atom(response, match=None, lazy=False):
+    return data.load(response.body.read(), match, lazy)
 
 
-# Load an array of atom entries from the body of the given response
+# Load an array of atom entries from the body of the given response. The
+# entries are lazy records, each parsed only when it's used.
 def _load_atom_entries(response):
-    r = _load_atom(response)
+    r = _load_atom(response, lazy=True)
     if 'feed' in r:
         # Need this to handle a random case in the REST API
         if r.feed.get('totalResults') in [0, '0']:
@@ -235,7 +247,8 @@ def _parse_atom_entry(entry):
     # Host entry metadata
     metadata = _parse_atom_metadata(content)
 
-    # Filter some of the noise out of the content record
+    # Filter some of the noise out of the content record, leaving the values
+    # which are lazy records to be loaded when the entity's content is read
     content = record((k, v) for k, v in content.iteritems()
                      if k not in ['eai:acl', 'eai:attributes'])
 
@@ -275,6 +288,20 @@ def _parse_atom_metadata(content):
 
     return record({'access': access, 'fields': fields})
 
+# Load the lazy records in the given value, however deeply they're nested, so
+# that code reading the underlying dicts, such as json.dumps, sees everything.
+# Entity state stays lazy until its access, content or fields are read.
+def _loaded(value):
+    if isinstance(value, data.LazyRecord):
+        value.load()
+    if isinstance(value, dict):
+        for item in value.itervalues():
+            _loaded(item)
+    elif isinstance(value, list):
+        for item in value:
+            _loaded(item)
+    return value
+
 # kwargs: scheme, host, port, app, owner, username, password
 def connect(**kwargs):
     """This function connects and logs in to a Splunk instance.
@@ -371,6 +398,9 @@ class Service(_BaseService):
     :param `password`: The password, which is used to authenticate the Splunk
                        instance.
     :type password: ``string``
+    :param `cache_ttl`: Seconds to keep entity states in a :class:`StateCache`
+        (optional; the states are not cached by default).
+    :type cache_ttl: ``integer``
     :return: A :class:`Service` instance.
 
     **Example**::
@@ -388,6 +418,8 @@ class Service(_BaseService):
     def __init__(self, **kwargs):
         super(Service, self).__init__(**kwargs)
         self._splunk_version = None
+        cache_ttl = kwargs.get("cache_ttl")
+        self.cache = StateCache(cache_ttl) if cache_ttl else None
 
     @property
     def apps(self):
@@ -793,6 +825,107 @@ class Endpoint(object):
         return self.service.post(path, owner=owner, app=app, sharing=sharing, **query)
 
 
+class StateCache(object):
+    """A cache of entity states, shared by the entities of a :class:`Service`
+    created with ``cache_ttl``.
+
+    States are keyed by the entity's path in the service's namespace, so an
+    entity opened by its path finds the state stored when a collection listed
+    it, even though the listing placed it in its own namespace. Entities load
+    their state from the cache, without a round trip to the server, if it was
+    stored less than *ttl* seconds ago. When a listing stores the states of
+    two entities from different namespaces under one path, neither is kept,
+    and opening that path asks the server. :meth:`Entity.refresh` always asks the server, but when the
+    server sent an ``ETag`` or ``Last-Modified`` header with the cached state,
+    it makes a conditional request and keeps the cached state if it hasn't
+    changed. Concurrent loads of the same path share one request.
+
+    Posting to or deleting an entity drops its state from the cache.
+
+    :param ttl: The number of seconds to use a cached state for.
+    :type ttl: ``integer``
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._states = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the state cached for *key* if it is less than
+        :attr:`ttl` seconds old, otherwise ``None``.
+        """
+        entry = self._states.get(key.strip('/'))
+        if entry is None or time.time() - entry[1] >= self.ttl:
+            return None
+        return entry[0]
+
+    def put(self, key, state, validators=None, origin=None):
+        """Caches *state* for *key*, along with the ``(etag, last_modified)``
+        *validators* the server sent with it, if any.
+
+        *origin* is the entity's path in its own namespace. If a fresh state
+        from a different *origin* is already cached for *key*, the key is
+        ambiguous and neither state is kept.
+        """
+        key = key.strip('/')
+        now = time.time()
+        entry = self._states.get(key)
+        if origin is not None and entry is not None and \
+                entry[3] not in (None, origin) and now - entry[1] < self.ttl:
+            state, validators = None, None
+        self._states[key] = (state, now, validators, origin)
+
+    def load(self, key, fetch):
+        """Loads and caches the state for *key* by calling *fetch*.
+
+        *fetch* is called with the validators of the cached state, or
+        ``None``, and returns a ``(state, validators)`` pair, with a state of
+        ``None`` if the cached one is still current. If another thread is
+        already loading *key*, this waits for and returns its state instead.
+        """
+        key = key.strip('/')
+        with self._lock:
+            pending = self._loading.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._loading[key] = [threading.Event(), None, None]
+        if not leader:
+            pending[0].wait()
+            if pending[2] is not None:
+                raise pending[2][0], pending[2][1], pending[2][2]
+            return pending[1]
+        try:
+            entry = self._states.get(key)
+            state, validators = fetch(entry[2] if entry is not None else None)
+            if state is None:
+                state = entry[0]
+            self._states[key] = (state, time.time(), validators, None)
+            pending[1] = state
+            return state
+        except Exception:
+            pending[2] = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+            pending[0].set()
+
+    def discard(self, path):
+        """Drops the states cached for *path*, an absolute path or one
+        relative to any namespace.
+        """
+        path = path.strip('/')
+        suffix = '/' + path
+        for key in self._states.keys():
+            if key == path or key.endswith(suffix):
+                self._states.pop(key, None)
+
+    def clear(self):
+        """Drops every cached state."""
+        self._states.clear()
+
+
 # kwargs: path, app, owner, sharing, state
 class Entity(Endpoint):
     """This class is a base class for Splunk entities in the REST API, such as
@@ -832,7 +965,9 @@ class Entity(Endpoint):
 
     The state of an :class:`Entity` object is cached, so accessing a field
     does not contact the server. If you think the values on the
-    server have changed, call the :meth:`Entity.refresh` method.
+    server have changed, call the :meth:`Entity.refresh` method. If the
+    :class:`Service` was created with ``cache_ttl``, new entities take their
+    state from its :class:`StateCache` when it's recent enough.
     """
     # Not every endpoint in the API is an Entity or a Collection. For
     # example, a saved search at saved/searches/{name} has an additional
@@ -869,7 +1004,11 @@ class Entity(Endpoint):
         Endpoint.__init__(self, service, path)
         self._state = None
         if not kwargs.get('skip_refresh', False):
-            self.refresh(kwargs.get('state', None))  # "Prefresh"
+            state = kwargs.get('state', None)
+            if state is None:
+                self._state = self._cached_state()
+            if self._state is None:
+                self.refresh(state)  # "Prefresh"
         return
 
     def __contains__(self, item):
@@ -972,8 +1111,51 @@ class Entity(Endpoint):
         else:
             return (owner,app,sharing)
 
+    # The key of this entity's state in the service's StateCache, its path in
+    # the service's namespace, which is the same whether the entity was opened
+    # by its path or listed by a collection
+    def _cache_key(self):
+        return self.service._abspath(self.path)
+
+    # The path of this entity in its own namespace
+    def _own_path(self):
+        owner, app, sharing = self._proper_namespace()
+        return self.service._abspath(self.path, owner=owner, app=app, sharing=sharing)
+
+    def _cached_state(self):
+        cache = getattr(self.service, 'cache', None)
+        return None if cache is None else cache.get(self._cache_key())
+
+    def _uncache(self):
+        cache = getattr(self.service, 'cache', None)
+        if cache is not None:
+            cache.discard(self.path)
+
+    # Read the state from the server for StateCache.load, asking only for a
+    # changed one if the cached state came with validators
+    def _fetch_state(self, validators):
+        headers = []
+        if validators is not None:
+            etag, modified = validators
+            if etag is not None:
+                headers.append(('If-None-Match', etag))
+            if modified is not None:
+                headers.append(('If-Modified-Since', modified))
+        if headers:
+            response = self.service.request(self._own_path(), headers=headers)
+            if response.status == 304:
+                response.body.read()
+                return None, validators
+        else:
+            response = self.get()
+        state = self.read(response)
+        fields = dict(response.headers)
+        etag, modified = fields.get('etag'), fields.get('last-modified')
+        return state, (None if etag is None and modified is None else (etag, modified))
+
     def delete(self):
         owner, app, sharing = self._proper_namespace()
+        self._uncache()
         return self.service.delete(self.path, owner=owner, app=app, sharing=sharing)
 
     def get(self, path_segment="", owner=None, app=None, sharing=None, **query):
@@ -982,6 +1164,7 @@ class Entity(Endpoint):
 
     def post(self, path_segment="", owner=None, app=None, sharing=None, **query):
         owner, app, sharing = self._proper_namespace(owner, app, sharing)
+        self._uncache()
         return super(Entity, self).post(path_segment, owner=owner, app=app, sharing=sharing, **query)
 
     def refresh(self, state=None):
@@ -993,6 +1176,9 @@ class Entity(Endpoint):
         plus at most two additional round trips if
         the ``autologin`` field of :func:`connect` is set to ``True``.
 
+        With a :class:`StateCache`, the state is stored in the cache, and the
+        request is a conditional one when the server allows it.
+
         :param state: Entity-specific arguments (optional).
         :type state: ``dict``
         :raises EntityDeletedException: Raised if the entity no longer exists on
@@ -1005,8 +1191,13 @@ class Entity(Endpoint):
             search = s.apps['search']
             search.refresh()
         """
+        cache = getattr(self.service, 'cache', None)
         if state is not None:
             self._state = state
+            if cache is not None:
+                cache.put(self._cache_key(), state, origin=self._own_path())
+        elif cache is not None:
+            self._state = cache.load(self._cache_key(), self._fetch_state)
         else:
             self._state = self.read(self.get())
         return self
@@ -1018,7 +1209,7 @@ class Entity(Endpoint):
         :return: A :class:`splunklib.data.Record` object with three keys:
             ``owner``, ``app``, and ``sharing``.
         """
-        return self.state.access
+        return _loaded(self.state.access)
 
     @property
     def content(self):
@@ -1026,7 +1217,7 @@ class Entity(Endpoint):
 
         :return: A ``dict`` containing values.
         """
-        return self.state.content
+        return _loaded(self.state.content)
 
     def disable(self):
         """Disables the entity at this endpoint."""
@@ -1047,7 +1238,7 @@ class Entity(Endpoint):
         :return: A :class:`splunklib.data.Record` object with three keys:
             ``required``, ``optional``, and ``wildcard``.
         """
-        return self.state.fields
+        return _loaded(self.state.fields)
 
     @property
     def links(self):
@@ -1088,6 +1279,7 @@ class Entity(Endpoint):
 
         :return: A ``dict`` containing fields and metadata for the entity.
         """
+        if self._state is None: self._state = self._cached_state()
         if self._state is None: self.refresh()
         return self._state
 
@@ -1377,7 +1569,9 @@ class ReadOnlyCollection(Endpoint):
         :type offset: ``integer``
         :param count: The maximum number of entities to return (optional).
         :type count: ``integer``
-        :param pagesize: The number of entities to load (optional).
+        :param pagesize: The number of entities to load per round trip
+            (optional). Only one page of entities is held at a time, so
+            iterating over a large collection this way uses constant memory.
         :type pagesize: ``integer``
         :param kwargs: Additional arguments (optional):
 
@@ -1407,13 +1601,20 @@ class ReadOnlyCollection(Endpoint):
             count = self.null_count
         fetched = 0
         while count == self.null_count or fetched < count:
-            response = self.get(count=pagesize or count, offset=offset, **kwargs)
+            # Never ask for more than are left of count
+            if pagesize is None:
+                limit = count
+            elif count == self.null_count:
+                limit = pagesize
+            else:
+                limit = min(pagesize, count - fetched)
+            response = self.get(count=limit, offset=offset, **kwargs)
             items = self._load_list(response)
             N = len(items)
             fetched += N
             for item in items:
                 yield item
-            if pagesize is None or N < pagesize:
+            if pagesize is None or N < limit:
                 break
             offset += N
             logging.debug("pagesize=%d, fetched=%d, offset=%d, N=%d, kwargs=%s", pagesize, fetched, offset, N, kwargs)
@@ -1533,6 +1734,7 @@ class Collection(ReadOnlyCollection):
             params['owner'] = namespace.owner
             params['app'] = namespace.app
             params['sharing'] = namespace.sharing
+        self._uncache(UrlEncoded(name, encode_slash=True))
         response = self.post(name=name, **params)
         atom = _load_atom(response, XNAME_ENTRY)
         if atom is None:
@@ -1579,6 +1781,7 @@ class Collection(ReadOnlyCollection):
             params['owner'] = namespace.owner
             params['app'] = namespace.app
             params['sharing'] = namespace.sharing
+        self._uncache(name)
         try:
             self.service.delete(_path(self.path, name), **params)
         except HTTPError as he:
@@ -1591,6 +1794,13 @@ class Collection(ReadOnlyCollection):
                 raise
         return self
 
+    # Drop the cached states of the entity called name, which is being
+    # created or deleted
+    def _uncache(self, name):
+        cache = getattr(self.service, 'cache', None)
+        if cache is not None:
+            cache.discard(_path(self.path, name))
+
     def get(self, name="", owner=None, app=None, sharing=None, **query):
         """Performs a GET request to the server on the collection.
 
@@ -1946,8 +2156,8 @@ class Index(Entity):
                    "X-Splunk-Input-Mode: Streaming\r\n",
                    "\r\n"]
         
-        for h in headers:
-            sock.write(h)
+        # sendall rather than write, which plain (non SSL) sockets don't have
+        sock.sendall(''.join(headers))
         return sock
 
     @contextlib.contextmanager
@@ -2060,8 +2270,66 @@ class Index(Entity):
         # The reason we use service.request directly rather than POST
         # is that we are not sending a POST request encoded using
         # x-www-form-urlencoded (as we do not have a key=value body),
-        # because we aren't really sending a "form".
-        self.service.post(PATH_RECEIVERS_SIMPLE, body=event, **args)
+        # because we aren't really sending a "form".  Reading the response
+        # lets a pooled handler reuse the connection.
+        self.service.post(PATH_RECEIVERS_SIMPLE, body=event, **args).body.read()
+        return self
+
+    def submit_many(self, events, host=None, source=None, sourcetype=None,
+                    batch_bytes=DEFAULT_BATCH_BYTES, compress=False):
+        """Submits many events to the index, packing them into as few
+        ``HTTP POST`` requests as possible.
+
+        Events are sent newline-delimited in bodies of up to ``batch_bytes``
+        (an event longer than that is sent on its own), so the sourcetype
+        should break events on newlines. Create the :class:`Service` with
+        :func:`splunklib.binding.pooled_handler` to also reuse its
+        connections between requests.
+
+        :param events: The events to submit.
+        :type events: ``iterable`` of ``string``
+        :param `host`: The host value of the events.
+        :type host: ``string``
+        :param `source`: The source value of the events.
+        :type source: ``string``
+        :param `sourcetype`: The sourcetype value of the events.
+        :type sourcetype: ``string``
+        :param `batch_bytes`: The largest body to send, in bytes.
+        :type batch_bytes: ``integer``
+        :param `compress`: Whether to gzip each body and send it with
+            ``Content-Encoding: gzip``.
+        :type compress: ``boolean``
+
+        :return: The :class:`Index`.
+        """
+        args = { 'index': self.name }
+        if host is not None: args['host'] = host
+        if source is not None: args['source'] = source
+        if sourcetype is not None: args['sourcetype'] = sourcetype
+        headers = [('Content-Encoding', 'gzip')] if compress else []
+
+        def send(batch):
+            body = ''.join(batch)
+            if compress:
+                buf = StringIO()
+                with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                    f.write(body)
+                body = buf.getvalue()
+            self.service.post(PATH_RECEIVERS_SIMPLE, headers=headers, body=body, **args).body.read()
+
+        batch = []
+        size = 0
+        for event in events:
+            if not event.endswith('\n'):
+                event += '\n'
+            if batch and size + len(event) > batch_bytes:
+                send(batch)
+                batch = []
+                size = 0
+            batch.append(event)
+            size += len(event)
+        if batch:
+            send(batch)
         return self
 
     # kwargs: host, host_regex, host_segment, rename-source, sourcetype
@@ -2875,6 +3143,27 @@ class Job(Entity):
         return self
 
 
+# What Jobs.export_parallel's threads queue for its reader
+_EXPORT_RESULT = "result"
+_EXPORT_ERROR = "error"
+_EXPORT_DONE = "done"
+
+def _time_slices(earliest, latest, slices, span=None):
+    """Splits the range from *earliest* to *latest* into at most *slices*
+    ``(start, end)`` pairs, starting on multiples of *span* seconds since the
+    epoch if it's given."""
+    if span and span >= 86400:
+        raise ValueError("Splunk bins spans of a day or more from local midnight, "
+                         "so slices can't be aligned to a span of %s seconds." % span)
+    step = (latest - earliest) / float(max(slices, 1))
+    edges = [earliest + step * x for x in xrange(1, slices)]
+    if span:
+        edges = [math.floor(edge / span) * span for edge in edges]
+    edges = sorted(set(edge for edge in edges if earliest < edge < latest))
+    bounds = [earliest] + edges + [latest]
+    return zip(bounds[:-1], bounds[1:])
+
+
 class Jobs(Collection):
     """This class represents a collection of search jobs. Retrieve this
     collection using :meth:`Service.jobs`."""
@@ -2964,6 +3253,148 @@ class Jobs(Collection):
                          search=query,
                          **params).body
 
+    def export_parallel(self, query, earliest, latest, slices=4, ordered=True,
+                        reverse=False, span=None, buffer_size=1000, **params):
+        """Runs a search as several concurrent exports, each over a slice of
+        the time range, and returns their results as one stream.
+
+        The range from ``earliest`` to ``latest`` is split into ``slices``
+        equal slices, each exported by its own thread. Unlike :meth:`export`,
+        this returns parsed results: ``dict`` objects and
+        :class:`splunklib.results.Message` objects, without preview results::
+
+            import splunklib.client as client
+            service = client.connect(...)
+            now = time.time()
+            for result in service.jobs.export_parallel("search index=main | fields _time host",
+                                                       now - 86400, now, slices=8):
+                print result
+
+        With ``ordered`` (the default), all of the earliest slice's results
+        come first, then the next slice's, and so on, or the latest slice's
+        first with ``reverse``. Within a slice, results come in the search's
+        own order, so a search sorted by time ascending (or, with
+        ``reverse``, descending, as raw events are) gives one stream sorted
+        by time. Otherwise results come as soon as any slice has them. Each
+        slice buffers at most ``buffer_size`` results that haven't been
+        returned yet, so a slow reader holds the exports back rather than
+        memory growing.
+
+        Create the :class:`Service` with
+        :func:`splunklib.binding.pooled_handler` so that exports reuse
+        connections.
+
+        :param query: The search query.
+        :type query: ``string``
+        :param earliest: The start of the time range, inclusive, in seconds
+            since the epoch.
+        :type earliest: ``float``
+        :param latest: The end of the time range, exclusive, in seconds since
+            the epoch.
+        :type latest: ``float``
+        :param slices: The number of exports to run.
+        :type slices: ``integer``
+        :param ordered: Whether to return the slices' results in time order.
+        :type ordered: ``boolean``
+        :param reverse: Whether to return the latest slice's results first.
+        :type reverse: ``boolean``
+        :param span: If given, slices start on multiples of this many seconds
+            since the epoch, so that a search binning ``_time`` by this span
+            never splits a bin between two slices. The multiples are in UTC,
+            so they only match Splunk's bins for spans shorter than a day,
+            and in time zones offset from UTC by a fraction of an hour, only
+            for spans which divide that offset.
+        :type span: ``integer``
+        :raises ValueError: Raised for a ``span`` of a day or more, which
+            Splunk bins from local midnight.
+        :param buffer_size: The results each slice may buffer.
+        :type buffer_size: ``integer``
+        :param params: Additional arguments for :meth:`export` (optional).
+            ``output_mode`` defaults to ``json``.
+        :type params: ``dict``
+
+        :return: An iterator over the results and messages.
+        """
+        if "exec_mode" in params:
+            raise TypeError("Cannot specify an exec_mode to export.")
+        if "earliest_time" in params or "latest_time" in params:
+            raise TypeError("Specify the time range as earliest and latest.")
+        params.setdefault('output_mode', 'json')
+        reader = results.JSONResultsReader if params['output_mode'] == 'json' else results.ResultsReader
+        bounds = _time_slices(earliest, latest, slices, span)
+        return self._merge_exports(query, bounds, reader, ordered, reverse, buffer_size, params)
+
+    def _merge_exports(self, query, bounds, reader, ordered, reverse, buffer_size, params):
+        stop = threading.Event()
+        # Every export's stream, so that stopping can abort the ones blocked
+        # waiting for the server
+        streams = []
+        if ordered:
+            queues = [Queue.Queue(buffer_size) for x in bounds]
+        else:
+            queues = [Queue.Queue(buffer_size * len(bounds))] * len(bounds)
+
+        def put(queue, item):
+            # Gives up once the reader has gone away, rather than blocking
+            # on a full queue forever
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def produce(queue, start, end):
+            try:
+                stream = self.export(query, earliest_time='%.6f' % start,
+                                     latest_time='%.6f' % end, **params)
+                streams.append(stream)
+                try:
+                    if stop.is_set():
+                        return
+                    items = reader(stream)
+                    for item in items:
+                        if isinstance(item, dict) and items.is_preview:
+                            continue
+                        if not put(queue, (_EXPORT_RESULT, item)):
+                            return
+                finally:
+                    stream.close()
+            except Exception:
+                put(queue, (_EXPORT_ERROR, sys.exc_info()))
+            put(queue, (_EXPORT_DONE, None))
+
+        for (queue, (start, end)) in zip(queues, bounds):
+            thread = threading.Thread(target=produce, args=(queue, start, end))
+            thread.daemon = True
+            thread.start()
+
+        try:
+            if ordered:
+                for queue in (reversed(queues) if reverse else queues):
+                    while True:
+                        kind, item = queue.get()
+                        if kind is _EXPORT_DONE:
+                            break
+                        if kind is _EXPORT_ERROR:
+                            raise item[0], item[1], item[2]
+                        yield item
+            else:
+                running = len(bounds)
+                while running:
+                    kind, item = queues[0].get()
+                    if kind is _EXPORT_DONE:
+                        running -= 1
+                    elif kind is _EXPORT_ERROR:
+                        raise item[0], item[1], item[2]
+                    else:
+                        yield item
+        finally:
+            stop.set()
+            for stream in list(streams):
+                stream.close()
+
     def itemmeta(self):
         """There is no metadata available for class:``Jobs``.
 
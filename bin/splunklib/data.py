@@ -16,9 +16,12 @@
 format, which is the format used by most of the REST API.
 """
 
-from xml.etree.ElementTree import XML
+try:
+    from xml.etree.cElementTree import XML
+except ImportError:
+    from xml.etree.ElementTree import XML
 
-__all__ = ["load"]
+__all__ = ["load", "LazyRecord"]
 
 # LNAME refers to element names without namespaces; XNAME is the same
 # name, but with an XML namespace.
@@ -55,24 +58,30 @@ def localname(xname):
     rcurly = xname.find('}')
     return xname if rcurly == -1 else xname[rcurly+1:]
 
-def load(text, match=None):
+def load(text, match=None, lazy=False):
     """This function reads a string that contains the XML of an Atom Feed, then 
     returns the 
     data in a native Python structure (a ``dict`` or ``list``). If you also 
     provide a tag name or path to match, only the matching sub-elements are 
     loaded.
 
+    If *lazy* is ``True``, nested records are returned as :class:`LazyRecord`
+    views of their elements, which are only loaded when they are first used.
+
     :param text: The XML text to load.
     :type text: ``string``
     :param match: A tag name or path to match (optional).
     :type match: ``string``
+    :param lazy: Whether to defer loading nested records (optional).
+    :type lazy: ``boolean``
     """
     if text is None: return None
     text = text.strip()
     if len(text) == 0: return None
     nametable = {
         'namespaces': [],
-        'names': {}
+        'names': {},
+        'lazy': lazy
     }
     root = XML(text)
     items = [root] if match is None else root.findall(match)
@@ -99,7 +108,10 @@ def load_dict(element, nametable = None):
     for child in children:
         assert iskey(child.tag)
         name = child.attrib["name"]
-        value[name] = load_value(child, nametable)
+        if deferrable(child, nametable):
+            value[name] = LazyRecord(child, load_value, nametable)
+        else:
+            value[name] = load_value(child, nametable)
     return value
 
 # Loads the given elements attrs & value into single merged dict.
@@ -125,6 +137,18 @@ def load_elem(element, nametable=None):
             value[key] = val
     return name, value
 
+# Loads the given element's merged attrs & value, without its name.
+def load_elem_value(element, nametable=None):
+    return load_elem(element, nametable)[1]
+
+# True if the given element loads as a record which, for a lazy load, can
+# wait until it's used: one with children other than a single <list>.
+def deferrable(element, nametable):
+    if nametable is None or not nametable.get('lazy'): return False
+    count = len(element)
+    if count == 0: return False
+    return count > 1 or not islist(element[0].tag)
+
 # Parse a <list> element and return a Python list
 def load_list(element, nametable=None):
     assert islist(element.tag)
@@ -167,7 +191,11 @@ def load_value(element, nametable=None):
 
     value = record()
     for child in children:
-        name, item = load_elem(child, nametable)
+        if deferrable(child, nametable):
+            name = localname(child.tag)
+            item = LazyRecord(child, load_elem_value, nametable)
+        else:
+            name, item = load_elem(child, nametable)
         # If we have seen this name before, promote the value to a list
         if value.has_key(name):
             current = value[name]
@@ -244,7 +272,63 @@ class Record(dict):
         if len(result) == 0:
             raise KeyError("No key or prefix: %s" % key)
         return result
-    
+
+
+class LazyRecord(Record):
+    """A :class:`Record` which loads the element it was created from the first
+    time it is used.
+
+    Only one level is loaded at a time, so the records nested within a lazy
+    record are lazy too, and a large Atom feed can be walked entry by entry
+    without building the records for the parts that are never read. Loading is
+    idempotent, so a lazy record can be shared between threads.
+
+    The ``dict`` methods all load the record first, but code which reads the
+    underlying ``dict`` directly, such as ``dict(r)``, ``json.dumps(r)`` or
+    ``f(**r)``, sees an empty dictionary until the record has been loaded;
+    call :meth:`load` first in that case.
+
+    The *loader* is called as ``loader(element, nametable)`` and returns the
+    record's contents; *element* may be any value the loader accepts.
+    """
+    def __init__(self, element, loader, nametable=None):
+        Record.__init__(self)
+        object.__setattr__(self, '_element', element)
+        object.__setattr__(self, '_loader', loader)
+        object.__setattr__(self, '_nametable', nametable)
+
+    def load(self):
+        """Loads the record from its element, if that hasn't been done yet.
+
+        :return: This record.
+        :rtype: ``LazyRecord``
+        """
+        element = self._element
+        if element is not None:
+            dict.update(self, self._loader(element, self._nametable))
+            object.__setattr__(self, '_element', None)
+        return self
+
+    def __reduce__(self):
+        return (record, (dict(self.load()),))
+
+def _loading(name):
+    method = getattr(Record, name)
+    def wrapper(self, *args, **kwargs):
+        self.load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for name in ('__getitem__', '__setitem__', '__delitem__', '__contains__',
+             '__iter__', '__len__', '__repr__', '__eq__', '__ne__', '__cmp__',
+             'clear', 'copy', 'get', 'has_key', 'items', 'iteritems',
+             'iterkeys', 'itervalues', 'keys', 'pop', 'popitem', 'setdefault',
+             'update', 'values', 'viewitems', 'viewkeys', 'viewvalues'):
+    setattr(LazyRecord, name, _loading(name))
+del name
+
 
 def record(value=None): 
     """This function returns a :class:`Record` instance constructed with an 
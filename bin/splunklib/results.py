@@ -30,8 +30,14 @@ as follows:::
     for item in reader:
         print(item)
     print "Results are a preview: %s" % reader.is_preview
+
+For streams requested with ``output_mode=json``, :class:`JSONResultsReader`
+works the same way and is several times faster.
 """
 
+import json
+import re
+
 try:
     import xml.etree.cElementTree as et
 except:
@@ -49,6 +55,7 @@ except:
 
 __all__ = [
     "ResultsReader",
+    "JSONResultsReader",
     "Message"
 ]
 
@@ -95,15 +102,17 @@ class _ConcatenatedStream(object):
 
         If *n* is ``None``, return all available characters.
         """
-        response = ""
+        response = []
         while len(self.streams) > 0 and (n is None or n > 0):
             txt = self.streams[0].read(n)
-            response += txt
+            # A stream may return fewer than n characters before its end,
+            # only an empty read means it's finished
+            if n is None or txt == "":
+                del self.streams[0]
+            response.append(txt)
             if n is not None:
                 n -= len(txt)
-            if n > 0 or n is None:
-                del self.streams[0]
-        return response
+        return "".join(response)
 
 class _XMLDTDFilter(object):
     """Lazily remove all XML DTDs from a stream.
@@ -120,33 +129,46 @@ class _XMLDTDFilter(object):
     """
     def __init__(self, stream):
         self.stream = stream
+        # A "<" held back from the end of the last read, which might start
+        # a DTD, and whether the last read ended inside a DTD
+        self._pending = ""
+        self._in_dtd = False
 
     def read(self, n=None):
         """Read at most *n* characters from this stream.
 
         If *n* is ``None``, return all available characters.
         """
-        response = ""
-        while n is None or n > 0:
-            c = self.stream.read(1)
-            if c == "":
-                break
-            elif c == "<":
-                c += self.stream.read(1)
-                if c == "<?":
-                    while True:
-                        q = self.stream.read(1)
-                        if q == ">":
-                            break
-                else:
-                    response += c
-                    if n is not None:
-                        n -= len(c)
-            else:
-                response += c
-                if n is not None:
-                    n -= 1
-        return response
+        while True:
+            chunk = self.stream.read(n)
+            eof = chunk == ""
+            data = self._pending + chunk
+            self._pending = ""
+            response = []
+            x = 0
+            while True:
+                if self._in_dtd:
+                    end = data.find(">", x)
+                    if end == -1:
+                        break
+                    self._in_dtd = False
+                    x = end + 1
+                start = data.find("<?", x)
+                if start == -1:
+                    if not eof and data.endswith("<"):
+                        response.append(data[x:-1])
+                        self._pending = "<"
+                    else:
+                        response.append(data[x:])
+                    break
+                response.append(data[x:start])
+                self._in_dtd = True
+                x = start + 2
+            response = "".join(response)
+            # Keep reading if this chunk was all DTD, since an empty
+            # string means the end of the stream
+            if response or eof:
+                return response
 
 class ResultsReader(object):
     """This class returns dictionaries and Splunk messages from an XML results
@@ -286,3 +308,136 @@ class ResultsReader(object):
 
 
 
+
+
+class JSONResultsReader(object):
+    """This class returns dictionaries and Splunk messages from a JSON results
+    stream, one requested with ``output_mode=json``.
+
+    ``JSONResultsReader`` is used like :class:`ResultsReader`: it is iterable,
+    returns a ``dict`` for results, or a :class:`Message` object for Splunk
+    messages, and has an ``is_preview`` field. Field values are ``unicode``
+    strings, or lists of them for multivalued fields.
+
+    It reads both the newline-delimited objects that the
+    ``search/jobs/export`` endpoint streams, one result each, and the single
+    object with a ``results`` list that a job's results endpoints return,
+    even pretty-printed over several lines. Each read of a newline-delimited
+    stream is parsed with one call to the C JSON decoder rather than an
+    element at a time.
+
+    :param `stream`: The stream to read from (any object that supports
+        ``.read()``).
+    :param `chunk_size`: The number of bytes to read from the stream at a
+        time.
+
+    **Example**::
+
+        import results
+        response = service.jobs.export("search *", output_mode="json")
+        reader = results.JSONResultsReader(response)
+        for result in reader:
+            if isinstance(result, dict):
+                print "Result: %s" % result
+            elif isinstance(result, results.Message):
+                print "Message: %s" % result
+        print "is_preview = %s " % reader.is_preview
+    """
+    def __init__(self, stream, chunk_size=65536):
+        self.is_preview = None
+        self._gen = self._parse_results(stream, chunk_size)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._gen.next()
+
+    def _parse_results(self, stream, chunk_size):
+        """Parse results and messages out of *stream*."""
+        for doc in _json_documents(stream, chunk_size):
+            if 'preview' in doc:
+                self.is_preview = doc['preview']
+            for message in doc.get('messages') or ():
+                yield Message(message.get('type'), message.get('text', ''))
+            result = doc.get('result')
+            if result is not None:
+                yield result
+            for result in doc.get('results') or ():
+                yield result
+
+
+_WHITESPACE = re.compile(r'\s*')
+
+def _json_documents(stream, chunk_size):
+    """Generate the JSON objects in *stream*, which has one per line.
+
+    The complete lines of each read are decoded together, as the elements of
+    one JSON array, which is much faster than decoding them one by one. If
+    that fails, the objects span lines, and the rest of the stream is decoded
+    by :func:`_spanning_json_documents` instead.
+    """
+    loads = json.loads
+    pending = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind("\n")
+        if end == -1:
+            pending.append(chunk)
+            continue
+        pending.append(chunk[:end])
+        text = "".join(pending)
+        lines = [line for line in text.split("\n") if line.strip()]
+        pending = [chunk[end+1:]]
+        if lines:
+            try:
+                docs = loads("[" + ",".join(lines) + "]")
+            except ValueError:
+                for doc in _spanning_json_documents(stream, chunk_size, text + "\n" + pending[0]):
+                    yield doc
+                return
+            for doc in docs:
+                yield doc
+    # A single object such as a job's results may not end with a newline
+    tail = "".join(pending)
+    if tail.strip():
+        yield loads(tail)
+
+def _spanning_json_documents(stream, chunk_size, text):
+    """Generate the JSON objects in *text* followed by *stream*, however they
+    are laid out over lines.
+
+    An object which doesn't decode may just be incomplete, so it is tried
+    again once the text held has at least doubled, which keeps a large
+    object from being decoded once per read.
+    """
+    decode = json.JSONDecoder().raw_decode
+    x = 0
+    eof = False
+    while True:
+        x = _WHITESPACE.match(text, x).end()
+        if x < len(text):
+            try:
+                doc, x = decode(text, x)
+                yield doc
+                continue
+            except ValueError:
+                # Only an error once there's nothing more to read
+                if eof:
+                    raise
+        elif eof:
+            return
+        text = [text[x:]]
+        x = 0
+        held = len(text[0])
+        need = max(2 * held, 1)
+        while held < need:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                eof = True
+                break
+            text.append(chunk)
+            held += len(chunk)
+        text = "".join(text)
@@ -0,0 +1,76 @@
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+import asynchronous
+
+RESULT = '{"preview":false,"offset":0,"result":{"n":"1"}}\n'
+
+class ExportReaderTest(AsyncTestCase):
+    @gen_test
+    def test_feed_waits_for_room(self):
+        reader = asynchronous.ExportReader(maxsize=1)
+        self.assertTrue(reader._feed(RESULT).done())
+        waiting = reader._feed(RESULT)
+        self.assertFalse(waiting.done())
+        batch = yield reader.read()
+        self.assertEqual(batch, [{'n': '1'}])
+        self.assertTrue(waiting.done())
+
+    @gen_test
+    def test_partial_lines_wait(self):
+        reader = asynchronous.ExportReader(maxsize=1)
+        self.assertEqual(reader._feed(RESULT[:10]), None)
+        yield reader._feed(RESULT[10:])
+        batch = yield reader.read()
+        self.assertEqual(batch, [{'n': '1'}])
+
+class EndlessExport(RequestHandler):
+    """Streams results until the client goes away."""
+    def initialize(self, state):
+        self.state = state
+
+    @gen.coroutine
+    def post(self):
+        self.state['sent'] = 0
+        while not self.state.get('closed'):
+            self.write(RESULT * 100)
+            self.state['sent'] += 1
+            yield self.flush()
+            yield gen.moment
+
+    def on_connection_close(self):
+        self.state['closed'] = True
+
+class ExportTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.state = {}
+        return Application([('/services/search/jobs/export', EndlessExport, dict(state=self.state))])
+
+    @gen_test
+    def test_close_aborts_export(self):
+        service = asynchronous.AsyncService(scheme='http', host='127.0.0.1',
+                                            port=self.get_http_port(), token='Splunk token')
+        reader = service.export('search *')
+        batch = yield reader.read()
+        self.assertEqual(batch[0], {'n': '1'})
+        # The reader is behind, so the export stops reading
+        yield gen.sleep(0.2)
+        sent = self.state['sent']
+        yield gen.sleep(0.2)
+        self.assertEqual(self.state['sent'], sent)
+        reader.close()
+        for x in range(50):
+            if self.state.get('closed'):
+                break
+            yield gen.sleep(0.01)
+        self.assertTrue(self.state.get('closed'))
+        batch = yield reader.read()
+        self.assertEqual(batch, [])
+        service.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import BaseHTTPServer
+import httplib
+import threading
+import unittest
+
+import binding
+
+class ForgetfulHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers the first request on a connection and hangs up on the next
+    one without answering it, like a server which has just timed out an idle
+    keep-alive connection."""
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self.rfile.read(length)
+        self.server.requests.append((self.command, self.path))
+        if getattr(self, 'answered', False):
+            self.close_connection = 1
+            return
+        self.answered = True
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    do_GET = do_POST = handle_request
+
+    def log_message(self, *args):
+        pass
+
+class PooledHandlerRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ForgetfulHandler)
+        self.server.requests = []
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.request = binding.pooled_handler()
+
+    def tearDown(self):
+        self.request.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def prime(self):
+        response = self.request(self.url + '/first', {'method': 'GET', 'headers': []})
+        self.assertEqual(response['body'].read(), 'ok')
+        self.assertEqual(self.request.pool.idle(), 1)
+
+    def test_get_is_retried_on_reused_connection(self):
+        self.prime()
+        response = self.request(self.url + '/again', {'method': 'GET', 'headers': []})
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(response['body'].read(), 'ok')
+        self.assertEqual(self.server.requests, [
+            ('GET', '/first'), ('GET', '/again'), ('GET', '/again')])
+
+    def test_post_is_not_resent(self):
+        self.prime()
+        self.assertRaises(httplib.BadStatusLine, self.request,
+                          self.url + '/submit', {'method': 'POST', 'headers': [], 'body': 'x=1'})
+        self.assertEqual(self.server.requests, [
+            ('GET', '/first'), ('POST', '/submit')])
+
+class SharedSessionTest(unittest.TestCase):
+    def test_unicode_password(self):
+        session = binding._shared_session('https', 'localhost', 8089, 'admin', u'p\xe4ssw\xf6rd')
+        self.assertIs(binding._shared_session('https', 'localhost', 8089, 'admin', u'p\xe4ssw\xf6rd'), session)
+        self.assertIs(binding._shared_session('https', 'localhost', 8089, 'admin', u'p\xe4ssw\xf6rd'.encode('utf-8')), session)
+        self.assertIsNot(binding._shared_session('https', 'localhost', 8089, 'admin', 'password'), session)
+
+if __name__ == '__main__':
+    unittest.main()
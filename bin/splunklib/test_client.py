@@ -0,0 +1,159 @@
+from StringIO import StringIO
+import json
+import threading
+import time
+import unittest
+
+import client
+import data
+
+FEED = '''<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:s="http://dev.splunk.com/ns/rest">
+  %s
+</feed>'''
+
+ENTRY = '''<entry>
+    <title>%(name)s</title>
+    <id>https://localhost:8089/servicesNS/%(owner)s/%(app)s/saved/searches/%(name)s</id>
+    <updated>2016-01-01T00:00:00+00:00</updated>
+    <link href="/servicesNS/%(owner)s/%(app)s/saved/searches/%(name)s" rel="alternate"/>
+    <author><name>%(owner)s</name></author>
+    <content type="text/xml">
+      <s:dict>
+        <s:key name="search">%(search)s</s:key>
+        <s:key name="eai:acl">
+          <s:dict>
+            <s:key name="app">%(app)s</s:key>
+            <s:key name="owner">%(owner)s</s:key>
+            <s:key name="sharing">user</s:key>
+            <s:key name="perms"><s:dict><s:key name="read"><s:list><s:item>*</s:item></s:list></s:key></s:dict></s:key>
+          </s:dict>
+        </s:key>
+        <s:key name="eai:attributes">
+          <s:dict>
+            <s:key name="optionalFields"><s:list><s:item>description</s:item></s:list></s:key>
+            <s:key name="requiredFields"><s:list><s:item>search</s:item></s:list></s:key>
+            <s:key name="wildcardFields"><s:list><s:item>action\..*</s:item></s:list></s:key>
+          </s:dict>
+        </s:key>
+        <s:key name="dispatch">
+          <s:dict>
+            <s:key name="earliest_time">-1h</s:key>
+            <s:key name="latest_time">now</s:key>
+          </s:dict>
+        </s:key>
+      </s:dict>
+    </content>
+  </entry>'''
+
+class StubSplunkd(object):
+    """A handler answering every GET with the same feed and recording the
+    requests made."""
+    def __init__(self, *entries):
+        self.body = FEED % ''.join(ENTRY % entry for entry in entries)
+        self.requests = []
+
+    def __call__(self, url, message, **kwargs):
+        self.requests.append((message['method'], url))
+        return {
+            'status': 200,
+            'reason': 'OK',
+            'headers': [('content-type', 'text/xml; charset=utf-8')],
+            'body': StringIO(self.body),
+        }
+
+def service(handler):
+    return client.Service(handler=handler, token='Splunk token', cache_ttl=60)
+
+class StateCacheTest(unittest.TestCase):
+    def test_open_after_list_hits_cache(self):
+        splunkd = StubSplunkd(dict(name='errors', owner='admin', app='search', search='error'))
+        s = service(splunkd)
+        [listed] = s.saved_searches.list()
+        self.assertEqual(len(splunkd.requests), 1)
+        opened = client.SavedSearch(s, 'saved/searches/errors')
+        self.assertEqual(len(splunkd.requests), 1)
+        self.assertEqual(opened['search'], 'error')
+        self.assertEqual(opened.access.owner, 'admin')
+        self.assertEqual(len(s.cache._states), 1)
+
+    def test_ambiguous_listing_is_not_cached(self):
+        splunkd = StubSplunkd(dict(name='errors', owner='admin', app='search', search='error'),
+                              dict(name='errors', owner='boris', app='search', search='failure'))
+        s = service(splunkd)
+        self.assertEqual(len(s.saved_searches.list()), 2)
+        self.assertEqual(s.cache.get(s._abspath('saved/searches/errors')), None)
+
+    def test_delete_drops_cached_state(self):
+        splunkd = StubSplunkd(dict(name='errors', owner='admin', app='search', search='error'))
+        s = service(splunkd)
+        s.saved_searches.list()
+        s.saved_searches.delete('errors')
+        self.assertEqual(s.cache.get(s._abspath('saved/searches/errors')), None)
+
+class EntityStateTest(unittest.TestCase):
+    def test_listed_state_is_loaded(self):
+        splunkd = StubSplunkd(dict(name='errors', owner='admin', app='search', search='error'))
+        [listed] = client.Service(handler=splunkd, token='Splunk token').saved_searches.list()
+        access = json.loads(json.dumps(listed.access))
+        self.assertEqual(access['owner'], 'admin')
+        self.assertEqual(access['perms'], {'read': ['*']})
+        self.assertEqual(dict(listed.fields), {
+            'required': ['search'], 'optional': ['description'], 'wildcard': ['action\\..*']})
+        content = json.loads(json.dumps(listed.content))
+        self.assertEqual(content['dispatch'], {'earliest_time': '-1h', 'latest_time': 'now'})
+
+    def test_listed_state_is_lazy(self):
+        splunkd = StubSplunkd(dict(name='errors', owner='admin', app='search', search='error'))
+        [listed] = client.Service(handler=splunkd, token='Splunk token').saved_searches.list()
+        self.assertEqual(listed.name, 'errors')
+        # Nested records aren't parsed until the content is read
+        dispatch = listed.state.content['dispatch']
+        self.assertIsInstance(dispatch, data.LazyRecord)
+        self.assertEqual(dict.__len__(dispatch), 0)
+        self.assertEqual(dict(listed.content['dispatch']), {'earliest_time': '-1h', 'latest_time': 'now'})
+
+class StalledStream(object):
+    """An export stream which sends *body* and then waits until it's closed,
+    like a slice whose search hasn't found anything yet."""
+    def __init__(self, body):
+        self.body = body
+        self.closed = threading.Event()
+
+    def read(self, size=None):
+        if self.body:
+            body, self.body = self.body, ''
+            return body
+        self.closed.wait(5)
+        return ''
+
+    def close(self):
+        self.closed.set()
+
+class ExportParallelTest(unittest.TestCase):
+    def test_time_slices(self):
+        self.assertEqual(client._time_slices(0, 100, 4), [(0, 25), (25, 50), (50, 75), (75, 100)])
+        self.assertEqual(client._time_slices(10, 100, 4, span=30), [(10, 30), (30, 60), (60, 100)])
+        self.assertRaises(ValueError, client._time_slices, 0, 86400 * 7, 4, 86400)
+
+    def test_stopping_closes_streams(self):
+        streams = []
+        def export(query, **params):
+            streams.append(StalledStream('{"preview":false,"result":{"n":"1"}}\n'))
+            return streams[-1]
+        jobs = client.Jobs.__new__(client.Jobs)
+        jobs.export = export
+        merged = jobs.export_parallel('search *', 0, 100, slices=2, ordered=False)
+        self.assertEqual(merged.next(), {'n': '1'})
+        merged.close()
+        # A slice which only starts its export now closes it itself
+        for x in range(50):
+            if len(streams) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(streams), 2)
+        for stream in streams:
+            self.assertTrue(stream.closed.wait(1))
+
+if __name__ == '__main__':
+    unittest.main()
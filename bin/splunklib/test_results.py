@@ -0,0 +1,104 @@
+import json
+import unittest
+
+import results
+
+class Pieces(object):
+    """A stream which returns at most one of the given pieces per read, like
+    a socket returning what has arrived so far."""
+    def __init__(self, *pieces):
+        self.pieces = list(pieces)
+
+    def read(self, n=None):
+        if n is None:
+            data, self.pieces = ''.join(self.pieces), []
+            return data
+        if not self.pieces:
+            return ''
+        piece = self.pieces.pop(0)
+        if len(piece) > n:
+            self.pieces.insert(0, piece[n:])
+        return piece[:n]
+
+def pieces(text, size):
+    return Pieces(*[text[x:x+size] for x in range(0, len(text), size)])
+
+RESULTS = {
+    'preview': False,
+    'messages': [{'type': 'INFO', 'text': 'Your timerange was substituted'}],
+    'results': [{'host': 'web01', 'count': '3'}, {'host': 'web02', 'count': ['1', '2']}],
+}
+
+class JSONResultsReaderTest(unittest.TestCase):
+    def read(self, stream, chunk_size=65536):
+        reader = results.JSONResultsReader(stream, chunk_size)
+        return (list(reader), reader.is_preview)
+
+    def expected(self):
+        return [results.Message('INFO', 'Your timerange was substituted')] + RESULTS['results']
+
+    def test_export_lines(self):
+        body = ''.join(json.dumps(doc) + '\n' for doc in (
+            {'preview': True, 'offset': 0, 'result': {'host': 'web01'}},
+            {'preview': True, 'offset': 1, 'result': {'host': 'web02'}, 'lastrow': True}))
+        for size in (1, 7, len(body)):
+            self.assertEqual(self.read(pieces(body, size), size),
+                             ([{'host': 'web01'}, {'host': 'web02'}], True))
+
+    def test_results_object(self):
+        body = json.dumps(RESULTS)
+        for size in (5, len(body)):
+            self.assertEqual(self.read(pieces(body, size), size), (self.expected(), False))
+
+    def test_pretty_printed(self):
+        body = json.dumps(RESULTS, indent=2) + '\n'
+        for size in (1, 16, len(body)):
+            self.assertEqual(self.read(pieces(body, size), size), (self.expected(), False))
+
+    def test_pretty_printed_documents(self):
+        body = json.dumps({'result': {'n': '1'}}, indent=2) + json.dumps({'result': {'n': '2'}}, indent=2)
+        self.assertEqual(self.read(pieces(body, 8), 8), ([{'n': '1'}, {'n': '2'}], None))
+
+    def test_truncated(self):
+        body = json.dumps(RESULTS, indent=2)[:-10]
+        self.assertRaises(ValueError, self.read, pieces(body, 16), 16)
+
+class XMLDTDFilterTest(unittest.TestCase):
+    def read(self, stream, n=None):
+        stream = results._XMLDTDFilter(stream)
+        out = []
+        while True:
+            data = stream.read(n)
+            if not data:
+                return ''.join(out)
+            out.append(data)
+
+    def test_whole(self):
+        self.assertEqual(self.read(Pieces('<?xml abcd><element><?xml ...></element>')), '<element></element>')
+
+    def test_split_across_reads(self):
+        body = '<?xml version="1.0" encoding="UTF-8"?>\n<results preview="0"><?xml-stylesheet x?><r/></results>'
+        for size in range(1, 12):
+            self.assertEqual(self.read(pieces(body, size), size), '\n<results preview="0"><r/></results>')
+
+    def test_read_of_only_dtd(self):
+        stream = results._XMLDTDFilter(Pieces('<?xml', ' version="1.0"?>', '<r/>'))
+        self.assertEqual(stream.read(5), '<r/>')
+
+    def test_trailing_angle_bracket(self):
+        self.assertEqual(self.read(Pieces('a<', 'b>', '<')), 'a<b><')
+
+class ConcatenatedStreamTest(unittest.TestCase):
+    def test_read_all(self):
+        stream = results._ConcatenatedStream(Pieces('abc', 'de'), Pieces(), Pieces('f'))
+        self.assertEqual(stream.read(), 'abcdef')
+        self.assertEqual(stream.read(), '')
+
+    def test_short_reads(self):
+        stream = results._ConcatenatedStream(Pieces('ab', 'c'), Pieces('def'))
+        self.assertEqual(stream.read(4), 'abcd')
+        self.assertEqual(stream.read(4), 'ef')
+        self.assertEqual(stream.read(4), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import json
+import unittest
+
+try:
+    # Needs CherryPy and Splunk's own python modules
+    import cherrypy_webserver
+except ImportError:
+    cherrypy_webserver = None
+
+def inflight():
+    return cherrypy_webserver.metrics._merge()[0].get(('influx_requests_inflight', ()), 0)
+
+def failing_chunks(sent):
+    for chunk in sent:
+        yield chunk
+    raise RuntimeError('search failed')
+
+@unittest.skipIf(cherrypy_webserver is None, 'cherrypy_webserver needs CherryPy and Splunk')
+class StreamingTest(unittest.TestCase):
+    def test_error_before_any_chunk(self):
+        body = list(cherrypy_webserver.query_body(failing_chunks([ ])))
+        self.assertEqual([ json.loads(chunk) for chunk in body ], [ { 'error': 'search failed' } ])
+
+    def test_error_part_way(self):
+        body = ''.join(cherrypy_webserver.query_body(failing_chunks([ '{"results":[' ])))
+        self.assertEqual(body, '{"results":[\n{"error":"search failed"}')
+
+    def test_streamed_body_closed_unstarted(self):
+        closed = [ ]
+        chunks = failing_chunks([ 'x' ])
+        body = cherrypy_webserver.StreamedBody(chunks, lambda: closed.append(True))
+        body.close()
+        body.close()
+        self.assertEqual(closed, [ True ])
+        self.assertRaises(StopIteration, next, chunks)
+
+    def test_handler_in_flight_until_closed(self):
+        @cherrypy_webserver.HandleRequest([ 'GET' ])
+        def handler(environ, start_response):
+            start_response('200 OK', [ ])
+            yield 'chunk'
+        before = inflight()
+        body = handler({ 'REQUEST_METHOD': 'GET' }, lambda status, headers: None)
+        self.assertEqual(inflight(), before + 1)
+        self.assertEqual(list(body), [ 'chunk' ])
+        body.close()
+        self.assertEqual(inflight(), before)
+
+if __name__ == '__main__':
+    unittest.main()
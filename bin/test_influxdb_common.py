@@ -0,0 +1,109 @@
+import copy
+import json
+import pickle
+import unittest
+
+import influxdb_common
+import influxdb_metrics
+
+class FrozenTagsTest(unittest.TestCase):
+    def setUp(self):
+        self.tags = influxdb_common.FrozenTags({ 'host': 'server01', 'region': 'us-west' })
+
+    def test_copy(self):
+        for tags in (copy.copy(self.tags), copy.deepcopy(self.tags), copy.deepcopy({ 'tags': self.tags })['tags']):
+            self.assertIsInstance(tags, influxdb_common.FrozenTags)
+            self.assertEqual(tags, self.tags)
+            self.assertEqual(hash(tags), hash(self.tags))
+
+    def test_pickle(self):
+        for protocol in (0, 1, 2):
+            tags = pickle.loads(pickle.dumps(self.tags, protocol))
+            self.assertIsInstance(tags, influxdb_common.FrozenTags)
+            self.assertEqual(tags, self.tags)
+            self.assertEqual(hash(tags), hash(self.tags))
+            self.assertRaises(TypeError, tags.__setitem__, 'host', 'server02')
+
+class TimestampsTest(unittest.TestCase):
+    def check_overflow(self):
+        convert = influxdb_common._timestamps_ns
+        self.assertEqual(list(convert([ 1435362189, None ], None, 7, False)), [ 1435362189000000000, 7 ])
+        self.assertEqual(list(convert([ -2**63 ], 'n', 7, False)), [ -2**63 ])
+        for (timestamps, precision) in (([ 10**11 ], None), ([ 10**11 ], 's'), ([ 2**63 ], None), ([ -2**63 ], 'u')):
+            self.assertRaises(ValueError, convert, timestamps, precision, 0, False)
+
+    @unittest.skipIf(influxdb_common.numpy is None, 'numpy is not installed')
+    def test_overflow_numpy(self):
+        self.check_overflow()
+
+    def test_overflow_array(self):
+        saved = influxdb_common.numpy
+        influxdb_common.numpy = None
+        try:
+            self.check_overflow()
+        finally:
+            influxdb_common.numpy = saved
+
+class SpreadTest(unittest.TestCase):
+    def check_matches(self):
+        body = 'cpu value=1\ncpu value=2 1435362189\ncpu value=3\ncpu value=4\n'
+        for received in (1435362189.575692, 1435362190.1, 1435362190.000001):
+            for spread in (False, True):
+                points = influxdb_common.parse_influx(body, points=True, received=received, spread=spread)
+                batch = influxdb_common.parse_influx_columnar(body, received=received, spread=spread)
+                self.assertEqual([ long(round(p.timestamp*10**6))*1000 for p in points ], list(batch.timestamps))
+        # Only the lines without a timestamp step
+        self.assertEqual(batch.timestamps[3] - batch.timestamps[0], 2*influxdb_common.SPREAD_STEP_NS)
+
+    @unittest.skipIf(influxdb_common.numpy is None, 'numpy is not installed')
+    def test_matches_numpy(self):
+        self.check_matches()
+
+    def test_matches_array(self):
+        saved = influxdb_common.numpy
+        influxdb_common.numpy = None
+        try:
+            self.check_matches()
+        finally:
+            influxdb_common.numpy = saved
+
+class BlankLinesTest(unittest.TestCase):
+    def counts(self):
+        counters = influxdb_metrics._merge()[0]
+        return (counters.get(('influx_lines_received_total', ()), 0),
+                counters.get(('influx_parse_errors_total', (('type', 'no_fields'),)), 0))
+
+    def check(self, parse):
+        body = 'cpu value=1 1435362189\n\n  \ncpu value=2 1435362190\n'
+        (lines, errors) = self.counts()
+        parse(body)
+        self.assertEqual(self.counts(), (lines + 2, errors))
+
+    def test_parse_influx(self):
+        self.check(lambda body: self.assertEqual(len(influxdb_common.parse_influx(body)), 2))
+
+    def test_parse_influx_columnar(self):
+        self.check(lambda body: self.assertEqual(influxdb_common.parse_influx_columnar(body).length, 2))
+
+class HecEventsTest(unittest.TestCase):
+    def events(self, body):
+        decoder = json.JSONDecoder()
+        (events, x) = ([ ], 0)
+        while x < len(body):
+            (event, x) = decoder.raw_decode(body, x)
+            events.append(event)
+        return events
+
+    def test_matches_as_dict(self):
+        tags = influxdb_common.FrozenTags({ 'host': 'server01', 'path': '/var/"log" 100%' })
+        points = [ influxdb_common.Point('cpu', tags, ('usage', 'count', 'ok', 'note'), (0.1, 3, True, 'a, "b" %s'), 1435362189.575692),
+                   influxdb_common.Point('cpu', tags, ('usage', 'count', 'ok', 'note'), (float('nan'), 2**70, False, u'\xe9'), 1435362190),
+                   influxdb_common.Point('mem', influxdb_common.FrozenTags(), ('100%',), (1e300,), 1435362191.0),
+                   influxdb_common.Point('odd', tags, ('timestamp', 'tags'), (1, 2), 1435362192.0) ]
+        expected = [ { 'index': 'metrics', 'sourcetype': 'influx', 'time': p.timestamp, 'event': p.as_dict() } for p in points ]
+        actual = self.events(influxdb_common.hec_events(points, 'metrics', 'influx'))
+        # NaN never equals itself, so compare its JSON
+        self.assertEqual(json.dumps(actual, sort_keys=True), json.dumps(expected, sort_keys=True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import threading
+import unittest
+
+import influxdb_metrics as metrics
+
+metrics.counter('test_events_total', 'Events counted by the tests')
+metrics.histogram('test_seconds', 'Durations observed by the tests', (0.1, 1.0))
+metrics.histogram('test_retired_seconds', 'Durations observed by exited threads', (0.1, 1.0))
+
+class MetricsTest(unittest.TestCase):
+    def lines(self, name):
+        return [ line for line in metrics.render().splitlines() if line.startswith(name) ]
+
+    def test_counters_merge_across_threads(self):
+        before = metrics._merge()[0].get(('test_events_total', (('kind', 'a'),)), 0)
+        def count():
+            for x in range(1000):
+                metrics.inc('test_events_total', labels=(('kind', 'a'),))
+        threads = [ threading.Thread(target=count) for x in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIn('test_events_total{kind="a"} %d' % (before + 4000), self.lines('test_events_total'))
+
+    def test_exited_threads_are_retired(self):
+        before = metrics._merge()
+        def record():
+            metrics.inc('test_events_total', labels=(('kind', 'b'),))
+            metrics.observe('test_retired_seconds', 0.5)
+        for x in range(500):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+        self.assertLess(len(metrics._shards), 10)
+        (counters, histograms) = metrics._merge()
+        self.assertEqual(counters[('test_events_total', (('kind', 'b'),))],
+                         before[0].get(('test_events_total', (('kind', 'b'),)), 0) + 500)
+        self.assertEqual(histograms[('test_retired_seconds', ())][-1],
+                         before[1].get(('test_retired_seconds', ()), [ 0 ])[-1] + 500)
+
+    def test_histogram_buckets_are_cumulative(self):
+        for value in (0.05, 0.5, 0.5, 5.0):
+            metrics.observe('test_seconds', value, (('stage', 'parse'),))
+        self.assertEqual(self.lines('test_seconds'), [
+            'test_seconds_bucket{stage="parse",le="0.1"} 1',
+            'test_seconds_bucket{stage="parse",le="1.0"} 3',
+            'test_seconds_bucket{stage="parse",le="+Inf"} 4',
+            'test_seconds_sum{stage="parse"} 6.05',
+            'test_seconds_count{stage="parse"} 4' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import unittest
+
+import influxdb_query
+
+class ParseSelectTest(unittest.TestCase):
+    def test_regex(self):
+        query = influxdb_query.parse_select('SELECT value FROM cpu WHERE host =~ /^server0[12]$/')
+        self.assertEqual(query['measurement'], 'cpu')
+
+    def test_invalid_regex(self):
+        for regex in ('/[/', '/(/', '/a**/'):
+            self.assertRaises(influxdb_query.QueryError, influxdb_query.parse_select,
+                              'SELECT value FROM cpu WHERE host =~ %s' % regex)
+
+    def test_group_by_time(self):
+        query = influxdb_query.parse_select('SELECT mean(value) FROM cpu WHERE time > now() - 1h GROUP BY time(10s)')
+        self.assertEqual(query['interval'], 10)
+
+    def test_group_by_nonpositive_time(self):
+        for interval in ('0s', '0ns', '-10s'):
+            self.assertRaises(influxdb_query.QueryError, influxdb_query.parse_select,
+                              'SELECT mean(value) FROM cpu WHERE time > now() - 1h GROUP BY time(%s)' % interval)
+
+class CreateDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (list(influxdb_query._databases), influxdb_query.MAX_DATABASES)
+
+    def tearDown(self):
+        (influxdb_query._databases[:], influxdb_query.MAX_DATABASES) = self.saved
+        influxdb_query._encode_canned()
+        influxdb_query._responses.resize(influxdb_query._responses.size)
+
+    def databases(self):
+        result = json.loads(influxdb_query.query_response('SHOW DATABASES'))
+        return [ row[0] for row in result['results'][0]['series'][0]['values'] ]
+
+    def test_create_database_is_capped(self):
+        influxdb_query._databases[:] = [ 'telegraf' ]
+        influxdb_query.MAX_DATABASES = 2
+        for x in range(5):
+            influxdb_query.query_response('CREATE DATABASE "db%d"' % x)
+        self.assertEqual(self.databases(), [ 'telegraf', 'db0' ])
+
+if __name__ == '__main__':
+    unittest.main()
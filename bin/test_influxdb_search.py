@@ -0,0 +1,161 @@
+import threading
+import time
+import unittest
+
+import influxdb_metrics as metrics
+import influxdb_query
+import influxdb_search
+
+def coalesced():
+    return metrics._merge()[0].get(('influx_query_coalesced_total', ()), 0)
+
+class QueryChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (influxdb_search.searches, influxdb_search._respond)
+        influxdb_search.searches = lambda q: True
+
+    def tearDown(self):
+        (influxdb_search.searches, influxdb_search._respond) = self.saved
+
+    def test_waiters_run_together_after_failure(self):
+        release = threading.Event()
+        together = threading.Event()
+        entered = [ ]
+        lock = threading.Lock()
+        def respond(q, epoch):
+            with lock:
+                entered.append(q)
+                n = len(entered)
+            if n == 1:
+                release.wait(5)
+                raise RuntimeError('search failed')
+            if n == 4:
+                together.set()
+            # Waiters run one at a time would each time out here
+            together.wait(2)
+            yield 'ok'
+        influxdb_search._respond = respond
+
+        results = { }
+        def run(name):
+            try:
+                results[name] = list(influxdb_search.query_chunks('SELECT value FROM together'))
+            except RuntimeError as e:
+                results[name] = str(e)
+        before = coalesced()
+        leader = threading.Thread(target=run, args=('leader',))
+        leader.start()
+        while not entered:
+            time.sleep(0.001)
+        waiters = [ threading.Thread(target=run, args=(x,)) for x in range(3) ]
+        for waiter in waiters:
+            waiter.start()
+        while coalesced() < before + 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in [ leader ] + waiters:
+            thread.join()
+
+        self.assertTrue(together.is_set())
+        self.assertEqual(results, { 'leader': 'search failed', 0: [ 'ok' ], 1: [ 'ok' ], 2: [ 'ok' ] })
+
+# (statement, mode, spl, keys, tag fields)
+TRANSLATIONS = [
+    ("SELECT value FROM cpu WHERE host = 'a' LIMIT 5", 'stats',
+     'search index="metrics" sourcetype="influx" tags.host="a" | fields _time cpu'
+     ' | eval influx_time=_time | sort 0 influx_time | head 5',
+     [ 'cpu' ], [ ]),
+    ("SELECT mean(value), max(usage) FROM cpu WHERE host = 'a' AND region != 'west' AND time > now() - 1h GROUP BY time(10s), host", 'stats',
+     'search index="metrics" sourcetype="influx" (tags.host="a" NOT tags.region="west") | bin _time span=10s'
+     ' | stats avg(cpu) AS c0, max(cpu.usage) AS c1 by tags.host _time | eval influx_time=_time | sort 0 tags.host influx_time',
+     [ 'c0', 'c1' ], [ 'tags.host' ]),
+    ("SELECT mean(value), max(usage) FROM cpu WHERE host = 'a' AND region != 'west' AND time > now() - 1h GROUP BY time(10s), host", 'tstats',
+     '| tstats avg(cpu) AS c0, max(cpu.usage) AS c1 WHERE index="metrics" sourcetype="influx" (tags.host="a" NOT tags.region="west")'
+     ' BY tags.host _time span=10s | eval influx_time=_time | sort 0 tags.host influx_time',
+     [ 'c0', 'c1' ], [ 'tags.host' ]),
+    ("SELECT mean(value), max(usage) FROM cpu WHERE host = 'a' AND region != 'west' AND time > now() - 1h GROUP BY time(10s), host", 'mstats',
+     '| mstats avg(cpu) AS c0, max(cpu.usage) AS c1 WHERE index="metrics" (host="a" NOT region="west")'
+     ' BY host span=10s | eval influx_time=_time | sort 0 host influx_time',
+     [ 'c0', 'c1' ], [ 'host' ]),
+    ("SELECT count(value) FROM cpu WHERE host =~ /^web/ GROUP BY host", 'stats',
+     'search index="metrics" sourcetype="influx" | where match(coalesce(\'tags.host\', ""), "^web")'
+     ' | stats count(cpu) AS c0 by tags.host | eval influx_time=_time | sort 0 tags.host influx_time',
+     [ 'c0' ], [ 'tags.host' ]),
+    ("SELECT sum(value) FROM cpu GROUP BY time(1m) ORDER BY time DESC LIMIT 3", 'stats',
+     'search index="metrics" sourcetype="influx" | bin _time span=60s | stats sum(cpu) AS c0 by _time'
+     ' | eval influx_time=_time | sort 0 -influx_time | head 3',
+     [ 'c0' ], [ ]),
+    ("SELECT sum(value) FROM cpu GROUP BY time(1m) ORDER BY time DESC LIMIT 3", 'tstats',
+     '| tstats sum(cpu) AS c0 WHERE index="metrics" sourcetype="influx" BY _time span=60s'
+     ' | eval influx_time=_time | sort 0 -influx_time | head 3',
+     [ 'c0' ], [ ]),
+    ("SELECT sum(value) FROM cpu GROUP BY time(1m) ORDER BY time DESC LIMIT 3", 'mstats',
+     '| mstats sum(cpu) AS c0 WHERE index="metrics" span=60s | eval influx_time=_time | sort 0 -influx_time | head 3',
+     [ 'c0' ], [ ]),
+    ("SELECT last(value) FROM cpu WHERE host = 'a' OR host = 'b' LIMIT 2", 'tstats',
+     '| tstats latest(cpu) AS c0 WHERE index="metrics" sourcetype="influx" (tags.host="a" OR tags.host="b")'
+     ' | eval influx_time=_time | sort 0 influx_time | head 2',
+     [ 'c0' ], [ ]),
+    ("SELECT last(value) FROM cpu WHERE host = 'a' OR host = 'b' LIMIT 2", 'mstats',
+     '| mstats latest(cpu) AS c0 WHERE index="metrics" (host="a" OR host="b") | eval influx_time=_time | sort 0 influx_time | head 2',
+     [ 'c0' ], [ ]),
+]
+
+# (statement, mode) which can't be searched
+UNSUPPORTED = [
+    ("SELECT value FROM cpu", 'tstats'),
+    ("SELECT value FROM cpu", 'mstats'),
+    ("SELECT count(value) FROM cpu WHERE host =~ /^web/", 'tstats'),
+    ("SELECT count(value) FROM cpu WHERE host =~ /^web/", 'mstats'),
+    ("SELECT * FROM cpu", 'stats'),
+    ("SELECT count(value), value FROM cpu", 'stats'),
+]
+
+class ToSplTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (influxdb_search.index, influxdb_search.sourcetype)
+        (influxdb_search.index, influxdb_search.sourcetype) = ('metrics', 'influx')
+
+    def tearDown(self):
+        (influxdb_search.index, influxdb_search.sourcetype) = self.saved
+
+    def test_translations(self):
+        for (statement, mode, spl, keys, tag_fields) in TRANSLATIONS:
+            query = influxdb_query.parse_select(statement, 1435362189)
+            self.assertEqual(influxdb_search.to_spl(query, mode), (spl, keys, tag_fields), (statement, mode))
+
+    def test_unsupported(self):
+        for (statement, mode) in UNSUPPORTED:
+            query = influxdb_query.parse_select(statement, 1435362189)
+            self.assertRaises(influxdb_query.QueryError, influxdb_search.to_spl, query, mode)
+
+class FillerTest(unittest.TestCase):
+    # mean and count over four 10s buckets from 0, with rows only in the second and third
+    ROWS = [ (10, [ 1.5, 2 ]), (20, [ None, 1 ]) ]
+    FILLED = {
+        'null': [ [ 0, None, 0 ], [ 10, 1.5, 2 ], [ 20, None, 1 ], [ 30, None, 0 ] ],
+        'none': [ [ 10, 1.5, 2 ], [ 20, None, 1 ] ],
+        'previous': [ [ 0, None, 0 ], [ 10, 1.5, 2 ], [ 20, 1.5, 1 ], [ 30, 1.5, 0 ] ],
+        7.0: [ [ 0, 7.0, 0 ], [ 10, 1.5, 2 ], [ 20, 7.0, 1 ], [ 30, 7.0, 0 ] ],
+    }
+
+    def filled(self, fill, descending=False):
+        filler = influxdb_search._Filler([ 'mean', 'count' ], fill, 0, 10, 4, descending)
+        out = [ ]
+        for (t, values) in (reversed(self.ROWS) if descending else self.ROWS):
+            out.extend(filler.rows(t, values))
+        return out + filler.finish()
+
+    def test_fills(self):
+        for (fill, expected) in self.FILLED.items():
+            self.assertEqual(self.filled(fill), expected, fill)
+
+    def test_descending(self):
+        self.assertEqual(self.filled('null', True), list(reversed(self.FILLED['null'])))
+
+    def test_no_interval(self):
+        filler = influxdb_search._Filler([ 'mean' ], 'null', 0, None, 0, False)
+        self.assertEqual(filler.rows(5, [ 1.0 ]) + filler.finish(), [ [ 5, 1.0 ] ])
+
+if __name__ == '__main__':
+    unittest.main()
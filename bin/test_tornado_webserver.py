@@ -0,0 +1,96 @@
+import socket
+import threading
+import unittest
+
+from tornado.testing import AsyncHTTPTestCase
+
+import influxdb_receiver
+import influxdb_search
+import tornado_webserver
+
+class FailingForwarder(object):
+    '''
+    A StreamForwarder whose writes all fail, calling back from another thread as the real one does
+    '''
+    def send_async(self, data, index, sourcetype, callback):
+        thread = threading.Thread(target=callback, args=(socket.error('connection reset'),))
+        thread.start()
+
+class StreamFailureTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado_webserver.make_app()
+
+    def setUp(self):
+        super(StreamFailureTest, self).setUp()
+        self.saved = dict((k, getattr(tornado_webserver, k, None)) for k in ('STREAM_FORWARDER', 'SPLUNK_INDEX', 'SPLUNK_SOURCETYPE'))
+        tornado_webserver.STREAM_FORWARDER = FailingForwarder()
+        tornado_webserver.SPLUNK_INDEX = 'metrics'
+        tornado_webserver.SPLUNK_SOURCETYPE = 'metrics'
+
+    def tearDown(self):
+        for (k, v) in self.saved.items():
+            setattr(tornado_webserver, k, v)
+        super(StreamFailureTest, self).tearDown()
+
+    def test_failed_forward_is_500(self):
+        response = self.fetch('/write?db=x', method='POST', body='cpu value=1 1435362189575692182\n')
+        self.assertEqual(response.code, 500)
+
+def failing_chunks(sent):
+    for chunk in sent:
+        yield chunk
+    raise RuntimeError('search failed')
+
+class QueryStreamTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado_webserver.make_app()
+
+    def setUp(self):
+        super(QueryStreamTest, self).setUp()
+        self.saved = (influxdb_search.searches, influxdb_search.query_chunks)
+        influxdb_search.searches = lambda q: True
+        influxdb_search.query_chunks = lambda q, epoch: failing_chunks([ '{"results":[' ])
+
+    def tearDown(self):
+        (influxdb_search.searches, influxdb_search.query_chunks) = self.saved
+        super(QueryStreamTest, self).tearDown()
+
+    def test_error_part_way(self):
+        response = self.fetch('/query?q=SELECT+value+FROM+cpu')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, '{"results":[\n{"error":"search failed"}')
+
+    def test_threads_are_bounded(self):
+        for x in range(tornado_webserver.QUERY_THREADS * 2):
+            self.fetch('/query?q=SELECT+value+FROM+cpu')
+        workers = [ t for t in threading.enumerate() if t.name.startswith('query-') ]
+        self.assertEqual(len(workers), tornado_webserver.QUERY_THREADS)
+
+class BrokenSocket(object):
+    def __init__(self):
+        self.writes = 0
+
+    def sendall(self, data):
+        self.writes += 1
+        raise socket.error('broken pipe')
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+class AttachedPoolTest(unittest.TestCase):
+    def test_failed_write_is_not_resent(self):
+        pool = influxdb_receiver.AttachedPool(None, 'main', 'metrics')
+        sockets = [ ]
+        def attach():
+            sockets.append(BrokenSocket())
+            return sockets[-1]
+        pool._attach = attach
+        self.assertRaises(socket.error, pool.send, 'event\n')
+        self.assertEqual([ s.writes for s in sockets ], [ 1 ])
+        self.assertEqual(pool.idle(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,21 @@
 import tornado.ioloop
 import tornado.web
 import tornado.httpclient
+import tornado.stack_context
+from tornado.log import app_log
 import os
-from influxdb_common import parse_influx
+from influxdb_common import parse_influx, hec_events, PRECISIONS
+import influxdb_metrics as metrics
+import influxdb_query
+import influxdb_receiver
+import influxdb_search
+import influxdb_store
+import influxdb_trace
 import json
+import Queue
 import random
+import threading
+import time
 
 """Configured via environment variables:
     
@@ -13,45 +24,237 @@ import random
     SPLUNK_URLS: (Optional) Overrides SPLUNK_URL, takes a JSON formatted list of urls for Splunk hosts which will be load balanced across.
     SPLUNK_TOKEN: Auth token for Splunk's HTTP Event Collector
     SPLUNK_INDEX: Index to send Splunk Events
-    SPLUNK_SOURCETYPE: Sourcetype for Splunk Events"""
-    
+    SPLUNK_SOURCETYPE: Sourcetype for Splunk Events
+    INFLUX_FORWARD: (Optional) hec (default) to send to SPLUNK_URL, or stream to write to splunkd's streaming receiver
+        through influxdb_receiver, connecting with influxdb_search's SPLUNK_SEARCH_URL settings
+    INFLUX_QUERY_THREADS: (Optional) Threads streaming /query searches, later ones queue, default 8
+
+/query is answered by influxdb_query, influxdb_store and influxdb_search, which have their own settings."""
+
+LOOP_LAG_INTERVAL = 0.5
+
+# influxdb_receiver.StreamForwarder when INFLUX_FORWARD is stream
+STREAM_FORWARDER = None
+
+QUERY_THREADS = int(os.environ.get('INFLUX_QUERY_THREADS', 8))
+# Searches waiting for a query thread, the threads are started by the first search
+_query_queue = None
+_query_lock = threading.Lock()
+
+def _run_query(work):
+    '''
+    Hand work to one of QUERY_THREADS threads, since splunklib blocks
+    '''
+    global _query_queue
+    if _query_queue is None:
+        with _query_lock:
+            if _query_queue is None:
+                queue = Queue.Queue()
+                for x in xrange(QUERY_THREADS):
+                    worker = threading.Thread(target=_query_worker, args=(queue,), name='query-%d' % x)
+                    worker.daemon = True
+                    worker.start()
+                _query_queue = queue
+    _query_queue.put(work)
+
+def _query_worker(queue):
+    while True:
+        work = queue.get()
+        try:
+            work()
+        except Exception:
+            app_log.exception('Query thread failed')
+
+class InstrumentedHandler(tornado.web.RequestHandler):
+    '''
+    Counts finished requests by handler and status code for /metrics
+    '''
+    metrics_name = 'unknown'
+
+    def set_default_headers(self):
+        for (k, v) in influxdb_query.HEADERS:
+            self.set_header(k, v)
+
+    def on_finish(self):
+        metrics.inc('influx_http_requests_total', labels=(('handler', self.metrics_name), ('code', str(self.get_status()))))
+
+
+class WriteHandler(InstrumentedHandler):
+    metrics_name = 'write'
 
-class WriteHandler(tornado.web.RequestHandler):
     @tornado.web.asynchronous
     def post(self):
-        out = parse_influx(self.request.body)
-        sendstr = ""
-        for x in out:
-            send = { }
-            send['index'] = SPLUNK_INDEX
-            send['sourcetype'] = SPLUNK_SOURCETYPE
-            send['time'] = x['timestamp']
-            send['event'] = x
-            line = json.dumps(send)
-            sendstr += line
+        received = time.time()
+        metrics.inc('influx_requests_inflight')
+        self.inflight = True
+        metrics.observe('influx_http_request_body_bytes', len(self.request.body))
+        self.trace = trace = influxdb_trace.start()
+        if trace: trace.add('receive', self.request.request_time())
+        precision = self.get_argument('precision', None)
+        if precision is not None and precision not in PRECISIONS:
+            raise tornado.web.HTTPError(400, 'unknown precision %s', precision)
+        out = parse_influx(self.request.body, trace, points=True, precision=precision, received=received)
+        if influxdb_store.store is not None:
+            influxdb_store.store.add(out)
+        if STREAM_FORWARDER is not None:
+            self.stream(out)
+            return
+        sendstr = hec_events(out, SPLUNK_INDEX, SPLUNK_SOURCETYPE)
+        if trace: trace.stamp('serialize')
         http = tornado.httpclient.AsyncHTTPClient()
         
         if 'SPLUNK_URLS' in globals():
             url = random.choice(SPLUNK_URLS)
         else:
             url = SPLUNK_URL
-            
+        
+        self.target = url
+        self.forward_start = time.time()
+        metrics.inc('influx_forwards_inflight')
         http.fetch(url, headers={ 'Authorization': 'Splunk %s' % SPLUNK_TOKEN },
                    method="POST", body=sendstr, callback=self.on_response, validate_cert=False)
+        if trace: trace.stamp('enqueue')
+
+    def stream(self, points):
+        data = influxdb_receiver.serialize(points)
+        if self.trace: self.trace.stamp('serialize')
+        self.target = 'stream'
+        self.forward_start = time.time()
+        metrics.inc('influx_forwards_inflight')
+        loop = tornado.ioloop.IOLoop.current()
+        # The callback runs from a forwarder thread, wrapping it here keeps this request's
+        # stack context so an error raised in on_streamed is sent to the client
+        on_streamed = tornado.stack_context.wrap(self.on_streamed)
+        STREAM_FORWARDER.send_async(data, SPLUNK_INDEX, SPLUNK_SOURCETYPE,
+                                    lambda error: loop.add_callback(on_streamed, error))
+        if self.trace: self.trace.stamp('enqueue')
+
+    def on_streamed(self, error):
+        if self.trace: self.trace.stamp('forward')
+        metrics.dec('influx_forwards_inflight')
+        metrics.observe('influx_forward_seconds', time.time() - self.forward_start, (('target', self.target),))
+        if error is not None:
+            metrics.inc('influx_forward_errors_total', labels=(('target', self.target),))
+            raise tornado.web.HTTPError(500, 'streaming to Splunk failed: %s', error)
+        self.set_status(204, "No Content")
+        self.finish()
 
     def on_response(self, response):
-        if response.error: raise tornado.web.HTTPError(500)
+        if self.trace: self.trace.stamp('forward')
+        metrics.dec('influx_forwards_inflight')
+        metrics.observe('influx_forward_seconds', time.time() - self.forward_start, (('target', self.target),))
+        if response.error:
+            metrics.inc('influx_forward_errors_total', labels=(('target', self.target),))
+            raise tornado.web.HTTPError(500)
         self.set_status(204, "No Content")
         self.finish()
 
-class QueryHandler(tornado.web.RequestHandler):
+    def on_finish(self):
+        if getattr(self, 'inflight', False):
+            metrics.dec('influx_requests_inflight')
+            self.inflight = False
+        trace = getattr(self, 'trace', None)
+        if trace:
+            trace.stamp('ack')
+            trace.finish()
+        super(WriteHandler, self).on_finish()
+
+class QueryHandler(InstrumentedHandler):
+    metrics_name = 'query'
+
+    @tornado.web.asynchronous
     def get(self):
-        self.write({ 'results': [ ] })
+        self.set_header('Content-Type', 'application/json')
+        q = self.get_argument('q', '')
+        epoch = self.get_argument('epoch', None)
+        if not influxdb_search.searches(q):
+            self.finish(influxdb_query.query_response(q, epoch))
+            return
+        # splunklib blocks, so searches stream from a query thread a chunk at a time, waiting
+        # for each chunk to be flushed to the client before producing the next
+        self.loop = tornado.ioloop.IOLoop.current()
+        self.closed = False
+        self.flushed = threading.Event()
+        chunks = influxdb_search.query_chunks(q, epoch)
+        _run_query(lambda: self.stream(chunks))
+
+    post = get
+
+    def stream(self, chunks):
+        body = influxdb_search.query_body(chunks, app_log)
+        try:
+            for chunk in body:
+                if self.closed:
+                    break
+                self.flushed.clear()
+                self.loop.add_callback(self.write_chunk, chunk)
+                self.flushed.wait()
+        finally:
+            body.close()
+            self.loop.add_callback(self.finish_stream)
+
+    def write_chunk(self, chunk):
+        if self.closed:
+            self.flushed.set()
+            return
+        self.write(chunk)
+        self.flush(callback=self.flushed.set)
+
+    def finish_stream(self):
+        if not self.closed:
+            self.finish()
+
+    def on_connection_close(self):
+        self.closed = True
+        if hasattr(self, 'flushed'):
+            self.flushed.set()
+
+class PingHandler(InstrumentedHandler):
+    metrics_name = 'ping'
+
+    def get(self):
+        if self.get_argument('verbose', '') in ('true', '1'):
+            self.set_header('Content-Type', 'application/json')
+            self.write(influxdb_query.PING_VERBOSE)
+        else:
+            self.set_status(204)
+
+    head = get
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', metrics.CONTENT_TYPE)
+        self.write(metrics.render())
+
+def _forward_queue_depth():
+    '''
+    Requests waiting on a free connection in the shared AsyncHTTPClient
+    '''
+    return len(getattr(tornado.httpclient.AsyncHTTPClient(), 'queue', ()))
+
+def _measure_loop_lag(expected):
+    '''
+    Reschedules itself every LOOP_LAG_INTERVAL, how late it fires is the event loop lag
+    '''
+    loop = tornado.ioloop.IOLoop.current()
+    now = loop.time()
+    lag = max(now - expected, 0.0)
+    metrics.set_gauge('influx_event_loop_lag_seconds', lag)
+    metrics.observe('influx_event_loop_lag_seconds_hist', lag)
+    deadline = now + LOOP_LAG_INTERVAL
+    loop.call_at(deadline, _measure_loop_lag, deadline)
+
+metrics.gauge('influx_forward_queued', 'Forwards queued in the HTTP client waiting for a connection', _forward_queue_depth)
+metrics.gauge('influx_event_loop_lag_seconds', 'Most recent IOLoop scheduling delay')
+metrics.gauge('influx_queries_queued', 'Searches waiting for a query thread', lambda: _query_queue.qsize() if _query_queue else 0)
+metrics.histogram('influx_event_loop_lag_seconds_hist', 'IOLoop scheduling delay')
 
 def make_app():
     return tornado.web.Application([
         (r"/write", WriteHandler),
-        (r"/query", QueryHandler)
+        (r"/query", QueryHandler),
+        (r"/ping", PingHandler),
+        (r"/metrics", MetricsHandler)
     ])
 
 if __name__ == "__main__":
@@ -60,20 +263,30 @@ if __name__ == "__main__":
     globals()['SPLUNK_INDEX'] = "metrics" if 'SPLUNK_INDEX' not in os.environ else os.environ['SPLUNK_INDEX']
     globals()['SPLUNK_SOURCETYPE'] = "metrics" if 'SPLUNK_SOURCETYPE' not in os.environ else os.environ['SPLUNK_SOURCETYPE']
         
-    if 'SPLUNK_URLS' in os.environ:
-        globals()['SPLUNK_URLS'] = tornado.escape.json_decode(os.environ['SPLUNK_URLS'])
-    elif 'SPLUNK_URL' in os.environ:
-        globals()['SPLUNK_URL'] = os.environ['SPLUNK_URL']
+    if os.environ.get('INFLUX_FORWARD', 'hec') == 'stream':
+        service = influxdb_search.connect_from_environment()
+        if service is None:
+            print 'Cannot determine splunkd URL for streaming, set SPLUNK_SEARCH_URL'
+            exit(1)
+        globals()['STREAM_FORWARDER'] = influxdb_receiver.StreamForwarder(service)
     else:
-        print 'Cannot determine Splunk URL'
-        exit(1)
-        
-    if 'SPLUNK_TOKEN' not in os.environ:
-        print 'Cannot determine Splunk Token'
-        exit(1)
-    else:
-        globals()['SPLUNK_TOKEN'] = os.environ['SPLUNK_TOKEN']
+        if 'SPLUNK_URLS' in os.environ:
+            globals()['SPLUNK_URLS'] = tornado.escape.json_decode(os.environ['SPLUNK_URLS'])
+        elif 'SPLUNK_URL' in os.environ:
+            globals()['SPLUNK_URL'] = os.environ['SPLUNK_URL']
+        else:
+            print 'Cannot determine Splunk URL'
+            exit(1)
+            
+        if 'SPLUNK_TOKEN' not in os.environ:
+            print 'Cannot determine Splunk Token'
+            exit(1)
+        else:
+            globals()['SPLUNK_TOKEN'] = os.environ['SPLUNK_TOKEN']
     
     app = make_app()
     app.listen(port)
-    tornado.ioloop.IOLoop.current().start()
\ No newline at end of file
+    loop = tornado.ioloop.IOLoop.current()
+    deadline = loop.time() + LOOP_LAG_INTERVAL
+    loop.call_at(deadline, _measure_loop_lag, deadline)
+    loop.start()
\ No newline at end of file